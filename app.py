@@ -1,32 +1,55 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
+import functools
+import json
+import time
 import signal
 import sys
 import threading
 import os
 
 # --- Importar Servicios y Utilidades ---
-from services.log_service import LogService
-from services.register_service import RegisterService
-from services.connection_service import ConnectionService, ServiceError
-from services.polling_service import PollingService # Importar PollingService
+from services.log_service import LogService, RotatingFileSink
+from services.event_service import EventService, EVENT_TOPICS
+from services.connection_service import ServiceError
+from services.polling_service import MAIN_SCAN_GROUP, OVERRUN_SKIP, READ_ONCE_MAX_WAIT
+from services.device_manager import DeviceManager, DEFAULT_DEVICE
+from services.read_planner import DEFAULT_MAP
+from services.history_store import DEFAULT_SEGMENT_BYTES, DEFAULT_SEGMENT_SECONDS, DEFAULT_RETENTION_BYTES, DEFAULT_RETENTION_SECONDS, MAX_QUERY_RECORDS
+from services.register_history import MAX_HISTORY_ROWS
 from modbus_client.formatter import DataFormatter
 
 # --- Configuración de la Aplicación Flask ---
 app = Flask(__name__)
 
 # --- Inicialización Singleton de Servicios ---
-log_service = LogService()
-register_service = RegisterService(log_service=log_service)
-# PollingService necesita ser creado ANTES que ConnectionService si este último lo va a llamar
-polling_service = PollingService(log_service=log_service,
-                                 # Pasar Nones temporalmente, se setearán después
-                                 connection_service=None,
-                                 register_service=register_service)
-connection_service = ConnectionService(log_service=log_service,
-                                       register_service=register_service,
-                                       polling_service=polling_service) # Pasar polling al connection service
-# Ahora que connection_service existe, inyectarlo en polling_service
-polling_service.connection_service = connection_service
+event_service = EventService() # Cambios de estado/registros/logs para los streams SSE
+# Fichero de log opcional (rotación por tamaño y/o tiempo); lo escribe el hilo escritor del LogService
+log_file_sink = RotatingFileSink(os.environ["LOG_FILE"], max_bytes=int(os.environ.get("LOG_FILE_MAX_BYTES", 5 * 1024 * 1024)),
+                                 backup_count=int(os.environ.get("LOG_FILE_BACKUPS", 5)),
+                                 rotate_seconds=int(os.environ.get("LOG_FILE_ROTATE_SECONDS", 0))) if os.environ.get("LOG_FILE") else None
+log_service = LogService(level=os.environ.get("LOG_LEVEL", "INFO"), file_sink=log_file_sink, event_service=event_service) # DEBUG muestra frames (coste por transacción)
+# Histórico en disco opcional (HISTORY_DIR): segmentos por dispositivo con rotación y retención
+history_options = {"segment_bytes": int(os.environ.get("HISTORY_SEGMENT_BYTES", DEFAULT_SEGMENT_BYTES)), "segment_seconds": int(os.environ.get("HISTORY_SEGMENT_SECONDS", DEFAULT_SEGMENT_SECONDS)),
+                   "retention_bytes": int(os.environ.get("HISTORY_RETENTION_BYTES", DEFAULT_RETENTION_BYTES)), "retention_seconds": int(os.environ.get("HISTORY_RETENTION_SECONDS", DEFAULT_RETENTION_SECONDS))}
+# Un juego de servicios (conexión, registros, cola de escrituras, polling) por gateway
+device_manager = DeviceManager(log_service=log_service, event_service=event_service, history_dir=os.environ.get("HISTORY_DIR") or None, history_options=history_options)
+
+
+def device_route(rule, **options):
+    """
+    Registra una ruta de dispositivo dos veces: /api/devices/<device_id>/... y
+    la ruta clásica /api/... (dispositivo por defecto). La vista recibe el Device.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(device_id=DEFAULT_DEVICE):
+            device = device_manager.get_device(device_id)
+            if device is None: return jsonify({"success": False, "message": f"Dispositivo '{device_id}' no existe."}), 404
+            return view(device)
+        app.add_url_rule(rule, view_func=wrapper, **options)
+        app.add_url_rule(rule.replace('/api/', '/api/devices/<device_id>/', 1), view_func=wrapper, **options)
+        return wrapper
+    return decorator
 
 
 # --- Rutas de la API REST y Vistas HTML ---
@@ -35,114 +58,424 @@ polling_service.connection_service = connection_service
 def index():
     """Sirve la página principal."""
     log_service.log_debug("Solicitud GET a '/'")
-    initial_status = connection_service.get_connection_status()
-    initial_registers = register_service.get_register_data()
+    device = device_manager.get_device(DEFAULT_DEVICE)
+    initial_status = device.connection_service.get_connection_status()
+    initial_registers = device.register_service.get_register_data()
     return render_template('index.html',
                            initial_status=initial_status,
                            initial_registers=initial_registers)
 
 # --- Rutas Connect/Disconnect (sin cambios) ---
-@app.route('/api/connect', methods=['POST'])
-def connect_modbus():
+@device_route('/api/connect', methods=['POST'])
+def connect_modbus(device):
     log_service.log_info("POST /api/connect"); response_data = {"success": False, "message": "Error"}; status_code = 500
     try:
-        data = request.get_json(); ip = data.get('ip'); port = data.get('port'); unit_id = data.get('unit_id'); mode = data.get('mode', 'tcp')
-        log_service.log_debug(f"Connect Data: {ip}:{port} U:{unit_id} M:{mode}")
+        data = request.get_json(); ip = data.get('ip'); port = data.get('port'); unit_id = data.get('unit_id'); mode = data.get('mode', 'tcp'); pipeline_window = int(data.get('pipeline_window', 1)); unit_ids = data.get('unit_ids')
+        log_service.log_debug(f"Connect Data: {ip}:{port} U:{unit_id} M:{mode} W:{pipeline_window}")
         if not ip or not port or unit_id is None: raise ValueError("Faltan parámetros.")
         if mode not in ['tcp', 'rtu_over_tcp']: raise ValueError(f"Modo '{mode}' inválido.")
-        result_dict = connection_service.connect(ip, port, unit_id, mode) # Devuelve dict
+        if not (1 <= pipeline_window <= 64): raise ValueError("pipeline_window fuera de rango (1-64).")
+        if unit_ids is not None and not isinstance(unit_ids, list): raise ValueError("'unit_ids' debe ser una lista.")
+        result_dict = device.connect(ip, port, unit_id, mode, pipeline_window, unit_ids) # Devuelve dict
         response_data = result_dict; status_code = 200
     except ValueError as ve: log_service.log_warning(f"Validation Error: {ve}"); response_data = {"success": False, "message": str(ve)}; status_code = 400
     except ServiceError as se: log_service.log_error(f"Service Error: {se}"); response_data = {"success": False, "message": f"Error Servicio: {se}"}; status_code = 500
     except Exception as e: log_service.log_critical(f"Unexpected Error /api/connect: {e}", exc_info=True); response_data = {"success": False, "message": "Error Interno Servidor."}
     finally: return jsonify(response_data), status_code
 
-@app.route('/api/disconnect', methods=['POST'])
-def disconnect_modbus():
+@device_route('/api/disconnect', methods=['POST'])
+def disconnect_modbus(device):
     log_service.log_info("POST /api/disconnect"); response_data = {"success": False, "message": "Error"}; status_code = 500
     try:
-        log_service.log_info("Deteniendo Polling Service (si aplica)..."); polling_service.stop_polling() # Stop ya no hace nada si no corre
-        log_service.log_info("Llamando a ConnectionService.disconnect..."); result_dict = connection_service.disconnect() # Devuelve dict
+        log_service.log_info("Deteniendo Polling Service (si aplica)..."); device.polling_service.stop_polling() # Idempotente: no hace nada si no corre
+        log_service.log_info("Llamando a ConnectionService.disconnect..."); result_dict = device.connection_service.disconnect() # Devuelve dict
         response_data = result_dict; status_code = 200
     except ServiceError as se: log_service.log_error(f"Service Error /disconnect: {se}"); response_data = {"success": False, "message": f"Error Servicio: {se}"}; status_code = 500
     except Exception as e: log_service.log_critical(f"Error inesperado /disconnect: {e}", exc_info=True); response_data = {"success": False, "message": "Error Interno Servidor."}
     finally: return jsonify(response_data), status_code
 
+# --- Rutas Registro de Dispositivos (un gateway por entrada) ---
+@app.route('/api/devices', methods=['GET', 'POST'])
+def devices():
+    if request.method == 'GET': return jsonify({"devices": device_manager.list_devices()})
+    log_service.log_info("POST /api/devices")
+    try:
+        data = request.get_json()
+        if not data or not data.get('id'): return jsonify({"success": False, "message": "Falta 'id'."}), 400
+        device = device_manager.add_device(data['id'], int(data.get('gap_threshold', 10)))
+        if isinstance(data.get('map'), list): device.register_service.update_register_map(data['map'])
+        if data.get('ip') and data.get('port') and data.get('unit_id') is not None: # Conectar al registrarlo (opcional)
+            mode = data.get('mode', 'tcp')
+            if mode not in ['tcp', 'rtu_over_tcp']: raise ValueError(f"Modo '{mode}' inválido.")
+            result = device.connect(data['ip'], data['port'], data['unit_id'], mode, int(data.get('pipeline_window', 1)), data.get('unit_ids'))
+            return jsonify({"success": True, "message": f"Dispositivo '{device.device_id}' registrado. {result.get('message', '')}".strip(), "device": device.get_summary()})
+        return jsonify({"success": True, "message": f"Dispositivo '{device.device_id}' registrado.", "device": device.get_summary()})
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/devices: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/devices: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+@app.route('/api/devices/<device_id>', methods=['DELETE'])
+def delete_device(device_id):
+    log_service.log_info(f"DELETE /api/devices/{device_id}")
+    try:
+        if not device_manager.remove_device(device_id): return jsonify({"success": False, "message": f"Dispositivo '{device_id}' no existe."}), 404
+        return jsonify({"success": True, "message": f"Dispositivo '{device_id}' eliminado."})
+    except ValueError as ve: return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error DELETE /api/devices: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
 # --- Ruta Status (sin cambios) ---
-@app.route('/api/status', methods=['GET'])
-def get_status():
-    try: status = connection_service.get_connection_status(); return jsonify(status)
+@device_route('/api/status', methods=['GET'])
+def get_status(device):
+    try: status = device.connection_service.get_connection_status(); return jsonify(status)
     except Exception as e: log_service.log_error(f"Error /api/status: {e}", exc_info=True); return jsonify({"connected": False, "is_connecting": False, "message": "Error estado", "last_error": "Error servidor"}), 500
 
+def _registers_payload(device, format_type, unit_id=None):
+    if unit_id is not None: # Datos de un esclavo concreto del bus
+        unit_data = device.register_service.get_unit_data(unit_id) or {"unit_id": unit_id, "addresses": [], "values": [], "last_update": None}
+        formatted_values = [DataFormatter.format_value(v, format_type) for v in unit_data["values"]]
+        return dict(unit_data, values=formatted_values, raw_values=unit_data["values"], format=format_type)
+    register_data = device.register_service.get_register_data()
+    formatted_values = [DataFormatter.format_value(v, format_type) for v in register_data.get("values", [])]
+    return {"start_addr": register_data.get("start_addr"), "count": register_data.get("count"), "addresses": register_data.get("addresses", []), "values": formatted_values, "raw_values": register_data.get("values", []), "last_update": register_data.get("last_update"), "generation": register_data.get("generation"), "cursor": register_data.get("cursor"), "format": format_type}
+
 # --- Ruta Registers (sin cambios) ---
-@app.route('/api/registers', methods=['GET'])
-def get_registers():
-    format_type = request.args.get('format', 'dec'); response_data = {"error": "Error interno"}
+@device_route('/api/registers', methods=['GET'])
+def get_registers(device):
+    format_type = request.args.get('format', 'dec'); unit_id = request.args.get('unit_id', type=int); response_data = {"error": "Error interno"}
     try:
-        register_data = register_service.get_register_data()
-        formatted_values = [DataFormatter.format_value(v, format_type) for v in register_data.get("values", [])]
-        response_data = {"start_addr": register_data.get("start_addr"), "count": register_data.get("count"), "values": formatted_values, "raw_values": register_data.get("values", []), "last_update": register_data.get("last_update"), "format": format_type}
+        response_data = _registers_payload(device, format_type, unit_id)
         return jsonify(response_data)
     except Exception as e: log_service.log_error(f"Error /api/registers: {e}", exc_info=True); return jsonify(response_data), 500
 
-# --- Ruta Debug Log (sin cambios) ---
+# --- Ruta Deltas (report-by-exception: sólo registros cambiados, ?since=<cursor>&unit_id=) ---
+@device_route('/api/registers/changes', methods=['GET'])
+def register_changes(device):
+    try:
+        since = request.args.get('since', default=0, type=int); unit_id = request.args.get('unit_id', type=int)
+        return jsonify(device.register_service.get_deltas(since, unit_id))
+    except Exception as e: log_service.log_error(f"Error /api/registers/changes: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+
+# --- Ruta Histórico (buffer circular en memoria; ?unit_id=&start=&end=&addresses=1,2&buckets=200 para gráficas) ---
+@device_route('/api/history', methods=['GET', 'POST'])
+def register_history(device):
+    if request.method == 'GET':
+        try:
+            addresses = [int(a) for a in request.args.get('addresses', '').split(',') if a.strip()] or None
+            result = device.register_service.get_history(request.args.get('unit_id', type=int), request.args.get('start', type=float), request.args.get('end', type=float), addresses, request.args.get('buckets', type=int), request.args.get('limit', MAX_HISTORY_ROWS, type=int))
+            if result is None: return jsonify({"success": False, "message": "Sin histórico para esa unidad."}), 404
+            return jsonify(result)
+        except ValueError as ve: return jsonify({"success": False, "message": str(ve)}), 400
+        except Exception as e: log_service.log_error(f"Error GET /api/history: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+    log_service.log_info("POST /api/history")
+    try:
+        data = request.get_json()
+        if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
+        config = device.register_service.configure_history(data.get('samples'), data.get('interval'))
+        return jsonify({"success": True, "message": "Histórico actualizado.", "config": config, "stats": device.register_service.get_history_stats()["units"]})
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/history: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/history: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Rutas Histórico en disco (HISTORY_DIR; cambios de registros que sobreviven a reinicios) ---
+@device_route('/api/history/records', methods=['GET'])
+def history_records(device):
+    """?start=&end=&unit_id=&addresses=1,2&limit= (timestamps epoch en s)"""
+    if not device.history_store: return jsonify({"success": False, "message": "Histórico en disco no configurado (HISTORY_DIR)."}), 404
+    try:
+        addresses = [int(a) for a in request.args.get('addresses', '').split(',') if a.strip()] or None
+        limit = request.args.get('limit', default=MAX_QUERY_RECORDS, type=int)
+        if not (1 <= limit <= MAX_QUERY_RECORDS): raise ValueError(f"limit fuera de rango (1-{MAX_QUERY_RECORDS}).")
+        return jsonify(device.history_store.query(request.args.get('start', type=float), request.args.get('end', type=float), request.args.get('unit_id', type=int), addresses, limit))
+    except ValueError as ve: return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_error(f"Error /api/history/records: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+
+@device_route('/api/history/snapshot', methods=['GET'])
+def history_snapshot(device):
+    """?at=<timestamp>&unit_id= : valores vigentes en ese instante"""
+    if not device.history_store: return jsonify({"success": False, "message": "Histórico en disco no configurado (HISTORY_DIR)."}), 404
+    try:
+        at = request.args.get('at', default=time.time(), type=float)
+        state = device.history_store.snapshot_at(at, request.args.get('unit_id', type=int))
+        return jsonify({"time": at, "units": {unit_id: [[address, value] for address, value in sorted(values.items())] for unit_id, values in state.items()}})
+    except Exception as e: log_service.log_error(f"Error /api/history/snapshot: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+
+@device_route('/api/history/store', methods=['GET'])
+def history_store_stats(device):
+    if not device.history_store: return jsonify({"success": False, "message": "Histórico en disco no configurado (HISTORY_DIR)."}), 404
+    return jsonify(device.history_store.get_stats())
+
+# --- Ruta Tags (valores tipados: float32, int32, ... con byte/word order, escala y bits) ---
+@device_route('/api/tags', methods=['GET', 'POST'])
+def tags(device):
+    if request.method == 'GET':
+        try:
+            unit_id = request.args.get('unit_id', type=int); result = device.register_service.get_tag_values(unit_id)
+            if result is None: return jsonify({"success": False, "message": "Sin tags definidos."}), 404
+            if request.args.get('definitions'): result["definitions"] = device.register_service.get_tags(result["unit_id"])
+            return jsonify(result)
+        except Exception as e: log_service.log_error(f"Error GET /api/tags: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+    log_service.log_info("POST /api/tags")
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('tags'), list): return jsonify({"success": False, "message": "Falta 'tags' (lista de {name, address, type, ...})."}), 400
+        result = device.register_service.set_tags(data['tags'], data.get('unit_id'))
+        return jsonify(result), 200 if result.get("success") else 400
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/tags: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/tags: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Ruta Bandas Muertas (cambios menores que la banda no se emiten como deltas) ---
+@device_route('/api/registers/deadbands', methods=['GET', 'POST'])
+def register_deadbands(device):
+    if request.method == 'GET': return jsonify({"deadbands": device.register_service.get_deadbands(request.args.get('unit_id', type=int))})
+    log_service.log_info("POST /api/registers/deadbands")
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('map'), list): return jsonify({"success": False, "message": "Falta 'map' (lista de direcciones y/o rangos [start, count])."}), 400
+        result = device.register_service.set_deadband(data['map'], data.get('absolute'), data.get('percent'), data.get('unit_id'))
+        return jsonify(result), 200 if result.get("success") else 400
+    except Exception as e: log_service.log_critical(f"Error /api/registers/deadbands: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Ruta Eventos (SSE): empuja estado, registros y logs sólo cuando cambian ---
+SSE_KEEPALIVE_SECONDS = 15 # Comentario periódico para que proxies/navegador no corten el stream
+SSE_COALESCE_SECONDS = 0.1 # Agrupar ráfagas de cambios (p.ej. logs DEBUG) en un solo envío
+
+@device_route('/api/events', methods=['GET'])
+def stream_events(device):
+    """?topics=status,registers,changes,log&since=<cursor log>&changes_since=<cursor deltas>&format=dec|hex|bin"""
+    topics = [t for t in request.args.get('topics', 'status,registers').split(',') if t in EVENT_TOPICS]
+    # status/registers/changes son del dispositivo ("status:<id>"); log es global
+    scoped = {(t if t == "log" else EventService.scoped_topic(t, device.device_id)): t for t in topics}
+    format_type = request.args.get('format', 'dec'); log_cursor = request.args.get('since', default=0, type=int)
+    # Sin changes_since se empieza en el cursor actual (el primer envío sólo lleva deltas nuevos)
+    changes_cursor = request.args.get('changes_since', type=int)
+    if changes_cursor is None: changes_cursor = device.register_service.get_delta_cursor()
+    def generate(log_cursor, changes_cursor):
+        versions = {} # Vacío: el primer envío incluye todos los temas pedidos
+        yield "retry: 3000\n\n"
+        while True:
+            versions, changed = event_service.wait_for_change(versions, list(scoped), SSE_KEEPALIVE_SECONDS)
+            if not changed: yield ": keep-alive\n\n"; continue
+            for topic in map(scoped.get, changed):
+                if topic == "status": data = device.connection_service.get_connection_status()
+                elif topic == "registers": data = _registers_payload(device, format_type)
+                elif topic == "changes":
+                    data = device.register_service.get_deltas(changes_cursor); changes_cursor = data["cursor"]
+                    if not data["events"] and not data["reset"]: continue
+                else:
+                    data = log_service.get_logs_since(log_cursor); log_cursor = data["cursor"]
+                    if not data["logs"] and not data["reset"]: continue
+                yield f"event: {topic}\ndata: {json.dumps(data)}\n\n"
+            time.sleep(SSE_COALESCE_SECONDS)
+    return Response(generate(log_cursor, changes_cursor), mimetype='text/event-stream', headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Ruta Debug Log (incremental: ?since=<cursor>&level=WARN&layer=SOCKET,MB_RECV) ---
 @app.route('/api/debuglog', methods=['GET'])
 def get_debug_log():
-    try: logs = log_service.get_logs(); return jsonify({"logs": logs})
+    try:
+        since = request.args.get('since', default=0, type=int); level = request.args.get('level') or None
+        layers = [layer.strip() for layer in request.args.get('layer', '').split(',') if layer.strip()]
+        return jsonify(log_service.get_logs_since(since, level, layers))
+    except ValueError as ve: return jsonify({"logs": [], "message": str(ve)}), 400
     except Exception as e: log_service.log_error(f"Error /api/debuglog: {e}", exc_info=True); return jsonify({"logs": [f"ERROR LOGS: {e}"]}), 500
 
+# --- Ruta Nivel de Log (umbral; DEBUG incluye frames Modbus) ---
+@app.route('/api/log_level', methods=['GET', 'POST'])
+def log_level():
+    if request.method == 'GET': return jsonify({"level": log_service.get_level()})
+    try:
+        data = request.get_json()
+        if not data or not data.get('level'): return jsonify({"success": False, "message": "Falta 'level'."}), 400
+        log_service.set_level(data.get('level')); log_service.log_info(f"Nivel de log cambiado a {log_service.get_level()}.")
+        return jsonify({"success": True, "level": log_service.get_level()})
+    except ValueError as ve: return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/log_level: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
 # --- Ruta Update Params (sin cambios) ---
-@app.route('/api/update_params', methods=['POST'])
-def update_params():
+@device_route('/api/update_params', methods=['POST'])
+def update_params(device):
     log_service.log_info("POST /api/update_params")
     try:
         data = request.get_json();
         if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
         start_addr = data.get('start_addr'); count = data.get('count')
         if start_addr is None or count is None: return jsonify({"success": False, "message": "Faltan params."}), 400
-        result = register_service.update_read_parameters(start_addr, count)
+        result = device.register_service.update_read_parameters(start_addr, count)
         return jsonify(result)
     except Exception as e: log_service.log_critical(f"Error /api/update_params: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
 
+# --- Ruta Mapa de Registros (direcciones sueltas y/o rangos) ---
+@device_route('/api/register_map', methods=['GET', 'POST'])
+def register_map(device):
+    if request.method == 'GET':
+        try:
+            unit_id = request.args.get('unit_id', type=int); planner = device.register_service.read_planner
+            map_key = unit_id if unit_id is not None else DEFAULT_MAP; plan = device.register_service.get_read_plan(map_key)
+            return jsonify({"addresses": planner.get_register_map(map_key), "blocks": plan.blocks if plan else [], "gap_threshold": planner.gap_threshold, "own_map": unit_id is not None and planner.has_own_map(unit_id)})
+        except Exception as e: log_service.log_error(f"Error GET /api/register_map: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+    log_service.log_info("POST /api/register_map")
+    try:
+        data = request.get_json()
+        if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
+        spec = data.get('map'); unit_id = data.get('unit_id') # Con unit_id: mapa propio de esa unidad (map null = usar el común)
+        if not isinstance(spec, list) and not (unit_id is not None and spec is None): return jsonify({"success": False, "message": "Falta 'map' (lista de direcciones y/o rangos [start, count])."}), 400
+        result = device.register_service.update_register_map(spec, data.get('gap_threshold'), unit_id)
+        return jsonify(result), 200 if result.get("success") else 400
+    except Exception as e: log_service.log_critical(f"Error /api/register_map: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Ruta Unit IDs (varios esclavos tras el mismo gateway, un solo socket) ---
+@device_route('/api/units', methods=['GET', 'POST'])
+def units(device):
+    if request.method == 'GET':
+        status = device.connection_service.get_connection_status()
+        return jsonify({"unit_id": status["unit_id"], "unit_ids": status["unit_ids"], "units": device.register_service.get_units_summary(),
+                        "breakers": device.polling_service.get_breaker_stats()["units"]})
+    log_service.log_info("POST /api/units")
+    try:
+        data = request.get_json()
+        unit_ids = data.get('unit_ids') if data else None
+        if not isinstance(unit_ids, list) or not unit_ids: return jsonify({"success": False, "message": "Falta 'unit_ids' (lista, el primero es el principal)."}), 400
+        unit_ids = device.connection_service.set_unit_ids(unit_ids)
+        device.register_service.forget_units(unit_ids); device.polling_service.reset_breakers(unit_ids)
+        return jsonify({"success": True, "message": f"Unit IDs: {unit_ids}.", "unit_ids": unit_ids})
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/units: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/units: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Ruta Circuito por unidad (una unidad que no responde deja de escanearse, con pruebas espaciadas) ---
+@device_route('/api/breakers', methods=['GET', 'POST'])
+def unit_breakers(device):
+    if request.method == 'GET': return jsonify(device.polling_service.get_breaker_stats())
+    log_service.log_info("POST /api/breakers")
+    try:
+        data = request.get_json()
+        if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
+        config = device.polling_service.configure_breakers(data.get('failure_threshold'), data.get('backoff'), data.get('max_backoff'), data.get('jitter'))
+        return jsonify({"success": True, "message": "Circuito actualizado.", "config": config})
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/breakers: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/breakers: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Ruta Bus (turnos por prioridad: escritura > bajo demanda > cíclica > keep-alive) ---
+@device_route('/api/bus', methods=['GET'])
+def bus_stats(device):
+    try: return jsonify(device.connection_service.bus_arbiter.get_stats())
+    except Exception as e: log_service.log_error(f"Error /api/bus: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+
+# --- Ruta Timeouts (plazo por petición a partir del RTT medido de cada unidad) ---
+@device_route('/api/timeouts', methods=['GET', 'POST'])
+def request_timeouts(device):
+    if request.method == 'GET': return jsonify(device.connection_service.get_timeout_stats())
+    log_service.log_info("POST /api/timeouts")
+    try:
+        data = request.get_json()
+        if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
+        stats = device.connection_service.configure_timeouts(data.get('floor'), data.get('ceiling'))
+        return jsonify({"success": True, "message": "Timeouts actualizados.", "timeouts": stats})
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/timeouts: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/timeouts: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Ruta Keep-Alive (sondeo sólo tras un periodo sin respuestas; keepalive TCP opcional) ---
+@device_route('/api/keepalive', methods=['GET', 'POST'])
+def keep_alive_config(device):
+    if request.method == 'GET': return jsonify(device.connection_service.get_keep_alive_config())
+    log_service.log_info("POST /api/keepalive")
+    try:
+        data = request.get_json()
+        if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
+        options = {key: data[key] for key in ('idle', 'probe', 'tcp_keepalive') if key in data} # probe/tcp_keepalive null = desactivar
+        if any(options.get(key) is not None and not isinstance(options[key], dict) for key in ('probe', 'tcp_keepalive')): raise ValueError("'probe' y 'tcp_keepalive' deben ser objetos o null.")
+        config = device.connection_service.configure_keep_alive(**options)
+        return jsonify({"success": True, "message": "Keep-alive actualizado.", "config": config})
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/keepalive: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/keepalive: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
 # --- <<< NUEVA RUTA para Lectura Bajo Demanda >>> ---
-@app.route('/api/readnow', methods=['POST'])
-def read_registers_now():
+@device_route('/api/readnow', methods=['POST'])
+def read_registers_now(device):
     """Endpoint API para disparar una lectura única de registros."""
     log_service.log_info("Solicitud POST a /api/readnow")
     try:
+        # Con una lectura ya en curso la petición se une a ella; max_wait acota la espera (s)
+        data = request.get_json(silent=True) or {}
+        max_wait = float(request.args.get('max_wait', data.get('max_wait', READ_ONCE_MAX_WAIT)))
+        if not (0 <= max_wait <= READ_ONCE_MAX_WAIT): return jsonify({"success": False, "message": f"max_wait fuera de rango (0-{READ_ONCE_MAX_WAIT}s)."}), 400
+        # max_age (s): se aceptan valores leídos hace como mucho eso (sin él, siempre se lee del dispositivo)
+        max_age = request.args.get('max_age', data.get('max_age'))
+        max_age = float(max_age) if max_age is not None else None
+        if max_age is not None and max_age < 0: return jsonify({"success": False, "message": "max_age no puede ser negativo."}), 400
         # Llamar al método read_once del PollingService
-        result = polling_service.read_once()
+        result = device.polling_service.read_once(max_wait, max_age)
         # Devolver el resultado (que ya es un diccionario)
         # El código de estado será 200 OK si la llamada al servicio no falló,
         # el 'success' dentro del JSON indica si la LECTURA fue exitosa.
         return jsonify(result), 200
+    except (ValueError, TypeError) as ve:
+        return jsonify({"success": False, "message": f"max_wait/max_age inválido: {ve}"}), 400
     except Exception as e:
         log_service.log_critical(f"Error inesperado en la ruta /api/readnow: {e}", exc_info=True)
         return jsonify({"success": False, "message": "Error interno del servidor al intentar leer."}), 500
 
-# --- Ruta Intervalo (sin cambios) ---
-@app.route('/api/polling/interval', methods=['POST'])
-def set_polling_interval():
+# --- Ruta Escritura de Registros (0x06/0x10/0x17 vía cola con coalescencia) ---
+@device_route('/api/write', methods=['GET', 'POST'])
+def write_registers(device):
+    if request.method == 'GET': return jsonify({"pending": device.write_queue.get_pending(), "rejected": device.write_queue.get_rejected()}) # Rechazadas: descartadas tras una excepción Modbus
+    log_service.log_info("POST /api/write")
+    try:
+        data = request.get_json()
+        if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
+        address = data.get('address'); values = data.get('values')
+        if values is None and data.get('value') is not None: values = [data.get('value')]
+        if address is None or not values: return jsonify({"success": False, "message": "Faltan 'address' y 'value'/'values'."}), 400
+        unit_id = data.get('unit_id', device.connection_service.get_connection_status().get("unit_id"))
+        if unit_id is None: return jsonify({"success": False, "message": "Unit ID no configurado."}), 400
+        pending = device.write_queue.queue_write(int(unit_id), address, values)
+        # flush=False: se aplican con la próxima lectura (0x17 combinada con la lectura)
+        if not data.get('flush', True): return jsonify({"success": True, "message": f"Escritura en cola ({pending} registros pendientes).", "pending": pending})
+        return jsonify(device.polling_service.flush_writes())
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/write: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_critical(f"Error /api/write: {e}", exc_info=True); return jsonify({"success": False, "message": "Error servidor."}), 500
+
+# --- Rutas Polling cíclico ---
+@device_route('/api/polling/interval', methods=['POST'])
+def set_polling_interval(device):
      log_service.log_info("POST /api/polling/interval")
      try:
         data = request.get_json();
         if not data: return jsonify({"success": False, "message": "Falta JSON."}), 400
-        interval = data.get('interval')
+        interval = data.get('interval'); group = data.get('group', MAIN_SCAN_GROUP)
         if interval is None: return jsonify({"success": False, "message": "Falta 'interval'."}), 400
-        # Esto ahora no tendría efecto si el polling automático está deshabilitado
-        # success = polling_service.set_interval(interval)
-        success = False # Marcar como no soportado por ahora
-        message = "Configuración de intervalo automático no soportada en modo lectura única." # Mensaje claro
-        # message = f"Intervalo actualizado a {interval}s." if success else f"Intervalo inválido: {interval}."
-        return jsonify({"success": success, "message": message})
+        if float(interval) <= 0: # 0 = sólo lecturas bajo demanda
+            device.polling_service.stop_polling(); return jsonify({"success": True, "message": "Polling automático detenido.", "stats": device.polling_service.get_scan_stats()})
+        if 'jitter' in data or 'policy' in data: device.polling_service.set_scan_group(group, interval, jitter=data.get('jitter', 0.0), policy=data.get('policy', OVERRUN_SKIP)); success = True
+        else: success = device.polling_service.set_interval(interval, group)
+        if success: device.polling_service.start_polling()
+        message = f"Intervalo de '{group}' actualizado a {interval}s." if success else f"Intervalo inválido: {interval}."
+        return jsonify({"success": success, "message": message, "stats": device.polling_service.get_scan_stats()}), (200 if success else 400)
+     except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/polling/interval: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
      except Exception as e: log_service.log_error(f"Error /api/polling/interval: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
 
+@device_route('/api/polling', methods=['GET'])
+def get_polling_stats(device):
+    try: return jsonify(device.polling_service.get_scan_stats())
+    except Exception as e: log_service.log_error(f"Error /api/polling: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+
+@device_route('/api/polling/groups', methods=['POST', 'DELETE'])
+def scan_groups(device):
+    log_service.log_info(f"{request.method} /api/polling/groups")
+    try:
+        data = request.get_json() or {}; name = data.get('name')
+        if not name: return jsonify({"success": False, "message": "Falta 'name'."}), 400
+        if request.method == 'DELETE':
+            removed = device.polling_service.remove_scan_group(name)
+            return jsonify({"success": removed, "message": f"Grupo '{name}' eliminado." if removed else f"Grupo '{name}' no existe."}), (200 if removed else 404)
+        if data.get('interval') is None: return jsonify({"success": False, "message": "Falta 'interval'."}), 400
+        device.polling_service.set_scan_group(name, data['interval'], addresses=data.get('addresses'), jitter=data.get('jitter', 0.0), policy=data.get('policy', OVERRUN_SKIP))
+        device.polling_service.start_polling()
+        return jsonify({"success": True, "message": f"Grupo '{name}' configurado.", "stats": device.polling_service.get_scan_stats()})
+    except (ValueError, TypeError) as ve: log_service.log_warning(f"Validation Error /api/polling/groups: {ve}"); return jsonify({"success": False, "message": str(ve)}), 400
+    except Exception as e: log_service.log_error(f"Error /api/polling/groups: {e}", exc_info=True); return jsonify({"success": False, "message": "Error interno."}), 500
+
 # --- Manejo de Cierre Limpio (sin cambios) ---
 def handle_shutdown_signal(signum, frame):
     print("\nApagando..."); log_service.log_info("Señal apagado...")
-    # polling_service.stop_polling() # Ya no es necesario
     print("Desconectando..."); log_service.log_info("Desconectando...")
-    connection_service.disconnect()
+    device_manager.shutdown() # Detiene el polling y desconecta todos los dispositivos
     log_service.log_info("Saliendo."); print("Saliendo.")
     sys.exit(0)
 signal.signal(signal.SIGINT, handle_shutdown_signal); signal.signal(signal.SIGTERM, handle_shutdown_signal)
@@ -0,0 +1,304 @@
+import asyncio
+import time
+
+from .exceptions import ConnectionException, ModbusIOException, ModbusInvalidResponseException
+from .protocol import ModbusProtocol, MBAP_HEADER_SIZE
+from .recv_buffer import RecvBuffer
+from .rtu_framer import RtuFramer, RTU_RESYNC_TIMEOUT
+
+
+class _AsyncModbusClientBase:
+    """
+    Base común de los clientes asyncio: conexión, logging y uptime.
+    Un único event loop puede manejar miles de instancias (una por dispositivo)
+    sin un hilo de sistema por conexión.
+    """
+    def __init__(self):
+        self.ip = None
+        self.port = None
+        self.timeout = 5 # Timeout por defecto para operaciones de socket
+        self.is_connected = False
+        self.connection_start_time = None
+        self._reader = None
+        self._writer = None
+        self._log_service = None
+
+    def set_log_service(self, log_service):
+        """Establece el servicio de logging a usar."""
+        self._log_service = log_service
+
+    def _log(self, level, message, *args, layer="MODBUS_CLIENT"):
+        """Argumentos estilo % (formateo diferido); con el nivel desactivado no se formatea nada."""
+        if self._log_service:
+            self._log_service.log(level, message, *args, layer=layer)
+
+    def _log_enabled(self, level):
+        """True si `level` está activo. Los hot paths lo consultan antes de construir argumentos caros (hex de frames)."""
+        return self._log_service is not None and self._log_service.is_enabled_for(level)
+    async def connect(self, ip, port, timeout=5):
+        """Establece conexión TCP. Lanza ConnectionException en fallo."""
+        if self.is_connected:
+            raise ConnectionException("Cliente ya está conectado.")
+        self.ip = ip
+        self.port = port
+        self.timeout = timeout
+        self._log("INFO", f"Intentando conectar (asyncio) a {self.ip}:{self.port} (Timeout: {timeout}s)...", layer="SOCKET")
+        try:
+            self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        except asyncio.TimeoutError:
+            self._log("ERROR", f"Timeout ({timeout}s) al conectar a {self.ip}:{self.port}", layer="SOCKET")
+            raise ConnectionException(f"Timeout al conectar a {self.ip}:{self.port}")
+        except OSError as e:
+            self._log("ERROR", f"Error de conexión a {self.ip}:{self.port}: {e}", layer="SOCKET")
+            raise ConnectionException(f"Error de conexión: {e}")
+        self.is_connected = True
+        self.connection_start_time = time.time()
+        self._on_connected()
+        self._log("INFO", f"Conexión establecida (asyncio) con {self.ip}:{self.port}", layer="SOCKET")
+
+    def _on_connected(self):
+        """Hook para subclases (p.ej. arrancar la tarea receptora)."""
+        pass
+
+    async def disconnect(self):
+        """Cierra la conexión."""
+        writer = self._writer
+        self._reset_connection_state()
+        if writer:
+            self._log("INFO", "Cerrando socket (asyncio)...", layer="SOCKET")
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError as e:
+                self._log("ERROR", f"Error al cerrar socket: {e}", layer="SOCKET")
+
+    def _reset_connection_state(self):
+        self._reader = None
+        self._writer = None
+        self.is_connected = False
+        self.connection_start_time = None
+
+    def get_connection_uptime(self):
+        """Devuelve el tiempo de conexión activo en segundos."""
+        if self.is_connected and self.connection_start_time:
+            return time.time() - self.connection_start_time
+        return 0
+
+    def _check_connected(self):
+        if not self.is_connected or not self._writer:
+            self._log("ERROR", "Intento de enviar request sin conexión.", layer="SOCKET")
+            raise ConnectionException("No conectado al servidor Modbus.")
+
+
+class AsyncModbusTCPClient(_AsyncModbusClientBase):
+    """
+    Cliente Modbus TCP (MBAP) sobre asyncio.
+    Las peticiones concurrentes sobre la misma conexión se emparejan con su
+    respuesta por Transaction ID; `max_in_flight` limita cuántas hay a la vez.
+    """
+    def __init__(self, max_in_flight=1):
+        super().__init__()
+        self.transaction_id = 0
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._window = None # asyncio.Semaphore, creado al conectar (dentro del loop)
+        self._pending = {} # TID -> Future
+        self._receiver_task = None
+
+    def _on_connected(self):
+        self.transaction_id = 0
+        self._window = asyncio.Semaphore(self.max_in_flight)
+        self._receiver_task = asyncio.get_running_loop().create_task(self._receiver_loop(self._reader))
+
+    async def disconnect(self):
+        task = self._receiver_task
+        self._receiver_task = None
+        await super().disconnect()
+        if task:
+            task.cancel()
+        self._fail_pending(ConnectionException("Conexión cerrada."))
+
+    def _reserve_transaction_id(self, future):
+        """
+        Asigna el siguiente TID libre y registra `future` en la misma llamada
+        síncrona: sin await entre medias ninguna otra corrutina ve la tabla
+        a medias (todo corre en el hilo del loop).
+        """
+        while True:
+            self.transaction_id = (self.transaction_id + 1) & 0xFFFF
+            if self.transaction_id not in self._pending:
+                self._pending[self.transaction_id] = future
+                return self.transaction_id
+
+    async def _receiver_loop(self, reader):
+        """Lee respuestas MBAP y resuelve el Future del TID correspondiente."""
+        error = None
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER_SIZE)
+                try:
+                    rx_trans_id, rx_unit_id, pdu_length = ModbusProtocol.parse_mbap_header(header)
+                except ModbusInvalidResponseException as e:
+                    raise ConnectionException(str(e))
+                pdu_bytes = await reader.readexactly(pdu_length)
+                future = self._pending.pop(rx_trans_id, None)
+                if future is None or future.done():
+                    self._log("DEBUG", "Respuesta tardía/desconocida descartada (TID: %s).", rx_trans_id, layer="MB_RECV")
+                    continue
+                future.set_result((rx_unit_id, pdu_bytes))
+        except asyncio.CancelledError:
+            raise
+        except asyncio.IncompleteReadError:
+            error = ConnectionException("Conexión cerrada inesperadamente por el servidor.")
+        except ConnectionException as e:
+            error = e
+        except OSError as e:
+            error = ConnectionException(f"Error de Socket en comunicación: {e}")
+        if self._reader is reader:
+            self._log("ERROR", f"Receptor asyncio detenido: {error}", layer="SOCKET")
+            self._receiver_task = None
+            await super().disconnect()
+        self._fail_pending(error)
+
+    def _fail_pending(self, error):
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _send_request(self, unit_id, pdu):
+        """Envía un PDU y espera su respuesta. Devuelve (rx_unit_id, response_pdu)."""
+        self._check_connected()
+        async with self._window:
+            self._check_connected()
+            future = asyncio.get_running_loop().create_future()
+            tid = self._reserve_transaction_id(future)
+            try:
+                frame = ModbusProtocol.build_mbap_frame(tid, unit_id, pdu)
+                if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                    self._log("DEBUG", "Enviando %s bytes (TID: %s): %s", len(frame), tid, frame.hex(), layer="TCP")
+                self._writer.write(frame)
+                await self._writer.drain()
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self._log("ERROR", f"Timeout esperando respuesta (TID: {tid}).", layer="SOCKET")
+                raise ConnectionException("Timeout en la comunicación Modbus.")
+            except OSError as e:
+                self._log("ERROR", f"Error de Socket en send: {e}", layer="SOCKET")
+                await self.disconnect()
+                raise ConnectionException(f"Error de Socket en comunicación: {e}")
+            finally:
+                if self._pending.get(tid) is future:
+                    del self._pending[tid] # Una respuesta posterior se descartará
+
+    async def read_holding_registers(self, unit_id, starting_address, quantity):
+        """Lee registros Holding (Función 0x03)."""
+        ModbusProtocol.validate_read_params(starting_address, quantity)
+        function_code = 0x03
+        pdu = ModbusProtocol.build_read_pdu(function_code, starting_address, quantity)
+        rx_unit_id, response_pdu = await self._send_request(unit_id, pdu)
+        if rx_unit_id != unit_id:
+            self._log("WARN", f"Unit ID no coincide en respuesta. Esperado: {unit_id}, Recibido: {rx_unit_id}", layer="MB_ERROR")
+        try:
+            values = ModbusProtocol.parse_read_response(function_code, quantity, response_pdu)
+        except ModbusIOException as e:
+            self._log("ERROR", f"Respuesta de error Modbus recibida. Código: {e.error_code}", layer="MB_ERROR")
+            raise
+        self._log("DEBUG", "Registros leídos exitosamente (%s regs desde %s): %s", quantity, starting_address, values, layer="MODBUS")
+        return values
+
+
+class AsyncModbusRtuOverTcpClient(_AsyncModbusClientBase):
+    """
+    Cliente Modbus RTU (frame con CRC16) sobre TCP, en asyncio.
+    El bus serie detrás del gateway es half-duplex: las transacciones se
+    serializan con un asyncio.Lock (no bloquea el loop, sólo a esta conexión).
+    Los bytes recibidos pasan por el mismo RtuFramer que el cliente con hilos:
+    el ruido, los frames con CRC erróneo y las respuestas ajenas se descartan
+    sin desalinear las respuestas siguientes ni cerrar la conexión.
+    """
+    def __init__(self):
+        super().__init__()
+        self._bus_lock = None
+        self._rx_buffer = RecvBuffer()
+        self._framer = RtuFramer(self._rx_buffer, self._log)
+
+    def _on_connected(self):
+        self._bus_lock = asyncio.Lock()
+        self._rx_buffer.clear() # Descartar restos de una conexión anterior
+
+    async def _recv_more(self, deadline):
+        """Añade al buffer lo que haya disponible (al menos 1 byte), como mucho hasta `deadline`."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+        data = await asyncio.wait_for(self._reader.read(self._rx_buffer.free_space()), remaining)
+        if not data:
+            raise ConnectionException(f"Conexión cerrada inesperadamente por el servidor (recibidos {len(self._rx_buffer)} bytes).")
+        self._rx_buffer.feed(data)
+
+    async def _send_request_rtu(self, request_rtu_frame):
+        """
+        Envía un frame RTU y devuelve (rx_slave_id, pdu) de su respuesta, con
+        el CRC verificado por el RtuFramer. Un frame nuestro corrupto sin
+        reenvío válido en RTU_RESYNC_TIMEOUT lanza ModbusInvalidResponseException
+        (la conexión se conserva, como en el cliente con hilos).
+        """
+        slave_id, function_code = request_rtu_frame[0], request_rtu_frame[1]
+        self._check_connected()
+        async with self._bus_lock:
+            self._check_connected()
+            try:
+                if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                    self._log("DEBUG", "Enviando frame RTU (%s bytes): %s", len(request_rtu_frame), request_rtu_frame.hex(), layer="TCP")
+                self._framer.reset()
+                self._writer.write(request_rtu_frame)
+                await self._writer.drain()
+                deadline = time.monotonic() + self.timeout
+                while True:
+                    frame = self._framer.next_frame(slave_id, function_code)
+                    if frame is not None:
+                        break
+                    if self._framer.corrupted:
+                        # Nuestra respuesta llegó dañada: sólo esperar un posible reenvío/resto breve
+                        deadline = min(deadline, time.monotonic() + RTU_RESYNC_TIMEOUT)
+                    try:
+                        await self._recv_more(deadline)
+                    except asyncio.TimeoutError:
+                        if self._framer.corrupted:
+                            raise ModbusInvalidResponseException("Fallo de verificación CRC en la respuesta.")
+                        raise
+            except asyncio.TimeoutError:
+                # El resto de la respuesta podría llegar tarde y tomarse por la siguiente (RTU no tiene TID)
+                self._log("ERROR", "Timeout durante send/recv RTU.", layer="SOCKET")
+                await self.disconnect()
+                raise ConnectionException("Timeout en comunicación Modbus RTU over TCP.")
+            except ConnectionException as e:
+                self._log("ERROR", f"Error de conexión en RTU: {e}", layer="SOCKET")
+                await self.disconnect()
+                raise
+            except OSError as e:
+                self._log("ERROR", f"Error de socket en RTU: {e}", layer="SOCKET")
+                await self.disconnect()
+                raise ConnectionException(f"Error de socket durante recv: {e}")
+
+            if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                self._log("DEBUG", "Frame RTU completo recibido (%s bytes): %s", len(frame), frame.hex(), layer="RTU_RECV")
+            # Copia: la vista apunta al buffer, que la siguiente petición reutiliza
+            return frame[0], bytes(frame[1:-2])
+
+    async def read_holding_registers(self, unit_id, starting_address, quantity):
+        """Lee registros Holding (Función 0x03) usando RTU over TCP."""
+        ModbusProtocol.validate_read_params(starting_address, quantity)
+        function_code = 0x03
+        request_frame = ModbusProtocol.build_rtu_frame(unit_id, ModbusProtocol.build_read_pdu(function_code, starting_address, quantity))
+        rx_slave_id, response_pdu = await self._send_request_rtu(request_frame)
+        if rx_slave_id != unit_id:
+            self._log("WARN", f"Slave ID no coincide en respuesta RTU. Esperado: {unit_id}, Recibido: {rx_slave_id}", layer="RTU_ERROR")
+        try:
+            values = ModbusProtocol.parse_read_response(function_code, quantity, response_pdu)
+        except ModbusIOException as e:
+            self._log("ERROR", f"Respuesta de error Modbus RTU. Código: {e.error_code}", layer="RTU_ERROR")
+            raise
+        self._log("DEBUG", "Registros leídos (RTU) (%s regs desde %s): %s", quantity, starting_address, values, layer="MODBUS")
+        return values
@@ -14,4 +14,8 @@ class ModbusIOException(ModbusException):
 
 class ModbusInvalidResponseException(ModbusException):
     """La respuesta recibida no cumple el formato esperado."""
-    pass
\ No newline at end of file
+    pass
+
+class ModbusTimeoutException(ModbusException):
+    """La unidad no respondió dentro de su plazo; el enlace sigue vivo y el socket se conserva."""
+    pass
@@ -1,4 +1,5 @@
 import struct
+from .exceptions import ModbusInvalidResponseException
 
 class DataFormatter:
     @staticmethod
@@ -12,15 +13,21 @@ class DataFormatter:
         else: # 'dec' por defecto
             return str(value)
 
+    # Structs '>NH' precompilados por cantidad de registros (como máximo 125 distintos)
+    _register_structs = {}
+
     @staticmethod
-    def parse_registers(data_bytes, quantity):
-        """Parsea bytes recibidos en una lista de registros (words/16 bits)."""
-        if len(data_bytes) != quantity * 2:
-            raise ModbusInvalidResponseException(f"Tamaño de datos incorrecto. Esperado {quantity*2} bytes, recibidos {len(data_bytes)}")
+    def parse_registers(data_bytes, quantity, offset=0):
+        """
+        Parsea bytes recibidos en una lista de registros (words/16 bits).
+        Acepta bytes, bytearray o memoryview; decodifica todos los registros con
+        un único unpack_from, sin slicing ni copias intermedias.
+        """
+        if len(data_bytes) - offset != quantity * 2:
+            raise ModbusInvalidResponseException(f"Tamaño de datos incorrecto. Esperado {quantity*2} bytes, recibidos {len(data_bytes) - offset}")
 
-        values = []
-        for i in range(0, len(data_bytes), 2):
+        registers_struct = DataFormatter._register_structs.get(quantity)
+        if registers_struct is None:
             # '>H' significa Big-Endian Unsigned Short (16 bits)
-            value = struct.unpack('>H', data_bytes[i:i+2])[0]
-            values.append(value)
-        return values
\ No newline at end of file
+            registers_struct = DataFormatter._register_structs[quantity] = struct.Struct(f'>{quantity}H')
+        return list(registers_struct.unpack_from(data_bytes, offset))
@@ -0,0 +1,38 @@
+import threading
+
+
+class FrameCache:
+    """
+    Cache de frames de petición precompilados, por (unit, función, dirección, cantidad).
+    En un escaneo cíclico las peticiones de lectura se repiten idénticas, así
+    que se construyen (struct.pack, CRC) una sola vez. Lo que se guarda depende
+    del transporte: el frame RTU completo (CRC incluido) o la plantilla MBAP
+    en la que sólo se parchea el Transaction ID antes de cada envío.
+    La comparten todos los hilos que usan el cliente (polling, API,
+    keep-alive): el diccionario se consulta y modifica con un lock; el frame
+    se construye fuera de él.
+    """
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries # Límite simple: al llenarse se vacía entera
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, build_func):
+        """Devuelve el frame de `key`, construyéndolo con build_func() la primera vez."""
+        with self._lock:
+            frame = self._frames.get(key)
+        if frame is not None:
+            return frame
+        frame = build_func()
+        with self._lock:
+            if len(self._frames) >= self.max_entries:
+                self._frames.clear()
+            return self._frames.setdefault(key, frame) # Si otro hilo se adelantó, gana el suyo (son idénticos)
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frames)
@@ -0,0 +1,192 @@
+import struct
+
+from .exceptions import ModbusIOException, ModbusInvalidResponseException
+from .formatter import DataFormatter
+
+
+def _build_crc16_table():
+    """Tabla CRC-16/MODBUS (polinomio reflejado 0xA001), un valor por byte."""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+_CRC16_TABLE = _build_crc16_table()
+
+
+def crc16_func(data):
+    """CRC Modbus (RTU) por tabla: un lookup por byte. Acepta bytes, bytearray o memoryview."""
+    crc = 0xFFFF
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+MBAP_HEADER_SIZE = 7
+MAX_MBAP_LENGTH = 254 # Unit ID (1) + PDU máximo (253)
+
+# Códigos de función soportados
+FC_READ_HOLDING_REGISTERS = 0x03
+FC_READ_INPUT_REGISTERS = 0x04
+FC_WRITE_SINGLE_REGISTER = 0x06
+FC_DIAGNOSTICS = 0x08
+DIAG_RETURN_QUERY_DATA = 0x0000 # Subfunción 0x08: el esclavo devuelve el dato tal cual (eco)
+FC_WRITE_MULTIPLE_REGISTERS = 0x10
+FC_READ_WRITE_MULTIPLE_REGISTERS = 0x17
+
+MAX_READ_QUANTITY = 125 # 0x03
+MAX_WRITE_QUANTITY = 123 # 0x10
+MAX_RW_WRITE_QUANTITY = 121 # 0x17 (parte de escritura)
+
+
+class ModbusProtocol:
+    """
+    Construcción y validación de frames Modbus, independiente del transporte.
+    La comparten los clientes con hilos (tcp_client, rtu_over_tcp_client) y
+    los clientes asyncio (async_client), para que todos generen y validen
+    exactamente los mismos bytes y lancen las mismas excepciones.
+    """
+
+    @staticmethod
+    def validate_read_params(starting_address, quantity):
+        if not (0 <= starting_address <= 65535):
+            raise ValueError("Dirección inicial fuera de rango (0-65535)")
+        if not (1 <= quantity <= MAX_READ_QUANTITY):
+             raise ValueError(f"Cantidad de registros fuera de rango (1-{MAX_READ_QUANTITY})")
+
+    @staticmethod
+    def validate_write_params(starting_address, values, max_quantity=MAX_WRITE_QUANTITY):
+        if not (1 <= len(values) <= max_quantity):
+            raise ValueError(f"Cantidad de registros a escribir fuera de rango (1-{max_quantity})")
+        if not (0 <= starting_address <= 65535) or starting_address + len(values) > 65536:
+            raise ValueError("Dirección de escritura fuera de rango (0-65535)")
+        for value in values:
+            if not (0 <= value <= 0xFFFF):
+                raise ValueError(f"Valor de registro fuera de rango (0-65535): {value}")
+
+    @staticmethod
+    def build_read_pdu(function_code, starting_address, quantity):
+        """PDU de lectura: FuncCode + Dirección + Cantidad."""
+        return struct.pack('>BHH', function_code, starting_address, quantity)
+
+    @staticmethod
+    def build_write_single_pdu(address, value):
+        """PDU 0x06: FuncCode + Dirección + Valor."""
+        return struct.pack('>BHH', FC_WRITE_SINGLE_REGISTER, address, value)
+
+    @staticmethod
+    def build_write_multiple_pdu(starting_address, values):
+        """PDU 0x10: FuncCode + Dirección + Cantidad + ByteCount + Valores."""
+        quantity = len(values)
+        return struct.pack(f'>BHHB{quantity}H', FC_WRITE_MULTIPLE_REGISTERS, starting_address, quantity, quantity * 2, *values)
+
+    @staticmethod
+    def build_read_write_pdu(read_address, read_quantity, write_address, values):
+        """PDU 0x17: lectura + escritura en una sola transacción (el esclavo escribe primero)."""
+        quantity = len(values)
+        return struct.pack(f'>BHHHHB{quantity}H', FC_READ_WRITE_MULTIPLE_REGISTERS, read_address, read_quantity,
+                           write_address, quantity, quantity * 2, *values)
+
+    @staticmethod
+    def build_diagnostics_pdu(sub_function, data):
+        """PDU de Diagnostics (0x08): subfunción + un dato de 16 bits."""
+        return struct.pack('>BHH', FC_DIAGNOSTICS, sub_function, data)
+
+    @staticmethod
+    def build_mbap_frame(transaction_id, unit_id, pdu):
+        """Frame Modbus TCP: cabecera MBAP (TID, Proto=0, Length, UnitID) + PDU."""
+        return struct.pack('>HHHB', transaction_id, 0, len(pdu) + 1, unit_id) + pdu
+
+    @staticmethod
+    def parse_mbap_header(header_bytes):
+        """
+        Devuelve (transaction_id, unit_id, pdu_length) de una cabecera MBAP.
+        Lanza ModbusInvalidResponseException si la cabecera es imposible
+        (stream desincronizado).
+        """
+        rx_trans_id, rx_proto_id, rx_length, rx_unit_id = struct.unpack_from('>HHHB', header_bytes, 0)
+        if rx_proto_id != 0 or not (2 <= rx_length <= MAX_MBAP_LENGTH):
+            raise ModbusInvalidResponseException(f"Cabecera MBAP inválida (Proto: {rx_proto_id}, Length: {rx_length}). Conexión desincronizada.")
+        return rx_trans_id, rx_unit_id, rx_length - 1
+
+    @staticmethod
+    def build_rtu_frame(slave_id, pdu):
+        """Frame RTU: SlaveID + PDU + CRC16 (Little-Endian)."""
+        frame_no_crc = struct.pack('>B', slave_id) + pdu
+        return frame_no_crc + struct.pack('<H', crc16_func(frame_no_crc))
+
+    @staticmethod
+    def check_rtu_crc(frame_with_crc):
+        """Devuelve (ok, crc_recibido, crc_calculado) para un frame RTU completo."""
+        if len(frame_with_crc) < 3: # Mínimo: SlaveID+FuncCode+CRC(2)
+            return False, None, None
+        received_crc = struct.unpack_from('<H', frame_with_crc, len(frame_with_crc) - 2)[0]
+        calculated_crc = crc16_func(frame_with_crc[:-2])
+        return received_crc == calculated_crc, received_crc, calculated_crc
+
+    @staticmethod
+    def rtu_read_response_length(quantity):
+        """Bytes tras SlaveID+FuncCode en una respuesta 0x03/0x17 normal: ByteCount(1) + Data + CRC(2)."""
+        return 1 + (quantity * 2) + 2
+
+    @staticmethod
+    def rtu_write_response_length():
+        """Bytes tras SlaveID+FuncCode en una respuesta 0x06/0x10: Dirección(2) + Valor/Cantidad(2) + CRC(2)."""
+        return 2 + 2 + 2
+
+    @staticmethod
+    def check_exception_response(function_code, response_pdu):
+        """Lanza ModbusIOException si el PDU es una respuesta de excepción Modbus."""
+        if not response_pdu:
+            raise ModbusInvalidResponseException("Respuesta PDU vacía.")
+        rx_func_code = response_pdu[0]
+        if rx_func_code == (function_code | 0x80):
+            if len(response_pdu) < 2:
+                 raise ModbusInvalidResponseException("Respuesta de error Modbus incompleta (falta código de excepción).")
+            error_code = response_pdu[1]
+            raise ModbusIOException(f"Error Modbus recibido del dispositivo. Código: {error_code}", error_code=error_code)
+        elif rx_func_code != function_code:
+            raise ModbusInvalidResponseException(f"Código de función incorrecto en respuesta. Esperado: {function_code}, Recibido: {rx_func_code}")
+
+    @staticmethod
+    def parse_read_response(function_code, quantity, response_pdu):
+        """Valida el PDU de respuesta de una lectura de registros y devuelve los valores."""
+        ModbusProtocol.check_exception_response(function_code, response_pdu)
+        # Procesar respuesta normal
+        if len(response_pdu) < 2:
+             raise ModbusInvalidResponseException("Respuesta PDU demasiado corta para contener byte count.")
+        byte_count = response_pdu[1]
+        data_bytes = response_pdu[2:]
+
+        if byte_count != len(data_bytes):
+            raise ModbusInvalidResponseException(f"Byte count ({byte_count}) no coincide con longitud de datos ({len(data_bytes)}).")
+        if byte_count != quantity * 2:
+             raise ModbusInvalidResponseException(f"Byte count ({byte_count}) no coincide con cantidad solicitada ({quantity}*2 bytes).")
+
+        return DataFormatter.parse_registers(data_bytes, quantity)
+
+    @staticmethod
+    def parse_write_response(function_code, starting_address, second_field, response_pdu):
+        """
+        Valida el eco de una escritura 0x06 (second_field = valor) o
+        0x10 (second_field = cantidad).
+        """
+        ModbusProtocol.check_exception_response(function_code, response_pdu)
+        if len(response_pdu) != 5:
+            raise ModbusInvalidResponseException(f"Longitud de respuesta de escritura inválida ({len(response_pdu)} bytes, esperados 5).")
+        rx_address, rx_field = struct.unpack_from('>HH', response_pdu, 1)
+        if rx_address != starting_address or rx_field != second_field:
+            raise ModbusInvalidResponseException(f"Eco de escritura no coincide. Esperado: ({starting_address}, {second_field}), Recibido: ({rx_address}, {rx_field})")
+
+    @staticmethod
+    def parse_diagnostics_response(sub_function, data, response_pdu):
+        """Valida el eco de una petición Diagnostics (0x08) de subfunción + un dato."""
+        ModbusProtocol.check_exception_response(FC_DIAGNOSTICS, response_pdu)
+        if len(response_pdu) != 5:
+            raise ModbusInvalidResponseException(f"Longitud de respuesta de diagnóstico inválida ({len(response_pdu)} bytes, esperados 5).")
+        rx_sub_function, rx_data = struct.unpack_from('>HH', response_pdu, 1)
+        if rx_sub_function != sub_function or rx_data != data:
+            raise ModbusInvalidResponseException(f"Eco de diagnóstico no coincide. Esperado: ({sub_function}, {data}), Recibido: ({rx_sub_function}, {rx_data})")
@@ -0,0 +1,92 @@
+import socket
+import time
+
+from .exceptions import ConnectionException
+
+
+class RecvBuffer:
+    """
+    Buffer de recepción preasignado (uno por cliente/socket).
+    Lee con recv_into() directamente sobre un bytearray fijo, pidiendo todo
+    el espacio libre en cada llamada, de modo que normalmente un ADU completo
+    llega en un único syscall. Los datos se entregan como memoryview sobre el
+    propio buffer, sin copias.
+
+    IMPORTANTE: las vistas devueltas por peek()/consume() sólo son válidas
+    hasta la siguiente llamada a fill() (que puede compactar el buffer).
+    Quien necesite conservar los datos debe copiarlos (bytes(vista)).
+    """
+    def __init__(self, size=1024):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0 # Primer byte sin consumir
+        self._end = 0 # Fin de los datos recibidos
+
+    def __len__(self):
+        """Bytes recibidos y aún no consumidos."""
+        return self._end - self._start
+
+    def clear(self):
+        """Descarta cualquier dato pendiente (p.ej. al reconectar)."""
+        self._start = self._end = 0
+
+    def _compact(self):
+        """Mueve los datos pendientes al inicio del buffer para liberar espacio al final."""
+        pending = self._end - self._start
+        if self._start:
+            self._buf[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+
+    def fill(self, sock, min_bytes, deadline=None):
+        """
+        Recibe del socket hasta tener al menos `min_bytes` pendientes.
+        Con `deadline` (time.monotonic()) el tiempo total queda acotado;
+        sin él se aplica el timeout del socket a cada recv.
+        Lanza socket.timeout o ConnectionException (peer cerró la conexión).
+        """
+        if min_bytes > len(self._buf):
+            raise ValueError(f"RecvBuffer demasiado pequeño ({len(self._buf)}) para {min_bytes} bytes.")
+        while self._end - self._start < min_bytes:
+            if self._start == self._end:
+                self._start = self._end = 0 # Vacío: reiniciar sin copiar
+            elif len(self._buf) - self._start < min_bytes:
+                self._compact()
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout(f"Timeout esperando datos (recibidos {self._end - self._start}/{min_bytes})")
+                sock.settimeout(remaining)
+            received = sock.recv_into(self._view[self._end:])
+            if not received:
+                raise ConnectionException(f"Conexión cerrada inesperadamente por el servidor (recibidos {self._end - self._start}/{min_bytes} bytes).")
+            self._end += received
+
+    def feed(self, data):
+        """
+        Añade bytes ya recibidos por otra vía (p.ej. un StreamReader de asyncio)
+        para delimitarlos igual que los de fill(). Lanza ValueError si no caben.
+        """
+        if len(data) > len(self._buf) - (self._end - self._start):
+            raise ValueError(f"RecvBuffer demasiado pequeño ({len(self._buf)}) para {self._end - self._start + len(data)} bytes.")
+        if len(self._buf) - self._end < len(data):
+            self._compact()
+        self._view[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def free_space(self):
+        """Bytes que aún caben (compactando) sin perder los pendientes."""
+        return len(self._buf) - (self._end - self._start)
+
+    def peek(self, num_bytes):
+        """Vista de los próximos `num_bytes` sin consumirlos."""
+        return self._view[self._start:self._start + num_bytes]
+
+    def consume(self, num_bytes):
+        """Vista de los próximos `num_bytes`, marcándolos como consumidos."""
+        view = self._view[self._start:self._start + num_bytes]
+        self._start += num_bytes
+        return view
+
+    def skip(self, num_bytes):
+        """Descarta `num_bytes` pendientes."""
+        self._start += min(num_bytes, self._end - self._start)
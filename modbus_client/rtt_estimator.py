@@ -0,0 +1,158 @@
+import threading
+
+DEFAULT_TIMEOUT_FLOOR = 0.05 # s; por debajo el jitter del gateway daría falsos timeouts
+DEFAULT_TIMEOUT_CEILING = 5.0 # s; plazo máximo de una petición (unidad sin muestras o en backoff)
+MAX_BACKOFF = 6 # Duplicaciones tras timeouts seguidos (acotadas por el techo)
+DEAD_LINK_UNITS = 3 # Unidades distintas seguidas sin respuesta (ninguna otra respondió entretanto) que dan el enlace por muerto
+SIZE_CLASS_BYTES = 32 # Bytes (petición + respuesta) de la clase de tamaño más pequeña; cada clase dobla la anterior
+
+_ALPHA = 1 / 8 # Peso de la muestra nueva en SRTT (RFC 6298)
+_BETA = 1 / 4 # Peso de la muestra nueva en RTTVAR
+_K = 4 # RTTVAR que se suma a SRTT
+_GRANULARITY = 0.005 # s; margen mínimo sobre SRTT
+_LINK = None # Estimación conjunta del enlace (todas las unidades)
+_STATS_FIELDS = ("srtt", "rttvar", "samples", "backoff", "timeouts", "last_rtt")
+
+
+def transfer_size(pdu):
+    """
+    Bytes de PDU que viajan en una transacción: la petición más la respuesta
+    esperada (0x03/0x04/0x17 devuelven 2 bytes por registro pedido; el resto
+    responde con 4 bytes tras el código de función).
+    """
+    if pdu[0] in (0x03, 0x04, 0x17) and len(pdu) >= 5:
+        return len(pdu) + 2 + 2 * ((pdu[3] << 8) | pdu[4])
+    return len(pdu) + 5
+
+
+def size_class(size):
+    """Clase de tamaño: 0 hasta SIZE_CLASS_BYTES bytes, y una más cada vez que se dobla."""
+    return max(0, (max(1, size) - 1) // SIZE_CLASS_BYTES).bit_length()
+
+
+class RttEstimator:
+    """
+    Estimador del tiempo de ida y vuelta por unidad (SRTT/RTTVAR, como el RTO
+    de TCP en la RFC 6298). El plazo de cada petición es SRTT + 4·RTTVAR,
+    acotado a [floor, ceiling]; tras un timeout se duplica (backoff) hasta la
+    siguiente respuesta. Una unidad aún sin muestras usa la estimación del
+    enlace (todas las unidades) y, si tampoco la hay, el techo. Así un esclavo
+    muerto se detecta en decenas de ms en un enlace sano, sin penalizar a las
+    unidades lentas. Un timeout sólo afecta a su unidad: el enlace se da por
+    muerto cuando varias unidades distintas dejan de responder seguidas
+    (record_timeout), nunca por el tiempo transcurrido sin tráfico.
+
+    El RTT crece con los bytes transmitidos (en una pasarela serie domina el
+    tiempo de línea), así que cada unidad tiene una estimación por clase de
+    tamaño (`size`, ver transfer_size): una lectura de 125 registros o una
+    0x10 larga no hereda el plazo de las peticiones cortas. Una clase sin
+    muestras parte de la más cercana de la unidad, doblando el plazo por
+    cada clase de diferencia hacia arriba.
+    """
+    def __init__(self, floor=DEFAULT_TIMEOUT_FLOOR, ceiling=DEFAULT_TIMEOUT_CEILING):
+        self._lock = threading.Lock()
+        self._units = {} # unit_id -> {clase de tamaño: [srtt, rttvar, muestras, backoff, timeouts, última muestra]}
+        self._silent = set() # Unidades con timeout desde la última respuesta de cualquier unidad
+        self._responsive = {} # unit_id -> respondió a su última petición
+        self.floor = floor
+        self.ceiling = ceiling
+        self.set_limits(floor, ceiling)
+
+    def set_limits(self, floor=None, ceiling=None):
+        floor = self.floor if floor is None else float(floor)
+        ceiling = self.ceiling if ceiling is None else float(ceiling)
+        if not (0 < floor <= ceiling):
+            raise ValueError(f"Límites de timeout inválidos (0 < floor <= ceiling): {floor}, {ceiling}")
+        self.floor = floor
+        self.ceiling = ceiling
+
+    def timeout(self, unit_id, size=0):
+        """Plazo (s) para la próxima petición a `unit_id` que mueve `size` bytes."""
+        cls = size_class(size)
+        with self._lock:
+            classes = self._units.get(unit_id, {})
+            state = classes.get(cls)
+            backoff = state[3] if state else 0
+            rto = self._rto(classes, cls)
+            if rto is None:
+                rto = self._rto(self._units.get(_LINK, {}), cls)
+            if rto is None:
+                return self.ceiling
+        return min(self.ceiling, max(self.floor, rto * (1 << backoff)))
+
+    @staticmethod
+    def _rto(classes, cls):
+        """SRTT + 4·RTTVAR de la clase `cls`, o de la clase con muestras más cercana (x2 por clase hacia arriba)."""
+        measured = [known for known, state in classes.items() if state[2]]
+        if not measured:
+            return None
+        nearest = min(measured, key=lambda known: (abs(known - cls), -known))
+        state = classes[nearest]
+        return (state[0] + max(_GRANULARITY, _K * state[1])) * (1 << max(0, cls - nearest))
+
+    def record(self, unit_id, rtt, size=0):
+        """Muestra de una respuesta válida (también excepciones Modbus) de `unit_id`."""
+        cls = size_class(size)
+        with self._lock:
+            self._update(unit_id, cls, rtt)
+            self._update(_LINK, cls, rtt)
+            self._silent.clear()
+            self._responsive[unit_id] = True
+
+    def _update(self, key, cls, rtt):
+        classes = self._units.setdefault(key, {})
+        state = classes.get(cls)
+        if state is None or not state[2]: # Primera muestra (RFC 6298: RTTVAR = R/2)
+            timeouts = state[4] if state else 0
+            classes[cls] = [rtt, rtt / 2, 1, 0, timeouts, rtt]
+            return
+        state[1] += _BETA * (abs(state[0] - rtt) - state[1])
+        state[0] += _ALPHA * (rtt - state[0])
+        state[2] += 1; state[3] = 0; state[5] = rtt
+
+    def record_timeout(self, unit_id, size=0):
+        """
+        La unidad no respondió en plazo: el siguiente plazo se duplica.
+        Devuelve True si el enlace parece muerto: DEAD_LINK_UNITS unidades
+        distintas (o todas las conocidas, si son menos, pero al menos dos)
+        sin respuesta seguidas. Una sola unidad muerta nunca lo es.
+        """
+        with self._lock:
+            state = self._units.setdefault(unit_id, {}).setdefault(size_class(size), [0.0, 0.0, 0, 0, 0, None])
+            state[3] = min(state[3] + 1, MAX_BACKOFF); state[4] += 1
+            self._silent.add(unit_id)
+            self._responsive[unit_id] = False
+            known = sum(1 for key, classes in self._units.items() if key is not _LINK and any(unit[2] for unit in classes.values()))
+            return len(self._silent) >= max(2, min(DEAD_LINK_UNITS, known))
+
+    def is_responsive(self, unit_id):
+        """True si la unidad respondió a su última petición."""
+        with self._lock:
+            return self._responsive.get(unit_id, False)
+
+    def reset(self):
+        with self._lock:
+            self._units.clear()
+            self._silent.clear()
+            self._responsive.clear()
+
+    @staticmethod
+    def _summary(classes):
+        """Totales de una unidad: muestras/timeouts sumados; SRTT, RTTVAR y backoff de su clase más pequeña con muestras."""
+        measured = sorted(cls for cls, state in classes.items() if state[2])
+        base = classes[measured[0]] if measured else classes[min(classes)]
+        stats = dict(zip(_STATS_FIELDS, base))
+        stats["samples"] = sum(state[2] for state in classes.values())
+        stats["timeouts"] = sum(state[4] for state in classes.values())
+        stats["sizes"] = {SIZE_CLASS_BYTES << cls: dict(zip(_STATS_FIELDS, state)) for cls, state in sorted(classes.items())} # Clave: bytes máximos de la clase
+        return stats
+
+    def get_stats(self):
+        with self._lock:
+            units = {unit_id: self._summary(classes) for unit_id, classes in self._units.items() if classes}
+        link = units.pop(_LINK, None)
+        for unit_id, stats in units.items():
+            stats["timeout"] = self.timeout(unit_id)
+            for limit, size_stats in stats["sizes"].items():
+                size_stats["timeout"] = self.timeout(unit_id, limit)
+        return {"floor": self.floor, "ceiling": self.ceiling, "link": link, "units": units}
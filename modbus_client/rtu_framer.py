@@ -0,0 +1,118 @@
+from .protocol import ModbusProtocol
+
+MAX_RTU_FRAME_SIZE = 256 # SlaveID (1) + PDU (253) + CRC (2)
+RTU_EXCEPTION_FRAME_SIZE = 5 # SlaveID + FuncCode|0x80 + ExCode + CRC(2)
+# Tras detectar un frame corrupto, tiempo máximo esperando que aparezca uno válido
+RTU_RESYNC_TIMEOUT = 0.25
+
+# Respuestas de longitud fija (frame completo, CRC incluido)
+RTU_FIXED_RESPONSE_SIZES = {
+    0x05: 8, # Write Single Coil (eco)
+    0x06: 8, # Write Single Register (eco)
+    0x08: 8, # Diagnostics (eco de subfunción + dato)
+    0x0F: 8, # Write Multiple Coils
+    0x10: 8, # Write Multiple Registers
+}
+# Respuestas con ByteCount en el tercer byte: SlaveID + FC + ByteCount + Datos + CRC(2)
+RTU_BYTE_COUNT_FUNCTIONS = frozenset((0x01, 0x02, 0x03, 0x04, 0x17))
+
+
+class RtuFramer:
+    """
+    Delimitador incremental de frames RTU sobre un RecvBuffer.
+    Las fronteras se deducen del código de función (y del ByteCount), no de
+    la petición, así que el cliente puede pasarle lo que haya llegado y pedir
+    más bytes mientras next_frame() devuelva None.
+    Ante ruido o CRC erróneo no se cierra la conexión: se avanza byte a byte
+    hasta el siguiente frame válido (resincronización). Los frames íntegros
+    de otro esclavo o de otra función (respuestas tardías, tráfico ajeno en
+    el bus) se descartan completos.
+    """
+    def __init__(self, rx_buffer, log_func=None):
+        self._rx_buffer = rx_buffer
+        self._log = log_func
+        self.crc_errors = 0 # Contadores acumulados (diagnóstico)
+        self.discarded_bytes = 0
+        self.discarded_frames = 0
+        self.corrupted = False # Hubo un frame candidato con CRC erróneo en la petición actual
+
+    @staticmethod
+    def frame_length(data, pos):
+        """
+        Longitud total del frame que empieza en data[pos].
+        Devuelve 0 si aún faltan bytes para saberlo y None si la cabecera no
+        puede ser el inicio de un frame (función desconocida o longitud imposible).
+        """
+        available = len(data) - pos
+        if available < 2:
+            return 0
+        function_code = data[pos + 1]
+        if function_code & 0x80:
+            base_code = function_code & 0x7F
+            if base_code in RTU_FIXED_RESPONSE_SIZES or base_code in RTU_BYTE_COUNT_FUNCTIONS:
+                return RTU_EXCEPTION_FRAME_SIZE
+            return None
+        fixed_size = RTU_FIXED_RESPONSE_SIZES.get(function_code)
+        if fixed_size:
+            return fixed_size
+        if function_code in RTU_BYTE_COUNT_FUNCTIONS:
+            if available < 3:
+                return 0
+            length = 5 + data[pos + 2]
+            return length if length <= MAX_RTU_FRAME_SIZE else None
+        return None
+
+    def reset(self):
+        """Inicio de una nueva petición: lo que quede en el buffer no puede ser su respuesta."""
+        self.corrupted = False
+        self._rx_buffer.clear()
+
+    def next_frame(self, slave_id, function_code):
+        """
+        Busca en el buffer la respuesta de `slave_id` a `function_code` (normal
+        o de excepción) con CRC válido. Si la encuentra la consume y devuelve
+        una memoryview del frame completo; si no, descarta los bytes que ya no
+        pueden formar parte de ella y devuelve None (hay que recibir más).
+        """
+        data = self._rx_buffer.peek(len(self._rx_buffer))
+        total = len(data)
+        exception_code = function_code | 0x80
+        first_incomplete = None # Primer candidato que aún puede completarse
+        pos = 0
+        while pos < total:
+            matches = data[pos] == slave_id and (total - pos < 2 or data[pos + 1] in (function_code, exception_code))
+            length = self.frame_length(data, pos)
+            if not length or pos + length > total:
+                if matches and length is not None and first_incomplete is None:
+                    first_incomplete = pos
+                pos += 1
+                continue
+
+            ok = ModbusProtocol.check_rtu_crc(data[pos:pos + length])[0]
+            if ok and matches:
+                self._discard(pos)
+                return self._rx_buffer.consume(length)
+            if ok:
+                # Frame íntegro pero no es el nuestro: saltarlo entero
+                self.discarded_frames += 1
+                if self._log:
+                    self._log("WARN", f"Frame RTU ajeno descartado (Slave: {data[pos]}, FuncCode: 0x{data[pos + 1]:02X}, {length} bytes).", layer="RTU_ERROR")
+                pos += length
+                continue
+            if matches:
+                self.crc_errors += 1
+                self.corrupted = True
+                if self._log:
+                    self._log("ERROR", f"CRC ERROR en frame candidato ({length} bytes): {data[pos:pos + length].hex()}. Resincronizando...", layer="RTU_ERROR")
+            pos += 1
+
+        # Nada válido aún: conservar sólo desde el primer candidato incompleto
+        self._discard(total if first_incomplete is None else first_incomplete)
+        return None
+
+    def _discard(self, num_bytes):
+        if num_bytes:
+            self.discarded_bytes += num_bytes
+            if self._log:
+                self._log("WARN", f"Resincronización RTU: {num_bytes} bytes descartados.", layer="RTU_ERROR")
+            self._rx_buffer.skip(num_bytes)
@@ -1,14 +1,20 @@
 import socket
-import struct
 import time
 import threading
-import crcmod.predefined # Para calcular CRC
 
-from .exceptions import ConnectionException, ModbusIOException, ModbusInvalidResponseException
-from .formatter import DataFormatter
+from .exceptions import ModbusException, ConnectionException, ModbusIOException, ModbusInvalidResponseException, ModbusTimeoutException
+from .recv_buffer import RecvBuffer
+from .frame_cache import FrameCache
+from .rtu_framer import RtuFramer, RTU_RESYNC_TIMEOUT
+from .socket_options import apply_tcp_keepalive
+from .rtt_estimator import RttEstimator, transfer_size
+from .protocol import (ModbusProtocol, FC_READ_HOLDING_REGISTERS, FC_READ_INPUT_REGISTERS, FC_WRITE_SINGLE_REGISTER,
+                       FC_WRITE_MULTIPLE_REGISTERS, FC_READ_WRITE_MULTIPLE_REGISTERS, DIAG_RETURN_QUERY_DATA, MAX_RW_WRITE_QUANTITY)
 
-# Función CRC Modbus (RTU)
-crc16_func = crcmod.predefined.mkPredefinedCrcFun('modbus')
+# Silencio de línea (s) que cierra un frame: tras un timeout no se envía nada hasta observarlo
+RTU_SILENCE = 0.02
+# Tiempo máximo (s) esperando la respuesta tardía tras un timeout para descartarla
+RTU_DRAIN_MAX = 0.5
 
 class ModbusRtuOverTcpClient:
     """
@@ -21,29 +27,29 @@ class ModbusRtuOverTcpClient:
         # transaction_id no se usa en RTU framing
         self.is_connected = False
         self.connection_start_time = None
+        self.last_activity = None # time.monotonic() del último frame válido recibido (también excepciones Modbus)
+        self.tcp_keepalive = None # Opciones de keepalive TCP del sistema (ver set_tcp_keepalive)
         self._log_service = None
         self._client_lock = threading.Lock() # Lock para operaciones del socket
         self.timeout = 5 # Timeout por defecto para operaciones de socket
+        self.rtt_estimator = RttEstimator() # Plazo de cada petición según el RTT medido de su unidad
+        self._late_response = False # Una unidad agotó su plazo: su respuesta puede llegar aún
+        self._rx_buffer = RecvBuffer() # Buffer de recepción preasignado (recv_into, sin copias)
+        self._framer = RtuFramer(self._rx_buffer, self._log) # Delimita frames y resincroniza tras ruido
+        self._frame_cache = FrameCache() # Frames de lectura precompilados (CRC incluido)
+        self._rx_buffer_scratch = bytearray(256) # Destino de los bytes descartados tras un timeout
 
     def set_log_service(self, log_service):
         self._log_service = log_service
 
-    def _log(self, level, message, layer="MODBUS_CLIENT"):  # O RTU_CLIENT
+    def _log(self, level, message, *args, layer="MODBUS_CLIENT"):  # O RTU_CLIENT
+        """Argumentos estilo % (formateo diferido); con el nivel desactivado no se formatea nada."""
         if self._log_service:
-            log_msg = f"[{layer}] {message}"
-            if level == "DEBUG":
-                self._log_service.log_debug(log_msg)
-            elif level == "INFO":
-                self._log_service.log_info(log_msg)
-            elif level == "WARN":
-                self._log_service.log_warning(log_msg)
-            elif level == "ERROR":
-                self._log_service.log_error(log_msg)
-            elif level == "CRITICAL":
-                self._log_service.log_critical(log_msg)
-            else:  # Default a debug si nivel es desconocido
-                self._log_service.log_debug(f"[UNKNOWN_LVL:{level}] {log_msg}")
+            self._log_service.log(level, message, *args, layer=layer)
 
+    def _log_enabled(self, level):
+        """True si `level` está activo. Los hot paths lo consultan antes de construir argumentos caros (hex de frames)."""
+        return self._log_service is not None and self._log_service.is_enabled_for(level)
     def connect(self, ip, port, timeout=5):
         """Establece conexión TCP (síncrona). Lanza excepción en fallo."""
         with self._client_lock:
@@ -61,9 +67,13 @@ class ModbusRtuOverTcpClient:
                 temp_sock.settimeout(self.timeout)
                 temp_sock.connect((self.ip, self.port))
 
+                if self.tcp_keepalive:
+                    self._log("INFO", f"Keepalive TCP: {apply_tcp_keepalive(temp_sock, **self.tcp_keepalive)}", layer="SOCKET")
                 self.sock = temp_sock
+                self._rx_buffer.clear() # Descartar restos de una conexión anterior
                 self.is_connected = True
                 self.connection_start_time = time.time()
+                self.last_activity = time.monotonic()
                 self._log("INFO", f"Conexión TCP establecida para RTU over TCP con {self.ip}:{self.port}", layer="SOCKET")
 
             except socket.timeout:
@@ -82,6 +92,7 @@ class ModbusRtuOverTcpClient:
         self.sock = None
         self.is_connected = False
         self.connection_start_time = None
+        self._late_response = False
 
     def disconnect(self, acquire_lock=True):
         """Cierra la conexión del socket."""
@@ -107,125 +118,163 @@ class ModbusRtuOverTcpClient:
             return time.time() - self.connection_start_time
         return 0
 
+    def set_tcp_keepalive(self, options):
+        """
+        Configura el keepalive TCP del sistema (dict idle/interval/count, o None
+        para no tocarlo). Se aplica en cada connect() y, si ya hay socket, ahora.
+        """
+        self.tcp_keepalive = dict(options) if options else None
+        sock = self.sock
+        if sock and self.tcp_keepalive:
+            applied = apply_tcp_keepalive(sock, **self.tcp_keepalive)
+            self._log("INFO", f"Keepalive TCP aplicado: {applied}", layer="SOCKET")
+
+    def set_timeout_limits(self, floor=None, ceiling=None):
+        """Límites (s) del plazo adaptativo de las peticiones."""
+        self.rtt_estimator.set_limits(floor, ceiling)
+
+    def _timeout_error(self, unit_id, timeout, size=0):
+        """
+        Excepción para una petición sin respuesta en plazo. Normalmente sólo
+        falla esa unidad (ModbusTimeoutException) y el socket se conserva; si
+        varias unidades distintas han dejado de responder seguidas el enlace
+        está muerto (ConnectionException).
+        """
+        if self.rtt_estimator.record_timeout(unit_id, size):
+            return ConnectionException(f"Timeout en comunicación Modbus RTU over TCP (Slave: {unit_id}).")
+        return ModbusTimeoutException(f"Slave {unit_id}: sin respuesta en {timeout * 1000:.0f} ms.")
+
+    def _drain_late_response(self, max_wait):
+        """
+        Justo tras un timeout: RTU no tiene TID, así que una respuesta tardía
+        que llegara después del siguiente envío se aceptaría como la nueva si
+        coincide esclavo y función (p.ej. al reintentar la misma lectura).
+        Se espera como mucho `max_wait` a que empiece a llegar y se descarta
+        hasta observar RTU_SILENCE s de línea en silencio (fin de frame).
+        """
+        deadline = time.monotonic() + max_wait; received = False
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.sock.settimeout(min(remaining, RTU_SILENCE) if received else remaining)
+                if not self.sock.recv_into(self._rx_buffer_scratch):
+                    break # Conexión cerrada: el próximo envío lo detectará
+                received = True
+        except socket.timeout:
+            pass # Silencio: la línea está libre
+        except OSError as e:
+            self._log("WARN", f"Error descartando respuesta tardía: {e}", layer="SOCKET")
+        finally:
+            if self.sock: self.sock.settimeout(self.timeout)
+        if received:
+            self._log("DEBUG", "Respuesta tardía descartada tras timeout.", layer="RTU_RECV")
+
+    def _discard_late_bytes(self):
+        """
+        Antes del siguiente envío, descarta sin esperar lo que haya llegado
+        tras _drain_late_response (restos de una respuesta muy tardía); el
+        framer sólo aceptaría un frame ajeno si coincide esclavo, función y CRC.
+        """
+        self._late_response = False
+        self.sock.settimeout(0.0)
+        try:
+            while self.sock.recv_into(self._rx_buffer_scratch): pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
     def _build_rtu_frame(self, slave_id, function_code, starting_address, quantity):
-        """Construye el PDU Modbus y le añade SlaveID y CRC16."""
+        """Frame RTU de lectura (SlaveID + PDU + CRC16), precompilado y cacheado: no cambia entre escaneos."""
         # PDU (Protocol Data Unit) para Read Holding Registers (0x03)
-        pdu = struct.pack('>BHH', function_code, starting_address, quantity)
-        # Frame RTU sin CRC: SlaveID + PDU
-        frame_no_crc = struct.pack('>B', slave_id) + pdu
-        # Calcular CRC16
-        crc = crc16_func(frame_no_crc)
+        return self._frame_cache.get((slave_id, function_code, starting_address, quantity), lambda: self._build_rtu_pdu_frame(
+            slave_id, ModbusProtocol.build_read_pdu(function_code, starting_address, quantity)))
+
+    def _build_rtu_pdu_frame(self, slave_id, pdu):
+        """Añade SlaveID y CRC16 a un PDU cualquiera."""
         # Frame completo: SlaveID + PDU + CRC16 (Little-Endian)
-        rtu_frame = frame_no_crc + struct.pack('<H', crc) # '<H' es unsigned short little-endian
-        self._log("DEBUG", f"Frame RTU construido (Slave: {slave_id}): {rtu_frame.hex()}", layer="RTU_SENT")
+        rtu_frame = ModbusProtocol.build_rtu_frame(slave_id, pdu)
+        if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+            self._log("DEBUG", "Frame RTU construido (Slave: %s): %s", slave_id, rtu_frame.hex(), layer="RTU_SENT")
         return rtu_frame
 
-    def _recv_all(self, num_bytes):
-        """Lee exactamente num_bytes del socket."""
+    def _recv_more(self, deadline):
+        """Recibe lo que haya disponible (al menos 1 byte más) en el buffer, con timeout total acotado por `deadline`."""
         if not self.sock: raise ConnectionException("Socket no disponible para recv.")
-        self.sock.settimeout(self.timeout) # Asegurar timeout para cada lectura
-        data = bytearray()
-        start_recv_time = time.monotonic()
-        while len(data) < num_bytes:
-             time_elapsed = time.monotonic() - start_recv_time
-             if time_elapsed > self.timeout:
-                  self._log("ERROR", f"Timeout parcial al leer {num_bytes} bytes (recibidos {len(data)}).", layer="SOCKET")
-                  self.disconnect(acquire_lock=False)
-                  raise socket.timeout(f"Timeout parcial esperando datos (recibidos {len(data)}/{num_bytes})")
-
-             remaining_timeout = self.timeout - time_elapsed
-             self.sock.settimeout(remaining_timeout) # Ajustar timeout restante
-
-             try:
-                 packet = self.sock.recv(num_bytes - len(data))
-                 if not packet:
-                     self._log("ERROR", f"Conexión cerrada por peer mientras se esperaban {num_bytes} bytes (recibidos {len(data)}).", layer="SOCKET")
-                     self.disconnect(acquire_lock=False)
-                     raise ConnectionException("Conexión cerrada inesperadamente por el servidor.")
-                 data.extend(packet)
-             except socket.timeout: # Timeout específico de esta llamada recv
-                 self._log("ERROR", f"Timeout final al esperar el resto de {num_bytes} bytes (recibidos {len(data)}).", layer="SOCKET")
-                 self.disconnect(acquire_lock=False)
-                 raise socket.timeout(f"Timeout final esperando datos (recibidos {len(data)}/{num_bytes})")
-             except Exception as e:
-                  self._log("ERROR", f"Error inesperado durante recv: {e}", layer="SOCKET")
-                  self.disconnect(acquire_lock=False)
-                  raise ConnectionException(f"Error de socket durante recv: {e}")
-
-        return bytes(data)
-
-
-    def _verify_crc(self, frame_with_crc):
-        """Verifica el CRC16 de un frame RTU recibido."""
-        if len(frame_with_crc) < 3: # Mínimo: SlaveID+FuncCode+CRC(2) o SlaveID+ErrCode+ExCode+CRC(2)
-            return False
-        data_part = frame_with_crc[:-2]
-        received_crc_bytes = frame_with_crc[-2:]
-        received_crc = struct.unpack('<H', received_crc_bytes)[0] # Little-Endian
-        calculated_crc = crc16_func(data_part)
-        if received_crc != calculated_crc:
-             self._log("ERROR", f"CRC ERROR! Recibido: 0x{received_crc:04X}, Calculado: 0x{calculated_crc:04X} para datos: {data_part.hex()}", layer="RTU_ERROR")
-             return False
-        # self._log("DEBUG", f"CRC OK (0x{received_crc:04X}) para datos: {data_part.hex()}", layer="RTU_RECV")
-        return True
-
-    def _send_request_rtu(self, request_rtu_frame, expected_response_len_func):
+        try:
+            self._rx_buffer.fill(self.sock, len(self._rx_buffer) + 1, deadline)
+        except (socket.timeout, ConnectionException):
+            raise
+        except Exception as e:
+            raise ConnectionException(f"Error de socket durante recv: {e}")
+
+    def _send_request_rtu(self, request_rtu_frame, parse_func):
         """
-        Envía un frame RTU y maneja la recepción de la respuesta
-        basándose en la longitud esperada o detectando errores.
-        `expected_response_len_func` es una función que, dado el inicio de la
-        respuesta (slave_id, func_code), devuelve cuántos bytes *adicionales* leer.
+        Envía un frame RTU y espera su respuesta. El RtuFramer delimita el
+        frame por código de función/ByteCount y verifica el CRC; el ruido, los
+        frames corruptos y las respuestas ajenas se descartan sin cerrar la
+        conexión. `parse_func(rx_slave_id, response_pdu)` decodifica el PDU
+        (memoryview sobre el buffer de recepción, sin copias) y su resultado
+        se devuelve.
         """
+        slave_id, function_code = request_rtu_frame[0], request_rtu_frame[1]
+        size = transfer_size(memoryview(request_rtu_frame)[1:-2])
         with self._client_lock:
             if not self.is_connected or not self.sock:
                 raise ConnectionException("No conectado al servidor Modbus.")
 
             try:
-                self._log("DEBUG", f"Enviando frame RTU ({len(request_rtu_frame)} bytes): {request_rtu_frame.hex()}", layer="TCP")
+                if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                    self._log("DEBUG", "Enviando frame RTU (%s bytes): %s", len(request_rtu_frame), request_rtu_frame.hex(), layer="TCP")
+                if self._late_response:
+                    self._discard_late_bytes()
+                self._framer.reset()
+                timeout = self.rtt_estimator.timeout(slave_id, size)
                 self.sock.sendall(request_rtu_frame)
-
-                # Leer inicio de respuesta (SlaveID + Function Code)
-                self._log("DEBUG", "Esperando inicio de respuesta RTU (2 bytes)...", layer="RTU_RECV")
-                initial_bytes = self._recv_all(2) # Slave ID (1) + Func Code (1)
-                rx_slave_id, rx_func_code = struct.unpack('>BB', initial_bytes)
-                self._log("DEBUG", f"Recibido inicio RTU: SlaveID={rx_slave_id}, FuncCode=0x{rx_func_code:02X}", layer="RTU_RECV")
-
-                # Determinar si es una respuesta de error
-                is_error = (rx_func_code & 0x80) != 0
-                bytes_to_read_more = 0
-
-                if is_error:
-                    # Error: Leer Exception Code (1 byte) + CRC (2 bytes) = 3 bytes más
-                    bytes_to_read_more = 1 + 2
-                    self._log("DEBUG", f"Respuesta de error detectada. Esperando {bytes_to_read_more} bytes más (ExCode + CRC)...", layer="RTU_RECV")
-                else:
-                    # Respuesta normal: usar la función para determinar longitud restante
-                    bytes_to_read_more = expected_response_len_func(rx_slave_id, rx_func_code)
-                    if bytes_to_read_more < 2: # Debe incluir al menos el CRC
-                         raise ModbusInvalidResponseException(f"Función de longitud esperada devolvió un valor inválido ({bytes_to_read_more}). Debe ser >= 2.")
-                    self._log("DEBUG", f"Respuesta normal. Esperando {bytes_to_read_more} bytes más (Datos + CRC)...", layer="RTU_RECV")
-
-                # Leer el resto de la respuesta
-                remaining_bytes = self._recv_all(bytes_to_read_more)
-                full_response_frame = initial_bytes + remaining_bytes
-                self._log("DEBUG", f"Frame RTU completo recibido ({len(full_response_frame)} bytes): {full_response_frame.hex()}", layer="RTU_RECV")
-
-                # Verificar CRC
-                if not self._verify_crc(full_response_frame):
-                     raise ModbusInvalidResponseException("Fallo de verificación CRC en la respuesta.")
-
-                # Extraer PDU (quitar SlaveID y CRC)
-                pdu_bytes = full_response_frame[1:-2] # Índice 1 hasta 2 antes del final
-
-                return rx_slave_id, pdu_bytes # Devolver PDU para procesamiento
+                sent_at = time.monotonic(); deadline = sent_at + timeout
+
+                # Pedir lo que haya disponible hasta que el framer encuentre la
+                # respuesta; normalmente llega completa en el primer recv_into
+                while True:
+                    full_response_frame = self._framer.next_frame(slave_id, function_code)
+                    if full_response_frame is not None:
+                        self.last_activity = time.monotonic()
+                        self.rtt_estimator.record(slave_id, self.last_activity - sent_at, size)
+                        break
+                    if self._framer.corrupted:
+                        # Nuestra respuesta llegó dañada: sólo esperar un posible reenvío/resto breve
+                        deadline = min(deadline, time.monotonic() + RTU_RESYNC_TIMEOUT)
+                    try:
+                        self._recv_more(deadline)
+                    except socket.timeout:
+                        if self._framer.corrupted:
+                            # El stream sigue sincronizado: no hace falta reconectar
+                            raise ModbusInvalidResponseException("Fallo de verificación CRC en la respuesta.")
+                        raise
+
+                if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                    self._log("DEBUG", "Frame RTU completo recibido (%s bytes): %s", len(full_response_frame), full_response_frame.hex(), layer="RTU_RECV")
+                # Decodificar el PDU (quitar SlaveID y CRC) antes de liberar el buffer
+                return parse_func(full_response_frame[0], full_response_frame[1:-2])
 
             except socket.timeout as e:
+                error = self._timeout_error(slave_id, timeout, size)
+                if isinstance(error, ModbusTimeoutException):
+                    self._log("WARN", f"Timeout adaptativo: {error}", layer="SOCKET")
+                    self._drain_late_response(min(timeout, RTU_DRAIN_MAX))
+                    self._late_response = True
+                    raise error from e
                 self._log("ERROR", f"Timeout durante send/recv RTU: {e}", layer="SOCKET")
-                # disconnect ya se llama dentro de _recv_all en caso de timeout
-                raise ConnectionException(f"Timeout en comunicación Modbus RTU over TCP: {e}") from e
-            except (ConnectionException, ModbusException) as e:
-                 # Errores ya logueados y desconectados internamente si es necesario
-                 raise e # Re-lanzar
+                self.disconnect(acquire_lock=False)
+                raise error from e
+            except ConnectionException as e:
+                 self._log("ERROR", f"Error de conexión en send/recv RTU: {e}", layer="SOCKET")
+                 self.disconnect(acquire_lock=False)
+                 raise
+            except ModbusException as e:
+                 raise e # Re-lanzar (errores de protocolo: la conexión sigue siendo válida)
             except Exception as e:
                  self._log("CRITICAL", f"Error inesperado en _send_request_rtu: {e}", layer="ERROR")
                  self.disconnect(acquire_lock=False) # Forzar desconexión
@@ -233,86 +282,83 @@ class ModbusRtuOverTcpClient:
 
     def read_holding_registers(self, unit_id, starting_address, quantity):
         """Lee registros Holding (Función 0x03) usando RTU over TCP."""
-        if not (0 <= starting_address <= 65535): raise ValueError("Dirección inicial fuera de rango")
-        if not (1 <= quantity <= 125): raise ValueError("Cantidad fuera de rango (1-125)")
+        return self._read_registers(unit_id, FC_READ_HOLDING_REGISTERS, starting_address, quantity)
+
+    def read_input_registers(self, unit_id, starting_address, quantity):
+        """Lee registros Input (Función 0x04) usando RTU over TCP."""
+        return self._read_registers(unit_id, FC_READ_INPUT_REGISTERS, starting_address, quantity)
+
+    def _read_registers(self, unit_id, function_code, starting_address, quantity):
+        ModbusProtocol.validate_read_params(starting_address, quantity)
 
         slave_id = unit_id
-        function_code = 0x03
         request_frame = self._build_rtu_frame(slave_id, function_code, starting_address, quantity)
 
-        def expected_len_func_03(rx_sid, rx_fcode):
-            # Para respuesta 0x03 normal: ByteCount(1) + Data(N=ByteCount) + CRC(2)
-            # Necesitamos leer el ByteCount primero para saber N.
-            # Esta función devuelve los bytes *después* de SlaveID y FuncCode.
-            # Así que necesitamos leer ByteCount (1 byte) + CRC (2 bytes) = 3 bytes MÍNIMO.
-            # El resto depende del valor de ByteCount.
-            # *** Estrategia: Leer ByteCount, luego calcular y leer Data+CRC ***
-
-            # Leer ByteCount (1 byte)
-            self._log("DEBUG", "Leyendo ByteCount (1 byte) para respuesta 0x03...", layer="RTU_RECV")
-            byte_count_byte = self._recv_all(1)
-            byte_count = struct.unpack('>B', byte_count_byte)[0]
-            self._log("DEBUG", f"ByteCount = {byte_count}", layer="RTU_RECV")
-
-            # Validar byte_count (debe ser quantity * 2)
-            if byte_count != quantity * 2:
-                 # Esto indica un problema grave de desincronización o error del esclavo
-                 raise ModbusInvalidResponseException(f"Byte count en respuesta ({byte_count}) no coincide con cantidad solicitada ({quantity}*2 bytes).")
-
-            # Bytes restantes = Data (byte_count) + CRC (2)
-            bytes_to_read_next = byte_count + 2
-            self._log("DEBUG", f"Esperando {bytes_to_read_next} bytes más (Data + CRC)...", layer="RTU_RECV")
-
-            # DEVOLVEMOS EL NÚMERO DE BYTES A LEER *DESPUÉS* DEL BYTECOUNT
-            # La función _send_request_rtu leerá estos bytes.
-            # El frame completo será: SlaveID+FuncCode + ByteCountByte + DataBytes+CRCBytes
-            return bytes_to_read_next
-
-        # Modificar _send_request_rtu para manejar esta lectura en dos pasos
-        # O, alternativamente, simplificar y leer todo de una vez si podemos predecir:
-        # Longitud total esperada = 1 (SlaveID) + 1 (FuncCode) + 1 (ByteCount) + N (Data) + 2 (CRC)
-        # donde N = quantity * 2. Longitud total = 5 + quantity * 2 bytes.
-
-        def simpler_expected_len_func_03(rx_sid, rx_fcode):
-            # Simplemente devuelve los bytes esperados después de SlaveID+FuncCode
-            # Bytes = ByteCount(1) + Data(quantity*2) + CRC(2)
-            return 1 + (quantity * 2) + 2
-
-        # Usamos la función más simple para _send_request_rtu
-        rx_slave_id, response_pdu = self._send_request_rtu(request_frame, simpler_expected_len_func_03)
+        values = self._send_request_rtu(request_frame, lambda rx_slave_id, response_pdu: self._parse_read_response(
+            slave_id, function_code, quantity, rx_slave_id, response_pdu))
+        self._log("DEBUG", "Registros leídos (RTU) (%s regs desde %s): %s", quantity, starting_address, values, layer="MODBUS")
+        return values
 
+    def read_holding_register_blocks(self, unit_id, blocks):
+        """Lee varios bloques (starting_address, quantity); el bus RTU es half-duplex, así que van en serie."""
+        return [self.read_holding_registers(unit_id, addr, qty) for addr, qty in blocks]
+
+    def write_register(self, unit_id, address, value):
+        """Escribe un Holding Register (Función 0x06) usando RTU over TCP."""
+        ModbusProtocol.validate_write_params(address, [value])
+        request_frame = self._build_rtu_pdu_frame(unit_id, ModbusProtocol.build_write_single_pdu(address, value))
+        self._send_request_rtu(request_frame, lambda rx_slave_id, response_pdu: self._parse_write_response(
+                                   unit_id, FC_WRITE_SINGLE_REGISTER, address, value, rx_slave_id, response_pdu))
+        self._log("DEBUG", "Registro escrito (RTU) (%s = %s)", address, value, layer="MODBUS")
+
+    def write_registers(self, unit_id, starting_address, values):
+        """Escribe varios Holding Registers contiguos (Función 0x10) usando RTU over TCP."""
+        values = list(values)
+        ModbusProtocol.validate_write_params(starting_address, values)
+        request_frame = self._build_rtu_pdu_frame(unit_id, ModbusProtocol.build_write_multiple_pdu(starting_address, values))
+        self._send_request_rtu(request_frame, lambda rx_slave_id, response_pdu: self._parse_write_response(
+                                   unit_id, FC_WRITE_MULTIPLE_REGISTERS, starting_address, len(values), rx_slave_id, response_pdu))
+        self._log("DEBUG", "Registros escritos (RTU) (%s regs desde %s)", len(values), starting_address, layer="MODBUS")
+
+    def read_write_registers(self, unit_id, read_address, read_quantity, write_address, values):
+        """
+        Escribe y lee en una sola transacción (Función 0x17) usando RTU over TCP.
+        El dispositivo aplica la escritura antes de la lectura. Devuelve los valores leídos.
+        """
+        values = list(values)
+        ModbusProtocol.validate_read_params(read_address, read_quantity)
+        ModbusProtocol.validate_write_params(write_address, values, MAX_RW_WRITE_QUANTITY)
+        pdu = ModbusProtocol.build_read_write_pdu(read_address, read_quantity, write_address, values)
+        return self._send_request_rtu(
+            self._build_rtu_pdu_frame(unit_id, pdu), lambda rx_slave_id, response_pdu: self._parse_read_response(
+                unit_id, FC_READ_WRITE_MULTIPLE_REGISTERS, read_quantity, rx_slave_id, response_pdu))
+
+    def diagnostics(self, unit_id, sub_function=DIAG_RETURN_QUERY_DATA, data=0):
+        """Diagnostics (Función 0x08) usando RTU over TCP; por defecto Return Query Data (eco)."""
+        request_frame = self._build_rtu_pdu_frame(unit_id, ModbusProtocol.build_diagnostics_pdu(sub_function, data))
+        self._send_request_rtu(request_frame, lambda rx_slave_id, response_pdu: ModbusProtocol.parse_diagnostics_response(sub_function, data, response_pdu))
+
+    def _parse_read_response(self, unit_id, function_code, quantity, rx_slave_id, response_pdu):
         # Validar Slave ID recibido
-        if rx_slave_id != slave_id:
-            self._log("WARN", f"Slave ID no coincide en respuesta RTU. Esperado: {slave_id}, Recibido: {rx_slave_id}", layer="RTU_ERROR")
+        if rx_slave_id != unit_id:
+            self._log("WARN", f"Slave ID no coincide en respuesta RTU. Esperado: {unit_id}, Recibido: {rx_slave_id}", layer="RTU_ERROR")
             # Podría ser crítico dependiendo de la red
-
         # Procesar el PDU (ya sin SlaveID ni CRC, y CRC verificado)
-        rx_func_code = response_pdu[0] # Func code está al inicio del PDU
-
-        # Chequear error Modbus (ya se hizo parcialmente al leer, pero doble check)
-        if (rx_func_code & 0x80) != 0:
-            if len(response_pdu) < 2: raise ModbusInvalidResponseException("PDU de error RTU incompleto.")
-            error_code = response_pdu[1]
-            self._log("ERROR", f"Respuesta de error Modbus RTU. Código: {error_code}", layer="RTU_ERROR")
-            raise ModbusIOException(f"Error Modbus RTU recibido. Código: {error_code}", error_code=error_code)
-        elif rx_func_code != function_code:
-             raise ModbusInvalidResponseException(f"Código de función RTU incorrecto. Esperado: {function_code}, Recibido: {rx_func_code}")
-
-        # Procesar PDU normal 0x03: ByteCount(1) + Data(N)
-        if len(response_pdu) < 2: raise ModbusInvalidResponseException("PDU de respuesta 0x03 RTU incompleto.")
-        byte_count = response_pdu[1]
-        data_bytes = response_pdu[2:]
-
-        if byte_count != len(data_bytes):
-            raise ModbusInvalidResponseException(f"Byte count PDU ({byte_count}) no coincide con longitud datos PDU ({len(data_bytes)}).")
-        if byte_count != quantity * 2:
-             raise ModbusInvalidResponseException(f"Byte count PDU ({byte_count}) no coincide con cantidad solicitada ({quantity}*2 bytes).")
-
-        values = DataFormatter.parse_registers(data_bytes, quantity)
-        self._log("DEBUG", f"Registros leídos (RTU) ({quantity} regs desde {starting_address}): {values}", layer="MODBUS")
-        return values
+        try:
+            return ModbusProtocol.parse_read_response(function_code, quantity, response_pdu)
+        except ModbusIOException as e:
+            self._log("ERROR", f"Respuesta de error Modbus RTU. Código: {e.error_code}", layer="RTU_ERROR")
+            raise
+
+    def _parse_write_response(self, unit_id, function_code, starting_address, second_field, rx_slave_id, response_pdu):
+        if rx_slave_id != unit_id:
+            self._log("WARN", f"Slave ID no coincide en respuesta RTU. Esperado: {unit_id}, Recibido: {rx_slave_id}", layer="RTU_ERROR")
+        try:
+            ModbusProtocol.parse_write_response(function_code, starting_address, second_field, response_pdu)
+        except ModbusIOException as e:
+            self._log("ERROR", f"Respuesta de error Modbus RTU. Código: {e.error_code}", layer="RTU_ERROR")
+            raise
 
-    # --- Métodos para otras funciones Modbus RTU (write, read coils, etc.) ---
+    # --- Métodos para otras funciones Modbus RTU (read coils, write coils, etc.) ---
     # Seguirían un patrón similar: construir frame RTU, definir función de longitud esperada,
     # llamar a _send_request_rtu, procesar PDU.
-
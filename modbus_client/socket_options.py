@@ -0,0 +1,22 @@
+import socket
+
+
+def apply_tcp_keepalive(sock, idle=10, interval=5, count=3):
+    """
+    Activa el keepalive TCP del sistema operativo: tras `idle` s sin tráfico
+    el kernel envía sondas cada `interval` s y, si fallan `count` seguidas,
+    la conexión se da por muerta (el siguiente send/recv falla). No ocupa el
+    bus Modbus. Las opciones que la plataforma no tenga se omiten.
+    Devuelve las opciones aplicadas.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    applied = {"enabled": True}
+    # Linux: TCP_KEEPIDLE; macOS: TCP_KEEPALIVE (mismo significado)
+    idle_option = getattr(socket, "TCP_KEEPIDLE", None) or getattr(socket, "TCP_KEEPALIVE", None)
+    for name, option, value in (("idle", idle_option, idle),
+                                ("interval", getattr(socket, "TCP_KEEPINTVL", None), interval),
+                                ("count", getattr(socket, "TCP_KEEPCNT", None), count)):
+        if option is not None and value:
+            sock.setsockopt(socket.IPPROTO_TCP, option, int(value))
+            applied[name] = int(value)
+    return applied
@@ -0,0 +1,173 @@
+import sys
+import math
+import struct
+
+# Tipo -> (código struct, registros)
+TAG_TYPES = {
+    "uint16": ("H", 1), "int16": ("h", 1), "bool": ("H", 1),
+    "uint32": ("I", 2), "int32": ("i", 2), "float32": ("f", 2),
+    "uint64": ("Q", 4), "int64": ("q", 4), "float64": ("d", 4),
+}
+BYTE_ORDERS = ("big", "little")
+MERGE_GAP = 16 # Registros libres entre tags que aún se decodifican en el mismo bloque
+
+_NATIVE_IS_WIRE = sys.byteorder == "big" # array('H').tobytes() ya está en orden de red (big-endian por registro)
+
+
+class Tag:
+    """
+    Definición de un tag: `type` en TAG_TYPES, a partir de `address`.
+    `byte_order` es el orden de los bytes dentro de cada registro y
+    `word_order` el de los registros (big = el primero es el más
+    significativo; "little" en word_order es el clásico word swap, CDAB).
+    Con `bit` (y `bits`) se extrae un campo de bits del valor. El valor
+    final es raw * scale + offset.
+    """
+    __slots__ = ("name", "address", "type", "byte_order", "word_order", "scale", "offset", "bit", "bits", "registers")
+
+    def __init__(self, name, address, type="uint16", byte_order="big", word_order="big", scale=1, offset=0, bit=None, bits=None):
+        if type not in TAG_TYPES:
+            raise ValueError(f"Tipo de tag '{type}' desconocido. Válidos: {', '.join(TAG_TYPES)}")
+        if byte_order not in BYTE_ORDERS or word_order not in BYTE_ORDERS:
+            raise ValueError(f"Orden inválido (byte_order/word_order: {', '.join(BYTE_ORDERS)}).")
+        self.name = str(name)
+        self.address = int(address)
+        self.type = type
+        self.byte_order = byte_order
+        self.word_order = word_order
+        self.scale = float(scale)
+        self.offset = float(offset)
+        self.registers = TAG_TYPES[type][1]
+        if not (0 <= self.address <= 65536 - self.registers):
+            raise ValueError(f"Tag '{self.name}': dirección fuera de rango ({self.address}).")
+        self.bit = None if bit is None else int(bit)
+        self.bits = 1 if bits is None else int(bits)
+        if type == "bool" and self.bit is None:
+            self.bit = 0
+        if self.bit is not None:
+            if type.startswith("float"):
+                raise ValueError(f"Tag '{self.name}': 'bit' no aplica a {type}.")
+            if not (0 <= self.bit and 1 <= self.bits and self.bit + self.bits <= 16 * self.registers):
+                raise ValueError(f"Tag '{self.name}': campo de bits fuera del valor ({self.bit}+{self.bits}).")
+
+    @classmethod
+    def from_dict(cls, definition):
+        if not isinstance(definition, dict) or "name" not in definition or "address" not in definition:
+            raise ValueError("Cada tag necesita al menos 'name' y 'address'.")
+        return cls(**{key: definition[key] for key in cls.__slots__ if key in definition and key != "registers"})
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__ if key != "registers"}
+
+
+class _CompiledBlock:
+    """
+    Decodificador de un tramo contiguo [start, start + count): los bytes del
+    tramo se colocan cuatro veces en un buffer (orden de red, bytes de cada
+    registro intercambiados, y ambos invertidos), así cualquier combinación
+    de byte/word order es una lectura big-endian en algún desplazamiento y
+    todos los tags del tramo salen de un único unpack_from con un Struct
+    precompilado (uno más por cada tag que se solape con otro de tipo u
+    orden distinto).
+    """
+    __slots__ = ("start", "count", "passes", "indexes")
+
+    # Structs precompilados por formato (compartidos entre bloques con el mismo layout)
+    _structs = {}
+
+    def __init__(self, start, count, tags):
+        self.start = start
+        self.count = count
+        self.indexes = [index for index, _ in tags]
+        size = 2 * count
+        fields = {} # (desplazamiento en el buffer, código struct, bytes) -> índices de tag (varios: p.ej. bits del mismo registro)
+        for index, tag in tags:
+            code, registers = TAG_TYPES[tag.type]
+            width = 2 * registers
+            position = 2 * (tag.address - start)
+            word_order = tag.word_order if registers > 1 else tag.byte_order
+            swapped = registers > 1 and tag.byte_order != tag.word_order
+            quadrant = (1 if swapped else 0) + (2 if word_order == "little" else 0)
+            offset = quadrant * size + (size - position - width if word_order == "little" else position)
+            fields.setdefault((offset, code, width), []).append(index)
+        self.passes = [] # [(Struct, [[índices de tag] por campo])]: normalmente uno
+        remaining = sorted(fields.items())
+        while remaining:
+            layout, overlapping, end = [], [], 0
+            for field in remaining:
+                (layout if field[0][0] >= end else overlapping).append(field)
+                if field[0][0] >= end:
+                    end = field[0][0] + field[0][2]
+            fmt, position = ">", 0
+            for (offset, code, width), _ in layout:
+                fmt += (f"{offset - position}x" if offset > position else "") + code
+                position = offset + width
+            compiled = self._structs.get(fmt)
+            if compiled is None:
+                compiled = self._structs[fmt] = struct.Struct(fmt)
+            self.passes.append((compiled, [indexes for _, indexes in layout]))
+            remaining = overlapping
+
+    def decode(self, values, raw):
+        """Escribe en `raw` (por índice de tag) los valores crudos, leyendo del array('H') indexado por dirección."""
+        block = values[self.start:self.start + self.count]
+        native = block.tobytes()
+        block.byteswap()
+        swapped = block.tobytes()
+        wire, swapped = (native, swapped) if _NATIVE_IS_WIRE else (swapped, native)
+        buffer = b"".join((wire, swapped, wire[::-1], swapped[::-1]))
+        for compiled, fields in self.passes:
+            for indexes, value in zip(fields, compiled.unpack_from(buffer)):
+                for index in indexes:
+                    raw[index] = value
+
+
+class TagDecoder:
+    """
+    Tags compilados de un mapa: agrupa los tags en tramos contiguos (huecos
+    de hasta MERGE_GAP registros) y compila un _CompiledBlock por tramo. La
+    decodificación es una llamada a struct por tramo, más el escalado y los
+    campos de bits de los tags que los usan.
+    """
+    def __init__(self, tags):
+        self.tags = list(tags)
+        names = [tag.name for tag in self.tags]
+        if len(set(names)) != len(names):
+            raise ValueError("Nombres de tag repetidos.")
+        self.blocks = []
+        spans = [] # [inicio, fin, [(índice, tag)]]
+        for index, tag in sorted(enumerate(self.tags), key=lambda item: item[1].address):
+            end = tag.address + tag.registers
+            if spans and tag.address <= spans[-1][1] + MERGE_GAP:
+                spans[-1][1] = max(spans[-1][1], end); spans[-1][2].append((index, tag))
+            else:
+                spans.append([tag.address, end, [(index, tag)]])
+        self.blocks = [_CompiledBlock(start, end - start, tags) for start, end, tags in spans]
+        # Post-proceso sólo de los tags que lo necesitan
+        self._bitfields = [(index, tag.bit, (1 << tag.bits) - 1, tag.type == "bool") for index, tag in enumerate(self.tags) if tag.bit is not None]
+        self._scaled = [(index, tag.scale, tag.offset) for index, tag in enumerate(self.tags) if tag.scale != 1 or tag.offset != 0]
+
+    @classmethod
+    def from_definitions(cls, definitions):
+        return cls([Tag.from_dict(definition) for definition in definitions])
+
+    def decode(self, values, is_valid=None):
+        """
+        {nombre: valor} a partir de la imagen de registros (array('H') indexado
+        por dirección). `is_valid(start, end)` opcional: los tags con
+        registros aún no leídos valen None. Floats no finitos (NaN, inf) también.
+        """
+        raw = [None] * len(self.tags)
+        invalid = set()
+        for block in self.blocks:
+            block.decode(values, raw)
+            if is_valid is not None and not is_valid(block.start, block.start + block.count): # Sólo entonces, tag a tag
+                invalid.update(index for index in block.indexes if not is_valid(self.tags[index].address, self.tags[index].address + self.tags[index].registers))
+        for index, bit, mask, as_bool in self._bitfields:
+            field = (raw[index] >> bit) & mask
+            raw[index] = bool(field) if as_bool else field
+        for index, scale, offset in self._scaled:
+            raw[index] = raw[index] * scale + offset
+        for index in invalid:
+            raw[index] = None
+        return {tag.name: None if isinstance(value, float) and not math.isfinite(value) else value for tag, value in zip(self.tags, raw)}
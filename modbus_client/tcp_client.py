@@ -3,44 +3,72 @@ import struct
 import time
 # import logging # Ya no usamos logging interno, usamos el LogService inyectado
 import threading # Para obtener nombre de hilo
-from .exceptions import ConnectionException, ModbusIOException, ModbusInvalidResponseException
-from .formatter import DataFormatter
+from collections import deque
+from .exceptions import ModbusException, ConnectionException, ModbusIOException, ModbusInvalidResponseException, ModbusTimeoutException
+from .recv_buffer import RecvBuffer
+from .frame_cache import FrameCache
+from .socket_options import apply_tcp_keepalive
+from .rtt_estimator import RttEstimator, transfer_size
+from .protocol import (ModbusProtocol, MBAP_HEADER_SIZE, FC_READ_HOLDING_REGISTERS, FC_READ_INPUT_REGISTERS, FC_WRITE_SINGLE_REGISTER,
+                       FC_WRITE_MULTIPLE_REGISTERS, FC_READ_WRITE_MULTIPLE_REGISTERS, DIAG_RETURN_QUERY_DATA, MAX_RW_WRITE_QUANTITY)
 
 # logger = logging.getLogger(__name__) # Quitar
 
+_TID_STRUCT = struct.Struct('>H') # Transaction ID al inicio de la cabecera MBAP
+
+
+class _PendingTransaction:
+    """Transacción en vuelo en modo pipelining (una por TID)."""
+    __slots__ = ("tid", "unit_id", "size", "sent_at", "event", "response", "error")
+
+    def __init__(self, tid, unit_id, size=0):
+        self.tid = tid
+        self.unit_id = unit_id
+        self.size = size # Bytes de petición + respuesta (plazo por tamaño)
+        self.sent_at = None # time.monotonic() del envío (muestra de RTT)
+        self.event = threading.Event()
+        self.response = None # (rx_unit_id, pdu_bytes)
+        self.error = None
+
+
 class ModbusTCPClient:
-    def __init__(self):
+    def __init__(self, pipeline_window=1):
         self.ip = None
         self.port = None
         self.sock = None
         self.transaction_id = 0
         self.is_connected = False
         self.connection_start_time = None
+        self.last_activity = None # time.monotonic() de la última respuesta recibida (también excepciones Modbus)
+        self.tcp_keepalive = None # Opciones de keepalive TCP del sistema (ver set_tcp_keepalive)
+        self.timeout = 5 # Timeout por defecto para operaciones de socket
+        self.rtt_estimator = RttEstimator() # Plazo de cada petición según el RTT medido de su unidad
         self._log_service = None # Cambiar nombre para claridad
         self._client_lock = threading.Lock() # Lock para operaciones del socket
+        self._rx_buffer = RecvBuffer() # Buffer de recepción preasignado (recv_into, sin copias); en pipelining cada receptor tiene el suyo
+        self._frame_cache = FrameCache() # Plantillas MBAP de lectura precompiladas
+        self._tid_lock = threading.Lock() # Asignación atómica de Transaction IDs
+        # --- Modo pipelining (pipeline_window > 1) ---
+        # Varias transacciones MBAP en vuelo por socket; un hilo receptor
+        # despacha cada respuesta al llamante que espera ese TID.
+        self.pipeline_window = max(1, int(pipeline_window))
+        self._window = threading.BoundedSemaphore(self.pipeline_window)
+        self._pending = {} # TID -> _PendingTransaction de la conexión actual (cada conexión tiene su tabla)
+        self._pending_lock = threading.Lock()
+        self._receiver_thread = None
 
     def set_log_service(self, log_service):
         """Establece el servicio de logging a usar."""
         self._log_service = log_service
 
-    def _log(self, level, message, layer="MODBUS_CLIENT"):  # O RTU_CLIENT
+    def _log(self, level, message, *args, layer="MODBUS_CLIENT"):  # O RTU_CLIENT
+        """Argumentos estilo % (formateo diferido); con el nivel desactivado no se formatea nada."""
         if self._log_service:
-            log_msg = f"[{layer}] {message}"
-            if level == "DEBUG":
-                self._log_service.log_debug(log_msg)
-            elif level == "INFO":
-                self._log_service.log_info(log_msg)
-            elif level == "WARN":
-                self._log_service.log_warning(log_msg)
-            elif level == "ERROR":
-                self._log_service.log_error(log_msg)
-            elif level == "CRITICAL":
-                self._log_service.log_critical(log_msg)
-            else:  # Default a debug si nivel es desconocido
-                self._log_service.log_debug(f"[UNKNOWN_LVL:{level}] {log_msg}")
-        # else: # Opcional: imprimir si no hay logger
-        #     print(f"[{level}][{layer}] {message}")
+            self._log_service.log(level, message, *args, layer=layer)
 
+    def _log_enabled(self, level):
+        """True si `level` está activo. Los hot paths lo consultan antes de construir argumentos caros (hex de frames)."""
+        return self._log_service is not None and self._log_service.is_enabled_for(level)
 
     def connect(self, ip, port, timeout=5):
         """Establece conexión (síncrona). Lanza excepción en fallo."""
@@ -58,7 +86,9 @@ class ModbusTCPClient:
 
             self.ip = ip
             self.port = port
+            self.timeout = timeout
             self.transaction_id = 0 # Resetear en cada conexión
+            self._rx_buffer.clear() # Descartar restos de una conexión anterior
 
             self._log("INFO", f"Intentando conectar a {self.ip}:{self.port} (Timeout: {timeout}s)...", layer="SOCKET")
             temp_sock = None # Usar socket temporal para no afectar self.sock hasta éxito
@@ -68,10 +98,15 @@ class ModbusTCPClient:
                 temp_sock.connect((self.ip, self.port))
 
                 # Éxito, ahora actualizar estado del cliente
+                if self.tcp_keepalive:
+                    self._log("INFO", f"Keepalive TCP: {apply_tcp_keepalive(temp_sock, **self.tcp_keepalive)}", layer="SOCKET")
                 self.sock = temp_sock
                 self.is_connected = True
                 self.connection_start_time = time.time()
+                self.last_activity = time.monotonic()
                 self._log("INFO", f"Conexión establecida con {self.ip}:{self.port}", layer="SOCKET")
+                if self.is_pipelined():
+                    self._start_receiver(temp_sock)
                 # No retornamos True/False, el éxito es no lanzar excepción
 
             except socket.timeout:
@@ -100,7 +135,10 @@ class ModbusTCPClient:
                 self._log("INFO", "Cerrando socket...", layer="SOCKET")
                 try:
                     # Shutdown puede ayudar a cerrar limpiamente en algunos casos
-                    # self.sock.shutdown(socket.SHUT_RDWR)
+                    if self._receiver_thread:
+                        # Despierta al hilo receptor bloqueado en recv()
+                        try: self.sock.shutdown(socket.SHUT_RDWR)
+                        except OSError: pass
                     self.sock.close()
                     self._log("INFO", "Socket cerrado.", layer="SOCKET")
                 except Exception as e:
@@ -109,6 +147,7 @@ class ModbusTCPClient:
                     self.sock = None
                     self.is_connected = False
                     self.connection_start_time = None
+                    self._receiver_thread = None
             else:
                 # Loguear sólo si no se espera que esté desconectado
                 # self._log("DEBUG", "Intento de desconectar sin socket activo.", layer="SOCKET")
@@ -124,75 +163,124 @@ class ModbusTCPClient:
             return time.time() - self.connection_start_time
         return 0
 
+    def set_tcp_keepalive(self, options):
+        """
+        Configura el keepalive TCP del sistema (dict idle/interval/count, o None
+        para no tocarlo). Se aplica en cada connect() y, si ya hay socket, ahora.
+        """
+        self.tcp_keepalive = dict(options) if options else None
+        sock = self.sock
+        if sock and self.tcp_keepalive:
+            applied = apply_tcp_keepalive(sock, **self.tcp_keepalive)
+            self._log("INFO", f"Keepalive TCP aplicado: {applied}", layer="SOCKET")
+
+    def set_timeout_limits(self, floor=None, ceiling=None):
+        """Límites (s) del plazo adaptativo de las peticiones."""
+        self.rtt_estimator.set_limits(floor, ceiling)
+
+    def _timeout_error(self, unit_id, timeout, size=0):
+        """
+        Excepción para una petición sin respuesta en plazo. Normalmente sólo
+        falla esa unidad (ModbusTimeoutException) y el socket se conserva: las
+        respuestas tardías se descartan por TID. Si varias unidades distintas
+        han dejado de responder seguidas el enlace está muerto (ConnectionException).
+        """
+        if self.rtt_estimator.record_timeout(unit_id, size):
+            return ConnectionException(f"Timeout en la comunicación Modbus: varias unidades seguidas sin respuesta (última: {unit_id}).")
+        return ModbusTimeoutException(f"Unit {unit_id}: sin respuesta en {timeout * 1000:.0f} ms.")
+
+    def is_pipelined(self):
+        """True si el cliente admite varias transacciones en vuelo."""
+        return self.pipeline_window > 1
+
+    def _next_transaction_id(self):
+        """Asigna el siguiente TID, saltando los que siguen en vuelo (tabla consultada con su lock: el receptor la modifica)."""
+        with self._tid_lock, self._pending_lock:
+            while True:
+                self.transaction_id = (self.transaction_id + 1) & 0xFFFF
+                if self.transaction_id not in self._pending:
+                    return self.transaction_id
+
     def _build_modbus_frame(self, unit_id, function_code, starting_address, quantity):
-        # ... (sin cambios, pero usar self._log para debug) ...
-        self.transaction_id = (self.transaction_id + 1) & 0xFFFF
-        protocol_id = 0
-        pdu = struct.pack('>BHH', function_code, starting_address, quantity)
-        length = len(pdu) + 1
-        mbap_header = struct.pack('>HHHB', self.transaction_id, protocol_id, length, unit_id)
-        frame = mbap_header + pdu
-        self._log("DEBUG", f"Frame construido (TID: {self.transaction_id}): {frame.hex()}", layer="MB_SENT")
+        """Plantilla MBAP de una lectura, precompilada y cacheada (el TID se parchea al enviar)."""
+        return self._frame_cache.get((unit_id, function_code, starting_address, quantity), lambda: self._build_pdu_frame(
+            unit_id, ModbusProtocol.build_read_pdu(function_code, starting_address, quantity)))
+
+    def _build_pdu_frame(self, unit_id, pdu):
+        """Plantilla MBAP (bytearray, TID a 0) para un PDU cualquiera."""
+        frame = bytearray(ModbusProtocol.build_mbap_frame(0, unit_id, pdu))
+        if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+            self._log("DEBUG", "Frame construido (Unit: %s): %s", unit_id, frame.hex(), layer="MB_SENT")
         return frame
 
-    def _send_request(self, request):
-        """Envía una solicitud y recibe la respuesta (síncrono)."""
+    def _stamp_transaction_id(self, request):
+        """
+        Asigna un TID nuevo y lo escribe en la plantilla, en su sitio.
+        Debe llamarse con _client_lock tomado: la plantilla puede estar
+        compartida (cache) y sólo se reutiliza una vez enviada.
+        """
+        transaction_id = self._next_transaction_id()
+        _TID_STRUCT.pack_into(request, 0, transaction_id)
+        return transaction_id
+
+    def _send_request(self, request, parse_func):
+        """
+        Envía una solicitud y recibe la respuesta (síncrono).
+        `parse_func(rx_unit_id, response_pdu)` decodifica la respuesta y su
+        resultado es el valor devuelto. En modo normal se invoca con una
+        memoryview sobre el buffer de recepción (sin copias) mientras se
+        mantiene el lock, antes de que el buffer se reutilice.
+        """
+        if self.is_pipelined():
+            rx_unit_id, response_pdu = self._wait_transaction(self._submit_transaction(request))
+            return parse_func(rx_unit_id, response_pdu)
+
         # Este método es crítico y debe ser protegido por el lock
+        unit_id = request[6] # Unit ID de la cabecera MBAP
+        size = transfer_size(memoryview(request)[MBAP_HEADER_SIZE:])
         with self._client_lock:
             if not self.is_connected or not self.sock:
                 self._log("ERROR", "Intento de enviar request sin conexión.", layer="SOCKET")
                 raise ConnectionException("No conectado al servidor Modbus.")
 
+            timeout = self.rtt_estimator.timeout(unit_id, size)
             try:
-                self._log("DEBUG", f"Enviando {len(request)} bytes: {request.hex()}", layer="TCP")
+                # El TID se asigna aquí, con el lock, porque la plantilla es compartida
+                expected_tid = self._stamp_transaction_id(request)
+                if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                    self._log("DEBUG", "Enviando %s bytes: %s", len(request), request.hex(), layer="TCP")
                 self.sock.sendall(request)
-
-                # Leer cabecera MBAP (7 bytes)
-                mbap_header_bytes = self._recv_all(7)
-                if len(mbap_header_bytes) < 7:
-                    raise ModbusInvalidResponseException(f"Respuesta incompleta (MBAP header). Recibidos {len(mbap_header_bytes)}/7 bytes.")
-
-                self._log("DEBUG", f"MBAP Recibido: {mbap_header_bytes.hex()}", layer="MB_RECV")
-                rx_trans_id, rx_proto_id, rx_length, rx_unit_id = struct.unpack('>HHHB', mbap_header_bytes)
-
-                # Validar TID aquí mismo
-                if rx_trans_id != self.transaction_id:
-                    # Leer y descartar el resto según length para limpiar el buffer
-                    bytes_to_discard = rx_length - 1
-                    if bytes_to_discard > 0:
-                         self._log("WARN", f"TID no coincide (Esperado: {self.transaction_id}, Recibido: {rx_trans_id}). Descartando {bytes_to_discard} bytes.", layer="MB_ERROR")
-                         try:
-                             self._recv_all(bytes_to_discard) # Intenta leer el resto
-                         except Exception as discard_err:
-                              self._log("ERROR", f"Error al descartar bytes de respuesta inválida: {discard_err}", layer="MB_ERROR")
-                              # La conexión puede estar corrupta, forzar desconexión
-                              self.disconnect(acquire_lock=False)
-                              raise ConnectionException("Error de sincronización de TID y error al limpiar buffer.")
-                    else:
-                        self._log("WARN", f"TID no coincide (Esperado: {self.transaction_id}, Recibido: {rx_trans_id}). No hay datos adicionales que descartar.", layer="MB_ERROR")
-
-                    raise ModbusInvalidResponseException(f"ID de transacción no coincide. Esperado: {self.transaction_id}, Recibido: {rx_trans_id}")
-
-                # Leer PDU
-                pdu_length = rx_length - 1 # Length incluye Unit ID ya leído
-                if pdu_length < 1: # PDU debe tener al menos código de función (o func+error)
-                     raise ModbusInvalidResponseException(f"Longitud de PDU inválida en respuesta ({pdu_length}). MBAP Length: {rx_length}")
-
-                self._log("DEBUG", f"Esperando {pdu_length} bytes de PDU...", layer="TCP")
-                pdu_bytes = self._recv_all(pdu_length)
-                if len(pdu_bytes) < pdu_length:
-                     raise ModbusInvalidResponseException(f"Respuesta incompleta (PDU). Esperados {pdu_length}, recibidos {len(pdu_bytes)} bytes.")
-
-                self._log("DEBUG", f"PDU Recibido: {pdu_bytes.hex()}", layer="MB_RECV")
-                response_pdu = pdu_bytes
-
-                # Devolver unit_id también para validación externa si se desea
-                return rx_unit_id, response_pdu
+                sent_at = time.monotonic(); deadline = sent_at + timeout
+
+                # Leer frames MBAP completos. Las respuestas tardías de
+                # transacciones anteriores (TID distinto) se descartan y se
+                # sigue esperando la nuestra.
+                while True:
+                    rx_trans_id, rx_unit_id, frame = self._recv_mbap_frame(deadline)
+                    if rx_trans_id == expected_tid:
+                        self.last_activity = time.monotonic()
+                        self.rtt_estimator.record(unit_id, self.last_activity - sent_at, size)
+                        break
+                    self._log("WARN", f"TID no coincide (Esperado: {expected_tid}, Recibido: {rx_trans_id}). Respuesta tardía descartada ({len(frame)} bytes).", layer="MB_ERROR")
+
+                response_pdu = frame[MBAP_HEADER_SIZE:]
+                if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                    self._log("DEBUG", "PDU Recibido: %s", response_pdu.hex(), layer="MB_RECV")
+                return parse_func(rx_unit_id, response_pdu)
 
             except socket.timeout:
+                error = self._timeout_error(unit_id, timeout, size)
+                if isinstance(error, ModbusTimeoutException):
+                    # Los bytes parciales quedan en el buffer: la respuesta tardía se completará y descartará por TID
+                    self._log("WARN", f"Timeout adaptativo: {error}", layer="SOCKET")
+                    raise error
                 self._log("ERROR", "Timeout durante send/recv.", layer="SOCKET")
                 self.disconnect(acquire_lock=False) # Forzar desconexión interna
-                raise ConnectionException("Timeout en la comunicación Modbus.")
+                raise error
+            except ConnectionException as e:
+                 self._log("ERROR", f"Error de conexión en send/recv: {e}", layer="SOCKET")
+                 self.disconnect(acquire_lock=False) # Forzar desconexión interna
+                 raise
             except socket.error as e:
                  self._log("ERROR", f"Error de Socket en send/recv: {e}", layer="SOCKET")
                  self.disconnect(acquire_lock=False) # Forzar desconexión interna
@@ -205,71 +293,271 @@ class ModbusTCPClient:
                  # Envolver en una excepción genérica Modbus si no es ya una
                  raise ModbusException(f"Error inesperado procesando solicitud/respuesta: {e}") from e
 
-
-    def _recv_all(self, num_bytes):
-        """Lee exactamente num_bytes del socket, manejando lecturas parciales."""
-        # Asegurarse de que el socket exista y tenga timeout
-        if not self.sock:
-            raise ConnectionException("Socket no disponible para recv.")
-        # self.sock.settimeout(valor_timeout) # Asegurarse de que el timeout esté seteado
-
-        data = bytearray()
-        while len(data) < num_bytes:
-            packet = self.sock.recv(num_bytes - len(data))
-            if not packet:
-                # Conexión cerrada por el otro extremo inesperadamente
-                self._log("ERROR", f"Conexión cerrada por el peer mientras se esperaban {num_bytes} bytes (recibidos {len(data)}).", layer="SOCKET")
-                self.disconnect(acquire_lock=False) # Forzar desconexión interna
-                raise ConnectionException("Conexión cerrada inesperadamente por el servidor.")
-            data.extend(packet)
-        return bytes(data)
-
+    def _recv_mbap_frame(self, deadline=None):
+        """
+        Recibe un frame MBAP completo en el buffer preasignado, como mucho hasta `deadline`.
+        Devuelve (tid, unit_id, frame) donde frame es una memoryview (cabecera + PDU)
+        válida hasta la siguiente recepción. Lanza ConnectionException si la
+        cabecera es imposible (stream desincronizado).
+        """
+        # Normalmente el ADU entero llega en el primer recv_into
+        self._rx_buffer.fill(self.sock, MBAP_HEADER_SIZE, deadline)
+        try:
+            rx_trans_id, rx_unit_id, pdu_length = ModbusProtocol.parse_mbap_header(self._rx_buffer.peek(MBAP_HEADER_SIZE))
+        except ModbusInvalidResponseException as e:
+            self._rx_buffer.clear()
+            raise ConnectionException(str(e))
+        frame_length = MBAP_HEADER_SIZE + pdu_length
+        self._rx_buffer.fill(self.sock, frame_length, deadline)
+        return rx_trans_id, rx_unit_id, self._rx_buffer.consume(frame_length)
+
+    # --- Modo pipelining: envío/espera desacoplados y receptor dedicado ---
+
+    def _start_receiver(self, sock):
+        """
+        Arranca el hilo receptor que despacha respuestas por TID (con _client_lock
+        tomado). Cada conexión tiene su tabla de transacciones y su buffer: el
+        receptor de una conexión anterior (disconnect() no lo espera) puede
+        terminar después de reconectar y no debe tocar los de la nueva.
+        """
+        with self._pending_lock:
+            self._pending = pending = {}
+        self._receiver_thread = threading.Thread(target=self._receiver_loop, args=(sock, pending, RecvBuffer()),
+                                                 name=f"MBReceiver-{self.ip}:{self.port}", daemon=True)
+        self._receiver_thread.start()
+
+    def _receiver_loop(self, sock, pending, rx_buffer):
+        """Lee frames MBAP de `sock` y los entrega a la transacción en espera de su tabla `pending`."""
+        self._log("DEBUG", "Receptor pipelining iniciado (ventana: %s).", self.pipeline_window, layer="SOCKET")
+        error = None
+        try:
+            needed = MBAP_HEADER_SIZE
+            while True:
+                try:
+                    # Un recv_into puede traer varias respuestas (o sólo parte de una)
+                    rx_buffer.fill(sock, needed)
+                except socket.timeout:
+                    continue # Sin tráfico; los datos parciales siguen en el buffer
+                try:
+                    rx_trans_id, rx_unit_id, pdu_length = ModbusProtocol.parse_mbap_header(rx_buffer.peek(MBAP_HEADER_SIZE))
+                except ModbusInvalidResponseException as e:
+                    raise ConnectionException(str(e))
+                frame_length = MBAP_HEADER_SIZE + pdu_length
+                if len(rx_buffer) < frame_length:
+                    needed = frame_length
+                    continue
+                frame = rx_buffer.consume(frame_length)
+                self._dispatch_response(pending, rx_trans_id, rx_unit_id, frame[MBAP_HEADER_SIZE:])
+                needed = MBAP_HEADER_SIZE
+        except ConnectionException as e:
+            error = e
+        except (socket.error, OSError) as e:
+            error = ConnectionException(f"Error de Socket en comunicación: {e}")
+        finally:
+            with self._client_lock: # Comprobado con el lock: un connect() posterior no debe ser desconectado por este receptor
+                if self.sock is sock:
+                    # Fallo real (no un disconnect() local): dejar el cliente desconectado
+                    self._log("ERROR", f"Receptor pipelining detenido: {error}", layer="SOCKET")
+                    self.disconnect(acquire_lock=False)
+            self._fail_pending(pending, error or ConnectionException("Conexión cerrada."))
+            self._log("DEBUG", "Receptor pipelining terminado.", layer="SOCKET")
+
+    def _dispatch_response(self, table, rx_trans_id, rx_unit_id, pdu_view):
+        """Entrega una respuesta a su transacción de `table`; descarta las tardías."""
+        self.last_activity = now = time.monotonic() # Cualquier respuesta demuestra que el enlace vive
+        with self._pending_lock:
+            pending = table.pop(rx_trans_id, None)
+        if pending is None:
+            self._log("DEBUG", "Respuesta tardía/desconocida descartada (TID: %s).", rx_trans_id, layer="MB_RECV")
+            return
+        if pending.sent_at is not None:
+            self.rtt_estimator.record(pending.unit_id, now - pending.sent_at, pending.size)
+        if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+            self._log("DEBUG", "PDU Recibido (TID: %s): %s", rx_trans_id, pdu_view.hex(), layer="MB_RECV")
+        # La vista apunta al buffer del receptor: copiar antes de cruzar de hilo
+        pending.response = (rx_unit_id, bytes(pdu_view))
+        pending.event.set()
+
+    def _fail_pending(self, table, error):
+        """Despierta con un error a todas las transacciones en vuelo de `table` (las de una conexión)."""
+        with self._pending_lock:
+            pending_list = list(table.values())
+            table.clear()
+        for pending in pending_list:
+            pending.error = error
+            pending.event.set()
+
+    def _submit_transaction(self, request, blocking=True):
+        """
+        Registra y envía una transacción sin esperar la respuesta.
+        Devuelve la _PendingTransaction, o None si blocking=False y la ventana está llena.
+        """
+        if not self._window.acquire(blocking, self.timeout if blocking else None):
+            if not blocking:
+                return None
+            raise ConnectionException(f"Ventana de pipelining llena ({self.pipeline_window}) durante {self.timeout}s.")
+        pending = None
+        try:
+            with self._client_lock:
+                if not self.is_connected or not self.sock:
+                    self._log("ERROR", "Intento de enviar request sin conexión.", layer="SOCKET")
+                    raise ConnectionException("No conectado al servidor Modbus.")
+                # Asignar el TID y registrar la transacción antes de enviar (la respuesta puede llegar enseguida)
+                tid = self._stamp_transaction_id(request)
+                pending = _PendingTransaction(tid, request[6], transfer_size(memoryview(request)[MBAP_HEADER_SIZE:]))
+                with self._pending_lock:
+                    self._pending[tid] = pending
+                if self._log_enabled("DEBUG"): # Evitar el hex() del frame con DEBUG desactivado
+                    self._log("DEBUG", "Enviando %s bytes (TID: %s): %s", len(request), tid, request.hex(), layer="TCP")
+                try:
+                    pending.sent_at = time.monotonic()
+                    self.sock.sendall(request)
+                except (socket.error, OSError) as e:
+                    self._log("ERROR", f"Error de Socket en send: {e}", layer="SOCKET")
+                    self.disconnect(acquire_lock=False)
+                    raise ConnectionException(f"Error de Socket en comunicación: {e}")
+        except BaseException:
+            if pending is None:
+                self._window.release()
+            else:
+                self._release_transaction(pending)
+            raise
+        return pending
+
+    def _release_transaction(self, pending):
+        """Saca la transacción de la tabla actual (si sigue en ella) y libera su hueco de la ventana."""
+        with self._pending_lock:
+            if self._pending.get(pending.tid) is pending:
+                del self._pending[pending.tid] # Una respuesta posterior se descartará
+        self._window.release()
+
+    def _wait_transaction(self, pending):
+        """Espera la respuesta de una transacción enviada con _submit_transaction."""
+        try:
+            timeout = self.rtt_estimator.timeout(pending.unit_id, pending.size)
+            if not pending.event.wait(max(0.0, pending.sent_at + timeout - time.monotonic())):
+                error = self._timeout_error(pending.unit_id, timeout, pending.size)
+                self._log("WARN" if isinstance(error, ModbusTimeoutException) else "ERROR", f"Timeout esperando respuesta (TID: {pending.tid}): {error}", layer="SOCKET")
+                raise error
+            if pending.error:
+                raise pending.error
+            return pending.response
+        finally:
+            self._release_transaction(pending)
 
     def read_holding_registers(self, unit_id, starting_address, quantity):
         """Lee registros Holding (Función 0x03). Síncrono."""
-        if not (0 <= starting_address <= 65535):
-            raise ValueError("Dirección inicial fuera de rango (0-65535)")
-        if not (1 <= quantity <= 125):
-             raise ValueError("Cantidad de registros fuera de rango (1-125)")
+        return self._read_registers(unit_id, FC_READ_HOLDING_REGISTERS, starting_address, quantity)
+
+    def read_input_registers(self, unit_id, starting_address, quantity):
+        """Lee registros Input (Función 0x04). Síncrono."""
+        return self._read_registers(unit_id, FC_READ_INPUT_REGISTERS, starting_address, quantity)
 
-        function_code = 0x03
+    def _read_registers(self, unit_id, function_code, starting_address, quantity):
+        self._validate_read_params(starting_address, quantity)
         request = self._build_modbus_frame(unit_id, function_code, starting_address, quantity)
 
         # _send_request ya está protegido por lock y maneja errores de conexión/timeout
-        rx_unit_id, response_pdu = self._send_request(request)
+        return self._send_request(request, lambda rx_unit_id, response_pdu: self._parse_read_response(
+            unit_id, function_code, starting_address, quantity, rx_unit_id, response_pdu))
+
+    def read_holding_register_blocks(self, unit_id, blocks):
+        """
+        Lee varios bloques (starting_address, quantity) de Holding Registers.
+        En modo pipelining mantiene hasta `pipeline_window` peticiones en vuelo;
+        en modo normal equivale a llamar read_holding_registers por bloque.
+        Devuelve una lista de listas de valores, en el orden de `blocks`.
+        """
+        for starting_address, quantity in blocks:
+            self._validate_read_params(starting_address, quantity)
+        if not self.is_pipelined():
+            return [self.read_holding_registers(unit_id, addr, qty) for addr, qty in blocks]
+
+        function_code = FC_READ_HOLDING_REGISTERS
+        results = [None] * len(blocks)
+        in_flight = deque() # (índice, starting_address, quantity, pending)
+
+        def complete_oldest():
+            index, addr, qty, pending = in_flight.popleft()
+            rx_unit_id, response_pdu = self._wait_transaction(pending)
+            results[index] = self._parse_read_response(unit_id, function_code, addr, qty, rx_unit_id, response_pdu)
 
+        try:
+            for index, (starting_address, quantity) in enumerate(blocks):
+                request = self._build_modbus_frame(unit_id, function_code, starting_address, quantity)
+                pending = self._submit_transaction(request, blocking=not in_flight)
+                while pending is None:
+                    # Ventana llena: completar la más antigua propia antes de bloquear
+                    complete_oldest()
+                    pending = self._submit_transaction(request, blocking=not in_flight)
+                in_flight.append((index, starting_address, quantity, pending))
+            while in_flight:
+                complete_oldest()
+        finally:
+            for _, _, _, pending in in_flight: # Sólo quedan si hubo error
+                self._release_transaction(pending)
+        return results
+
+    def _validate_read_params(self, starting_address, quantity):
+        ModbusProtocol.validate_read_params(starting_address, quantity)
+
+    def _parse_read_response(self, unit_id, function_code, starting_address, quantity, rx_unit_id, response_pdu):
+        """Valida el PDU de respuesta de una lectura y devuelve los valores."""
         # Validar Unit ID (aunque en TCP/IP esto es menos crítico que el TID, es bueno chequear)
         if rx_unit_id != unit_id:
             self._log("WARN", f"Unit ID no coincide en respuesta. Esperado: {unit_id}, Recibido: {rx_unit_id}", layer="MB_ERROR")
             # Podríamos lanzar excepción o continuar si no es crítico para la aplicación
             # raise ModbusInvalidResponseException(f"Unit ID no coincide. Esperado: {unit_id}, Recibido: {rx_unit_id}")
 
-        # Analizar PDU
-        rx_func_code = response_pdu[0]
-
-        if rx_func_code == (function_code | 0x80):
-            if len(response_pdu) < 2:
-                 raise ModbusInvalidResponseException("Respuesta de error Modbus incompleta (falta código de excepción).")
-            error_code = response_pdu[1]
-            self._log("ERROR", f"Respuesta de error Modbus recibida. Código: {error_code}", layer="MB_ERROR")
-            raise ModbusIOException(f"Error Modbus recibido del dispositivo. Código: {error_code}", error_code=error_code)
-        elif rx_func_code != function_code:
-            raise ModbusInvalidResponseException(f"Código de función incorrecto en respuesta. Esperado: {function_code}, Recibido: {rx_func_code}")
-
-        # Procesar respuesta normal
-        if len(response_pdu) < 2:
-             raise ModbusInvalidResponseException("Respuesta PDU demasiado corta para contener byte count.")
-        byte_count = response_pdu[1]
-        data_bytes = response_pdu[2:]
-
-        if byte_count != len(data_bytes):
-            raise ModbusInvalidResponseException(f"Byte count ({byte_count}) no coincide con longitud de datos ({len(data_bytes)}).")
-        if byte_count != quantity * 2:
-             raise ModbusInvalidResponseException(f"Byte count ({byte_count}) no coincide con cantidad solicitada ({quantity}*2 bytes).")
-
-        values = DataFormatter.parse_registers(data_bytes, quantity)
-        self._log("DEBUG", f"Registros leídos exitosamente ({quantity} regs desde {starting_address}): {values}", layer="MODBUS")
+        try:
+            values = ModbusProtocol.parse_read_response(function_code, quantity, response_pdu)
+        except ModbusIOException as e:
+            self._log("ERROR", f"Respuesta de error Modbus recibida. Código: {e.error_code}", layer="MB_ERROR")
+            raise
+        self._log("DEBUG", "Registros leídos exitosamente (%s regs desde %s): %s", quantity, starting_address, values, layer="MODBUS")
         return values
 
-    # --- Otros métodos Modbus (read_coils, write_register, etc.) seguirían un patrón similar ---
+    def write_register(self, unit_id, address, value):
+        """Escribe un Holding Register (Función 0x06). Síncrono."""
+        ModbusProtocol.validate_write_params(address, [value])
+        request = self._build_pdu_frame(unit_id, ModbusProtocol.build_write_single_pdu(address, value))
+        self._send_request(request, lambda rx_unit_id, response_pdu: self._parse_write_response(
+            unit_id, FC_WRITE_SINGLE_REGISTER, address, value, rx_unit_id, response_pdu))
+        self._log("DEBUG", "Registro escrito (%s = %s)", address, value, layer="MODBUS")
+
+    def write_registers(self, unit_id, starting_address, values):
+        """Escribe varios Holding Registers contiguos (Función 0x10). Síncrono."""
+        values = list(values)
+        ModbusProtocol.validate_write_params(starting_address, values)
+        request = self._build_pdu_frame(unit_id, ModbusProtocol.build_write_multiple_pdu(starting_address, values))
+        self._send_request(request, lambda rx_unit_id, response_pdu: self._parse_write_response(
+            unit_id, FC_WRITE_MULTIPLE_REGISTERS, starting_address, len(values), rx_unit_id, response_pdu))
+        self._log("DEBUG", "Registros escritos (%s regs desde %s)", len(values), starting_address, layer="MODBUS")
+
+    def read_write_registers(self, unit_id, read_address, read_quantity, write_address, values):
+        """
+        Escribe y lee en una sola transacción (Función 0x17). El dispositivo
+        aplica la escritura antes de la lectura. Devuelve los valores leídos.
+        """
+        values = list(values)
+        self._validate_read_params(read_address, read_quantity)
+        ModbusProtocol.validate_write_params(write_address, values, MAX_RW_WRITE_QUANTITY)
+        pdu = ModbusProtocol.build_read_write_pdu(read_address, read_quantity, write_address, values)
+        return self._send_request(self._build_pdu_frame(unit_id, pdu), lambda rx_unit_id, response_pdu: self._parse_read_response(
+            unit_id, FC_READ_WRITE_MULTIPLE_REGISTERS, read_address, read_quantity, rx_unit_id, response_pdu))
+
+    def diagnostics(self, unit_id, sub_function=DIAG_RETURN_QUERY_DATA, data=0):
+        """Diagnostics (Función 0x08); por defecto Return Query Data (el esclavo devuelve el eco). Síncrono."""
+        request = self._build_pdu_frame(unit_id, ModbusProtocol.build_diagnostics_pdu(sub_function, data))
+        self._send_request(request, lambda rx_unit_id, response_pdu: ModbusProtocol.parse_diagnostics_response(sub_function, data, response_pdu))
+
+    def _parse_write_response(self, unit_id, function_code, starting_address, second_field, rx_unit_id, response_pdu):
+        if rx_unit_id != unit_id:
+            self._log("WARN", f"Unit ID no coincide en respuesta. Esperado: {unit_id}, Recibido: {rx_unit_id}", layer="MB_ERROR")
+        try:
+            ModbusProtocol.parse_write_response(function_code, starting_address, second_field, response_pdu)
+        except ModbusIOException as e:
+            self._log("ERROR", f"Respuesta de error Modbus recibida. Código: {e.error_code}", layer="MB_ERROR")
+            raise
 
+    # --- Otros métodos Modbus (read_coils, write_coil, etc.) seguirían un patrón similar ---
@@ -0,0 +1,165 @@
+# services/bus_arbiter.py
+import threading
+import time
+from modbus_client.exceptions import ModbusException
+
+# Clases de prioridad (menor = más urgente)
+PRIORITY_WRITE = 0 # Escrituras (órdenes del operador)
+PRIORITY_ON_DEMAND = 1 # Lecturas bajo demanda (/api/readnow, lectura inicial)
+PRIORITY_CYCLIC = 2 # Grupos de escaneo del planificador
+PRIORITY_KEEP_ALIVE = 3 # Sondeo de vida de la conexión
+PRIORITY_NAMES = {PRIORITY_WRITE: "write", PRIORITY_ON_DEMAND: "on_demand", PRIORITY_CYCLIC: "cyclic", PRIORITY_KEEP_ALIVE: "keep_alive"}
+
+DEFAULT_AGING_SECONDS = 2.0 # Cada tanto de espera, una petición sube una clase (evita inanición)
+DEFAULT_ACQUIRE_TIMEOUT = 30.0 # s
+
+
+class BusBusyException(ModbusException):
+    """No se obtuvo turno en el bus dentro del plazo (el bus sigue ocupado, la conexión es válida)."""
+    pass
+
+
+class BusArbiter:
+    """
+    Árbitro de un bus half-duplex (una transacción a la vez). Cada transacción
+    pide turno con una clase de prioridad; al liberarse el bus se concede a la
+    petición en espera con mejor prioridad efectiva, que mejora con el tiempo
+    esperado (aging) para que el keep-alive o el escaneo cíclico no se queden
+    sin turno bajo carga. El turno es por transacción, así que una orden del
+    operador se intercala entre los bloques de un escaneo largo en vez de
+    esperar a que termine.
+    """
+    def __init__(self, aging_seconds=DEFAULT_AGING_SECONDS, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        self.aging_seconds = aging_seconds
+        self.acquire_timeout = acquire_timeout
+        self._condition = threading.Condition()
+        self._busy = False
+        self._waiters = [] # [prioridad, instante de llegada, secuencia, concedido]
+        self._seq = 0
+        # Métricas por clase
+        self._granted = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._aged_grants = dict.fromkeys(PRIORITY_NAMES, 0) # Concedidas gracias al aging
+        self._timeouts = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._wait_total = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self._wait_max = dict.fromkeys(PRIORITY_NAMES, 0.0)
+        self._max_depth = 0
+
+    def _effective_priority(self, waiter, now):
+        return waiter[0] - (now - waiter[1]) / self.aging_seconds
+
+    def _grant_next(self):
+        """Concede el bus a la mejor petición en espera (con _condition tomada)."""
+        if not self._waiters:
+            return
+        now = time.monotonic()
+        best = min(self._waiters, key=lambda waiter: (self._effective_priority(waiter, now), waiter[2]))
+        if best[0] != min(waiter[0] for waiter in self._waiters):
+            self._aged_grants[best[0]] += 1
+        self._waiters.remove(best)
+        best[3] = True
+        self._busy = True
+        self._condition.notify_all()
+
+    def acquire(self, priority, timeout=None):
+        """Espera turno en el bus. Devuelve los segundos esperados; lanza BusBusyException si vence `timeout`."""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        with self._condition:
+            if not self._busy and not self._waiters:
+                self._busy = True
+                waited = 0.0
+            else:
+                self._seq += 1
+                waiter = [priority, start, self._seq, False]
+                self._waiters.append(waiter)
+                self._max_depth = max(self._max_depth, len(self._waiters))
+                if not self._condition.wait_for(lambda: waiter[3], timeout):
+                    self._waiters.remove(waiter)
+                    self._timeouts[priority] += 1
+                    raise BusBusyException(f"Bus ocupado: sin turno tras {timeout}s ({PRIORITY_NAMES.get(priority, priority)}, {len(self._waiters)} en cola).")
+                waited = time.monotonic() - start
+            self._granted[priority] += 1
+            self._wait_total[priority] += waited
+            self._wait_max[priority] = max(self._wait_max[priority], waited)
+            return waited
+
+    def release(self):
+        with self._condition:
+            self._busy = False
+            self._grant_next()
+
+    def slot(self, priority, timeout=None):
+        """Context manager: `with arbiter.slot(PRIORITY_WRITE): client.write_register(...)`."""
+        return _BusSlot(self, priority, timeout)
+
+    def get_stats(self):
+        with self._condition:
+            depth = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+            for waiter in self._waiters:
+                depth[PRIORITY_NAMES[waiter[0]]] += 1
+            classes = {name: {"granted": self._granted[priority], "aged_grants": self._aged_grants[priority], "timeouts": self._timeouts[priority],
+                              "avg_wait": self._wait_total[priority] / self._granted[priority] if self._granted[priority] else 0.0,
+                              "max_wait": self._wait_max[priority], "queued": depth[name]}
+                       for priority, name in PRIORITY_NAMES.items()}
+            return {"busy": self._busy, "queue_depth": len(self._waiters), "max_queue_depth": self._max_depth, "classes": classes}
+
+
+class _BusSlot:
+    def __init__(self, arbiter, priority, timeout):
+        self._arbiter = arbiter
+        self._priority = priority
+        self._timeout = timeout
+
+    def __enter__(self):
+        self._arbiter.acquire(self._priority, self._timeout)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._arbiter.release()
+        return False
+
+
+class ArbitratedClient:
+    """
+    Cliente Modbus visto con una prioridad fija: cada transacción pide turno
+    al BusArbiter. Las lecturas de varios bloques piden un turno por bloque.
+    Con un cliente TCP en modo pipelining no hay bus que arbitrar (el gateway
+    admite varias transacciones en vuelo) y las llamadas pasan directamente.
+    """
+    def __init__(self, client, arbiter, priority):
+        self._client = client
+        self._arbiter = arbiter
+        self._priority = priority
+        self._bypass = getattr(client, "is_pipelined", lambda: False)()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _call(self, method, *args):
+        if self._bypass:
+            return method(*args)
+        with self._arbiter.slot(self._priority):
+            return method(*args)
+
+    def read_holding_registers(self, unit_id, starting_address, quantity):
+        return self._call(self._client.read_holding_registers, unit_id, starting_address, quantity)
+
+    def read_input_registers(self, unit_id, starting_address, quantity):
+        return self._call(self._client.read_input_registers, unit_id, starting_address, quantity)
+
+    def diagnostics(self, unit_id, sub_function=0, data=0):
+        return self._call(self._client.diagnostics, unit_id, sub_function, data)
+
+    def read_holding_register_blocks(self, unit_id, blocks):
+        if self._bypass:
+            return self._client.read_holding_register_blocks(unit_id, blocks)
+        return [self.read_holding_registers(unit_id, addr, qty) for addr, qty in blocks]
+
+    def write_register(self, unit_id, address, value):
+        return self._call(self._client.write_register, unit_id, address, value)
+
+    def write_registers(self, unit_id, starting_address, values):
+        return self._call(self._client.write_registers, unit_id, starting_address, values)
+
+    def read_write_registers(self, unit_id, read_address, read_quantity, write_address, values):
+        return self._call(self._client.read_write_registers, unit_id, read_address, read_quantity, write_address, values)
@@ -0,0 +1,103 @@
+# services/circuit_breaker.py
+import random
+import threading
+import time
+
+BREAKER_CLOSED = "closed" # Se lee normalmente
+BREAKER_OPEN = "open" # No se le envían peticiones hasta `retry_at`
+BREAKER_HALF_OPEN = "half_open" # Una única lectura de prueba en curso
+
+DEFAULT_FAILURE_THRESHOLD = 3 # Fallos seguidos que abren el circuito
+DEFAULT_BACKOFF = 1.0 # s; primera espera antes de la lectura de prueba
+DEFAULT_MAX_BACKOFF = 60.0 # s; la espera se duplica tras cada prueba fallida hasta este techo
+DEFAULT_BACKOFF_JITTER = 0.2 # Fracción aleatoria (±) de cada espera, para no sincronizar pruebas
+
+# Excepciones de gateway (Modbus TCP): el esclavo tras el gateway no está disponible
+GATEWAY_PATH_UNAVAILABLE = 0x0A
+GATEWAY_TARGET_NO_RESPONSE = 0x0B
+
+
+class CircuitBreaker:
+    """
+    Circuito por unidad. Tras `failure_threshold` fallos seguidos (la unidad no
+    responde) se abre: el escaneo deja de enviarle peticiones, así el resto del
+    bus conserva su ritmo. Pasada la espera (exponencial, con jitter) se
+    permite una lectura de prueba (half-open): si responde se cierra, si no se
+    vuelve a abrir con el doble de espera.
+    """
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD, backoff=DEFAULT_BACKOFF,
+                 max_backoff=DEFAULT_MAX_BACKOFF, jitter=DEFAULT_BACKOFF_JITTER):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.backoff = backoff
+        self.retry_at = None # time.monotonic() de la próxima lectura de prueba
+        self.opened_at = None # time.time() de la última apertura
+        # Estadísticas
+        self.trips = 0 # Aperturas desde cerrado
+        self.probes = 0
+        self.skipped = 0 # Lecturas no enviadas con el circuito abierto
+
+    def allow(self):
+        """True si se puede leer la unidad ahora (en half-open sólo la primera petición)."""
+        with self._lock:
+            if self.state == BREAKER_CLOSED:
+                return True
+            if self.state == BREAKER_OPEN and time.monotonic() >= self.retry_at:
+                self.state = BREAKER_HALF_OPEN
+                self.probes += 1
+                return True
+            self.skipped += 1
+            return False
+
+    def record_success(self):
+        """La unidad respondió. Devuelve True si el circuito estaba abierto (recuperación)."""
+        with self._lock:
+            recovered = self.state != BREAKER_CLOSED
+            self.state = BREAKER_CLOSED
+            self.consecutive_failures = 0
+            self.backoff = self.base_backoff
+            self.retry_at = None
+            return recovered
+
+    def record_failure(self):
+        """La unidad no respondió. Devuelve True si el circuito se acaba de abrir."""
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == BREAKER_HALF_OPEN:
+                self.backoff = min(self.max_backoff, self.backoff * 2)
+                self._open()
+                return False
+            if self.state == BREAKER_CLOSED and self.consecutive_failures >= self.failure_threshold:
+                self.backoff = self.base_backoff
+                self.trips += 1
+                self._open()
+                return True
+            return False
+
+    def release_probe(self):
+        """La lectura de prueba no llegó a la unidad (bus ocupado, conexión caída): repetirla en el próximo ciclo."""
+        with self._lock:
+            if self.state == BREAKER_HALF_OPEN:
+                self.state = BREAKER_OPEN
+                self.retry_at = time.monotonic()
+
+    def _open(self):
+        self.state = BREAKER_OPEN
+        self.opened_at = time.time()
+        self.retry_at = time.monotonic() + self.backoff * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def retry_in(self):
+        """Segundos hasta la próxima lectura de prueba (0 si no está abierto)."""
+        with self._lock:
+            return max(0.0, self.retry_at - time.monotonic()) if self.state == BREAKER_OPEN else 0.0
+
+    def get_stats(self):
+        retry_in = self.retry_in()
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures, "backoff": self.backoff,
+                    "retry_in": retry_in, "opened_at": self.opened_at, "trips": self.trips, "probes": self.probes, "skipped": self.skipped}
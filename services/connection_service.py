@@ -7,9 +7,16 @@ import traceback
 from modbus_client.tcp_client import ModbusTCPClient
 from modbus_client.rtu_over_tcp_client import ModbusRtuOverTcpClient
 # Importar excepciones personalizadas
-from modbus_client.exceptions import ConnectionException, ModbusException
+from modbus_client.exceptions import ConnectionException, ModbusException, ModbusTimeoutException
+from modbus_client.rtt_estimator import RttEstimator, DEFAULT_TIMEOUT_FLOOR, DEFAULT_TIMEOUT_CEILING
 # Importar PollingService para llamarlo desde el monitor
 from services.polling_service import PollingService # Asumiendo que está en el mismo paquete
+from services.bus_arbiter import BusArbiter, ArbitratedClient, BusBusyException, PRIORITY_KEEP_ALIVE
+from modbus_client.protocol import FC_READ_HOLDING_REGISTERS, FC_READ_INPUT_REGISTERS, FC_DIAGNOSTICS
+
+KEEP_ALIVE_PROBE_FUNCTIONS = (FC_READ_HOLDING_REGISTERS, FC_READ_INPUT_REGISTERS, FC_DIAGNOSTICS) # 0x08 = eco, no toca registros
+MIN_KEEP_ALIVE_IDLE = 1.0 # s
+_UNCHANGED = object()
 
 class ServiceError(Exception):
     """Excepción personalizada para errores internos del servicio."""
@@ -74,25 +81,35 @@ def connection_worker_standalone(log_service_arg, stop_event, result_dict, ip, p
 #   CLASE ConnectionService
 # ==============================================================================
 class ConnectionService:
-    def __init__(self, log_service, register_service, polling_service):
-        self.log_service = log_service
+    def __init__(self, log_service, register_service, polling_service, event_service=None, device_id=None):
+        self.log_service = log_service; self.event_service = event_service # Avisa a los streams SSE (tema "status")
         self.register_service = register_service
         self.polling_service = polling_service
+        self.device_id = device_id; self._thread_suffix = f"-{device_id}" if device_id else "" # Hilos identificables por dispositivo en los logs
         self.client = None
-        self._keep_alive_thread = None; self._stop_keep_alive_event = threading.Event(); self.keep_alive_interval = 15
-        self._state = {"connected": False, "is_connecting": False, "message": "Desconectado", "ip": None, "port": None, "unit_id": None, "mode": None, "uptime_seconds": 0, "last_error": None, "last_keep_alive_ok": None}
-        self._state_lock = threading.Lock(); self._connection_thread = None; self._connection_thread_stop_event = threading.Event(); self._connection_thread_result = {}
+        self.bus_arbiter = BusArbiter() # Un bus = una transacción a la vez; turnos por prioridad
+        self._keep_alive_thread = None; self._stop_keep_alive_event = threading.Event()
+        # Keep-alive: sólo se sondea tras `keep_alive_idle` s sin ninguna respuesta (el tráfico real ya demuestra que el enlace vive)
+        self.keep_alive_idle = 15; self.keep_alive_probe = {"function": FC_READ_HOLDING_REGISTERS, "address": 0} # None = sin sondeo Modbus
+        self.tcp_keepalive = None # {"idle", "interval", "count"}: keepalive TCP del SO, alternativa sin coste en el bus
+        self.request_timeout = {"floor": DEFAULT_TIMEOUT_FLOOR, "ceiling": DEFAULT_TIMEOUT_CEILING} # Límites del plazo adaptativo (RTT medido)
+        self._state = {"connected": False, "is_connecting": False, "message": "Desconectado", "ip": None, "port": None, "unit_id": None, "unit_ids": [], "mode": None, "uptime_seconds": 0, "last_error": None, "last_keep_alive_ok": None}
+        self._state_lock = threading.RLock(); self._connection_thread = None; self._connection_thread_stop_event = threading.Event(); self._connection_thread_result = {} # RLock: disconnect() llama a _update_status() con el lock tomado
         self.max_retries = 6; self.retry_delay = 1.0
 
     # --- Getters (sin cambios) ---
-    def get_client(self):
-        with self._state_lock: return self.client if self._state["connected"] else None
+    def get_client(self, priority=None):
+        """Cliente conectado (o None). Con `priority` cada transacción pide turno al BusArbiter con esa clase."""
+        with self._state_lock: client = self.client if self._state["connected"] else None
+        return ArbitratedClient(client, self.bus_arbiter, priority) if client and priority is not None else client
 
     def get_connection_status(self):
         with self._state_lock:
             if self._state["connected"] and self.client:
                  try: self._state["uptime_seconds"] = self.client.get_connection_uptime()
                  except Exception: self._state["uptime_seconds"] = 0
+                 last_success = self._last_success_time(self.client)
+                 if last_success: self._state["last_keep_alive_ok"] = last_success
             return self._state.copy()
 
     # --- Métodos Internos de Estado (sin cambios) ---
@@ -118,8 +135,28 @@ class ConnectionService:
                      self._state["last_error"] = None
                  if self._state["uptime_seconds"] != 0: updated_keys.append("uptime_seconds_reset")
                  self._state["uptime_seconds"] = 0
+        if updated_keys and self.event_service: self.event_service.notify("status")
         self.log_service.log_debug(f"_update_status: Saliendo. Claves actualizadas: {updated_keys if updated_keys else 'Ninguna'}.")
 
+    @staticmethod
+    def normalize_unit_ids(unit_id, unit_ids=None):
+        """Lista ordenada (principal primero, sin duplicados) de Unit IDs a atender por la conexión."""
+        result = [int(unit_id)]
+        for extra in unit_ids or []:
+            extra = int(extra)
+            if extra not in result: result.append(extra)
+        for uid in result:
+            if not (0 <= uid <= 255): raise ValueError(f"Unit ID fuera de rango (0-255): {uid}")
+        return result
+
+    def set_unit_ids(self, unit_ids):
+        """Cambia el conjunto de Unit IDs servidos por el mismo socket (sin reconectar). El primero pasa a ser el principal."""
+        if not unit_ids: raise ValueError("La lista de Unit IDs no puede estar vacía.")
+        unit_ids = self.normalize_unit_ids(unit_ids[0], unit_ids[1:])
+        self._update_status(unit_id=unit_ids[0], unit_ids=unit_ids)
+        self.log_service.log_info(f"Unit IDs configurados: {unit_ids} (principal {unit_ids[0]}).")
+        return unit_ids
+
     def _reset_state_to_disconnected(self, message="Desconectado", error=None):
          tb_info = ""; client_temp = None
          if error and isinstance(error, Exception): tb_info = "\n" + "".join(traceback.format_exception(type(error), error, error.__traceback__))
@@ -133,11 +170,12 @@ class ConnectionService:
              # Es más seguro actualizar directamente el diccionario aquí.
              self._state["connected"] = False; self._state["is_connecting"] = False
              self._state["message"] = message; self._state["ip"] = None
-             self._state["port"] = None; self._state["unit_id"] = None
+             self._state["port"] = None; self._state["unit_id"] = None; self._state["unit_ids"] = []
              self._state["mode"] = None; self._state["uptime_seconds"] = 0
              self._state["last_error"] = str(error) if error else None
              self._state["last_keep_alive_ok"] = None
              self.log_service.log_debug(f"Estado DENTRO de reset: {self._state}")
+         if self.event_service: self.event_service.notify("status")
          if client_temp:
              self.log_service.log_debug("Intentando desconectar cliente previo en reset...")
              try: client_temp.disconnect(acquire_lock=True)
@@ -172,8 +210,9 @@ class ConnectionService:
           return success
 
     # --- Método Connect (sin cambios respecto a la versión anterior) ---
-    def connect(self, ip, port, unit_id, mode='tcp'):
-         self.log_service.log_info(f"API Connect Request: IP={ip}, Port={port}, UnitID={unit_id}, Mode={mode}")
+    def connect(self, ip, port, unit_id, mode='tcp', pipeline_window=1, unit_ids=None):
+         self.log_service.log_info(f"API Connect Request: IP={ip}, Port={port}, UnitID={unit_id}, UnitIDs={unit_ids}, Mode={mode}, Window={pipeline_window}")
+         unit_ids = self.normalize_unit_ids(unit_id, unit_ids) # Esclavos del bus tras el gateway (el primero es el principal)
          print(f"CONNECT METHOD: START - IP={ip}, Port={port}, UnitID={unit_id}, Mode={mode}")
          local_client = None; thread_created = False; thread_started = False
          response_sent = False; connect_result = None; local_thread_obj = None
@@ -188,7 +227,7 @@ class ConnectionService:
              if not self._check_port_open(ip, int(port)):
                   error_msg = f"Pre-check fallido: No se pudo conectar a {ip}:{port}."
                   self.log_service.log_error(f"CONNECT METHOD: {error_msg}"); print(f"CONNECT METHOD: {error_msg}")
-                  self._update_status(is_connecting=False, connected=False, message="Fallo de conexión", ip=ip, port=int(port), unit_id=int(unit_id), mode=mode, last_error=error_msg)
+                  self._update_status(is_connecting=False, connected=False, message="Fallo de conexión", ip=ip, port=int(port), unit_id=int(unit_id), unit_ids=unit_ids, mode=mode, last_error=error_msg)
                   response_sent = True; return {"success": False, "message": error_msg}
              self.log_service.log_debug("CONNECT METHOD: Readquiriendo lock...")
              with self._state_lock:
@@ -198,10 +237,10 @@ class ConnectionService:
                      return {"success": False, "message": "Proceso ya iniciado."}
                  self.log_service.log_info(f"CONNECT METHOD: Instanciando cliente ({mode.upper()})...")
                  try:
-                      if mode == 'tcp': local_client = ModbusTCPClient()
+                      if mode == 'tcp': local_client = ModbusTCPClient(pipeline_window=pipeline_window)
                       elif mode == 'rtu_over_tcp': local_client = ModbusRtuOverTcpClient()
                       else: raise ValueError(f"Modo desconocido: {mode}")
-                      local_client.set_log_service(self.log_service); self.client = local_client
+                      local_client.set_log_service(self.log_service); local_client.set_tcp_keepalive(self.tcp_keepalive); local_client.set_timeout_limits(**self.request_timeout); self.client = local_client
                       self.log_service.log_debug(f"CONNECT METHOD: Cliente instanciado OK.")
                  except Exception as e: raise ServiceError(f"Fallo crear cliente {mode}: {e}") from e
                  if not self.client or not self.log_service: raise ServiceError("Cliente o LogService None.")
@@ -210,14 +249,14 @@ class ConnectionService:
                  thread_args = (self.log_service, self._connection_thread_stop_event, self._connection_thread_result, ip, int(port), int(unit_id), self.client)
                  self.log_service.log_debug(f"CONNECT METHOD: Args listos."); print(f"CONNECT METHOD: Args listos.")
                  try:
-                     self._connection_thread = threading.Thread(target=connection_worker_standalone, args=thread_args, name="ConnectionWorkerStandalone", daemon=True)
+                     self._connection_thread = threading.Thread(target=connection_worker_standalone, args=thread_args, name=f"ConnectionWorkerStandalone{self._thread_suffix}", daemon=True)
                      local_thread_obj = self._connection_thread; thread_created = True
                      self.log_service.log_debug("CONNECT METHOD: Instancia Thread creada OK."); print("CONNECT METHOD: Instancia Thread creada OK.")
                  except Exception as thread_init_err: raise ServiceError(f"Fallo creación hilo: {thread_init_err}") from thread_init_err
              self.log_service.log_debug("CONNECT METHOD: Lock liberado (preparación).")
              self.log_service.log_debug("CONNECT METHOD: Actualizando estado a 'conectando'...")
              print("CONNECT METHOD: Actualizando estado a 'conectando'...")
-             try: self._update_status(is_connecting=True, connected=False, message="Conectando...", ip=ip, port=int(port), unit_id=int(unit_id), mode=mode, last_error="CLEAR")
+             try: self._update_status(is_connecting=True, connected=False, message="Conectando...", ip=ip, port=int(port), unit_id=int(unit_id), unit_ids=unit_ids, mode=mode, last_error="CLEAR")
              except Exception as update_err: raise ServiceError(f"Fallo al actualizar estado: {update_err}") from update_err
              self.log_service.log_info("CONNECT METHOD: Estado actualizado a 'conectando'.")
              print(f"CONNECT METHOD: Estado actualizado a 'conectando'.")
@@ -229,7 +268,7 @@ class ConnectionService:
                   self.log_service.log_info(f"CONNECT METHOD: Hilo REAL llamado a start() OK.")
                   print(f">>> Hilo worker REAL iniciado OK.")
                   self.log_service.log_debug("CONNECT METHOD: Iniciando monitor...")
-                  threading.Thread(target=self._monitor_connection_worker, args=(self,), daemon=True, name="ConnWorkerMonitor").start()
+                  threading.Thread(target=self._monitor_connection_worker, args=(self,), daemon=True, name=f"ConnWorkerMonitor{self._thread_suffix}").start()
                   self.log_service.log_debug("CONNECT METHOD: Monitor iniciado.")
              except BaseException as start_err: raise ServiceError(f"Fallo en start(): {start_err}") from start_err
              self.log_service.log_debug("CONNECT METHOD: Preparando respuesta JSON éxito...")
@@ -265,9 +304,11 @@ class ConnectionService:
             log_svc.log_info("Monitor: Realizando lectura inicial...")
             try:
                  if service_instance.polling_service:
+                     service_instance.polling_service.reset_breakers() # Conexión nueva: todas las unidades empiezan cerradas
                      read_result = service_instance.polling_service.read_once()
                      log_svc.log_info(f"Monitor: Res lectura inicial: {read_result.get('message')}")
                      if not read_result.get('success'): service_instance._update_status(last_error=f"Lectura inicial falló: {read_result.get('message')}")
+                     if service_instance.polling_service.start_polling(): log_svc.log_info("Monitor: Polling cíclico reanudado.") # Sólo si hay grupos configurados
                  else: log_svc.log_error("Monitor: polling_service no disponible.")
             except Exception as read_err: log_svc.log_error(f"Monitor: Error lectura inicial: {read_err}", exc_info=True); service_instance._update_status(last_error=f"Error lectura inicial: {read_err}")
         else:
@@ -308,40 +349,110 @@ class ConnectionService:
          return {"success": success, "message": final_message}
 
 
-    # --- Keep-Alive (sin cambios) ---
+    # --- Keep-Alive (por inactividad: el tráfico real cuenta como prueba de vida) ---
+    @staticmethod
+    def _last_success_time(client):
+        """Hora (time.time) de la última respuesta recibida por el cliente, o None."""
+        last_activity = getattr(client, "last_activity", None)
+        return time.time() - (time.monotonic() - last_activity) if last_activity else None
+
+    def configure_keep_alive(self, idle=_UNCHANGED, probe=_UNCHANGED, tcp_keepalive=_UNCHANGED):
+        """
+        idle: s sin respuestas antes de sondear. probe: {"function": 0x03|0x04|0x08,
+        "address": n} o None (sin sondeo Modbus). tcp_keepalive: {"idle", "interval",
+        "count"} o None; se aplica ya al socket actual y en las próximas conexiones.
+        """
+        if idle is not _UNCHANGED:
+            idle = float(idle)
+            if idle < MIN_KEEP_ALIVE_IDLE: raise ValueError(f"Inactividad mínima de keep-alive: {MIN_KEEP_ALIVE_IDLE}s.")
+        if probe is not _UNCHANGED and probe is not None:
+            function = int(probe.get("function", FC_READ_HOLDING_REGISTERS)); address = int(probe.get("address", 0))
+            if function not in KEEP_ALIVE_PROBE_FUNCTIONS: raise ValueError(f"Función de sondeo no soportada: {function} (0x03, 0x04 o 0x08).")
+            if not (0 <= address <= 65535): raise ValueError(f"Dirección de sondeo fuera de rango (0-65535): {address}")
+            probe = {"function": function, "address": address}
+        if tcp_keepalive is not _UNCHANGED and tcp_keepalive is not None:
+            tcp_keepalive = {key: int(tcp_keepalive[key]) for key in ("idle", "interval", "count") if tcp_keepalive.get(key) is not None}
+            if any(value <= 0 for value in tcp_keepalive.values()): raise ValueError("Los parámetros de keepalive TCP deben ser positivos.")
+        with self._state_lock:
+            if idle is not _UNCHANGED: self.keep_alive_idle = idle
+            if probe is not _UNCHANGED: self.keep_alive_probe = probe
+            if tcp_keepalive is not _UNCHANGED: self.tcp_keepalive = tcp_keepalive
+            client = self.client
+        if client and tcp_keepalive is not _UNCHANGED: client.set_tcp_keepalive(self.tcp_keepalive)
+        config = self.get_keep_alive_config()
+        self.log_service.log_info(f"[KeepAlive] Configuración: {config}")
+        return config
+
+    def configure_timeouts(self, floor=None, ceiling=None):
+        """Límites (s) del plazo adaptativo de las peticiones; se aplican ya al cliente actual y en las próximas conexiones."""
+        limits = RttEstimator(**self.request_timeout); limits.set_limits(floor, ceiling) # Valida (ValueError) sin tocar el cliente
+        with self._state_lock:
+            self.request_timeout = {"floor": limits.floor, "ceiling": limits.ceiling}
+            client = self.client
+        if client: client.set_timeout_limits(**self.request_timeout)
+        self.log_service.log_info(f"Timeouts adaptativos: floor={limits.floor}s, ceiling={limits.ceiling}s.")
+        return self.get_timeout_stats()
+
+    def get_timeout_stats(self):
+        """RTT medido y plazo actual por unidad (del cliente conectado)."""
+        client = self.client
+        if client: return client.rtt_estimator.get_stats()
+        return dict(self.request_timeout, link=None, units={})
+
+    def get_keep_alive_config(self):
+        return {"idle": self.keep_alive_idle, "probe": self.keep_alive_probe, "tcp_keepalive": self.tcp_keepalive}
+
     def _start_keep_alive(self):
         if self._keep_alive_thread and self._keep_alive_thread.is_alive(): return
         self._stop_keep_alive_event.clear()
-        self._keep_alive_thread = threading.Thread(target=self._keep_alive_worker, name="KeepAliveWorker", daemon=True)
+        self._keep_alive_thread = threading.Thread(target=self._keep_alive_worker, name=f"KeepAliveWorker{self._thread_suffix}", daemon=True)
         self._keep_alive_thread.start()
-        self.log_service.log_info(f"[KeepAlive] Iniciado (intervalo {self.keep_alive_interval}s).")
+        self.log_service.log_info(f"[KeepAlive] Iniciado (sondeo tras {self.keep_alive_idle}s de inactividad).")
     def _stop_keep_alive(self):
         if self._keep_alive_thread:
             if self._keep_alive_thread.is_alive(): self.log_service.log_info("[KeepAlive] Deteniendo..."); self._stop_keep_alive_event.set()
             else: self._stop_keep_alive_event.set()
             self._keep_alive_thread = None
+    def _keep_alive_probe(self, client, unit_id, probe):
+        function = probe["function"]; address = probe["address"]
+        if function == FC_READ_INPUT_REGISTERS: return client.read_input_registers(unit_id, address, 1)
+        if function == FC_DIAGNOSTICS: return client.diagnostics(unit_id, 0, address) # Return Query Data: eco de `address`
+        return client.read_holding_registers(unit_id, address, 1)
     def _keep_alive_worker(self):
         self.log_service.log_info("[KeepAlive] Hilo iniciado.")
+        last_probe = 0.0; reported_activity = None
         while not self._stop_keep_alive_event.is_set():
-            cancelled = self._stop_keep_alive_event.wait(timeout=self.keep_alive_interval);
-            if cancelled: self.log_service.log_info("[KeepAlive] Evento parada."); break
             ka_client = None; ka_unit_id = None; is_conn = False
             with self._state_lock:
                 is_conn = self._state["connected"] and not self._state["is_connecting"]
                 if is_conn and self.client: ka_client = self.client; ka_unit_id = self._state["unit_id"]
             if not is_conn: self.log_service.log_info("[KeepAlive] No conectado."); break
-            if ka_client and ka_unit_id is not None:
-                self.log_service.log_debug("[KeepAlive] Lectura prueba...")
-                ka_time = time.time()
-                try:
-                    vals = ka_client.read_holding_registers(ka_unit_id, 0, 1)
-                    self.log_service.log_debug(f"[KeepAlive] Lectura OK: {vals}")
-                    self._update_status(last_keep_alive_ok=ka_time)
-                except (ConnectionException, socket.error, socket.timeout) as e:
-                     err_msg = f"[KeepAlive] FALLO CONEXIÓN: {e}"; self.log_service.log_error(err_msg + ". Desconectando..."); self.disconnect(True); break
-                except ModbusException as e:
-                     warn_msg = f"[KeepAlive] Error Modbus (Conexión OK): {e}"; self.log_service.log_warning(warn_msg); self._update_status(last_keep_alive_ok=ka_time)
-                except Exception as e:
-                     crit_msg = f"[KeepAlive] Error inesperado: {e}"; self.log_service.log_critical(crit_msg + ". Desconectando...", exc_info=True); self.disconnect(True); break
-            else: self.log_service.log_warning("[KeepAlive] Inconsistente."); break
-        self.log_service.log_info("[KeepAlive] Hilo terminado."); self._keep_alive_thread = None
\ No newline at end of file
+            if not ka_client or ka_unit_id is None: self.log_service.log_warning("[KeepAlive] Inconsistente."); break
+            last_activity = ka_client.last_activity or 0.0
+            remaining = self.keep_alive_idle - (time.monotonic() - max(last_activity, last_probe))
+            if remaining > 0:
+                if last_activity != reported_activity and last_activity > last_probe: # Hubo tráfico real: publicar la prueba de vida sin sondear
+                    reported_activity = last_activity; self._update_status(last_keep_alive_ok=self._last_success_time(ka_client))
+                if self._stop_keep_alive_event.wait(timeout=remaining): break
+                continue
+            probe = self.keep_alive_probe; last_probe = time.monotonic()
+            if probe is None: continue # Sin sondeo Modbus: sólo tráfico real y keepalive TCP
+            self.log_service.log_debug(f"[KeepAlive] {self.keep_alive_idle}s sin respuestas. Sondeo {probe}...")
+            ka_time = time.time(); responsive = ka_client.rtt_estimator.is_responsive(ka_unit_id) # Respondió a su última petición
+            try:
+                vals = self._keep_alive_probe(ArbitratedClient(ka_client, self.bus_arbiter, PRIORITY_KEEP_ALIVE), ka_unit_id, probe)
+                self.log_service.log_debug(f"[KeepAlive] Sondeo OK: {vals}")
+                self._update_status(last_keep_alive_ok=ka_time)
+            except (ConnectionException, socket.error, socket.timeout) as e:
+                 err_msg = f"[KeepAlive] FALLO CONEXIÓN: {e}"; self.log_service.log_error(err_msg + ". Desconectando..."); self.disconnect(True); break
+            except ModbusTimeoutException as e:
+                 if responsive: # Una unidad que respondía deja de hacerlo tras un silencio total del enlace: enlace muerto
+                     self.log_service.log_error(f"[KeepAlive] Unidad {ka_unit_id} sin respuesta al sondeo: {e}. Desconectando..."); self.disconnect(True); break
+                 self.log_service.log_warning(f"[KeepAlive] Sondeo sin respuesta: {e}")
+            except BusBusyException as e: # El sondeo no llegó a enviarse: no prueba nada del enlace
+                 self.log_service.log_debug(f"[KeepAlive] Sondeo omitido: {e}")
+            except ModbusException as e:
+                 warn_msg = f"[KeepAlive] Error Modbus (Conexión OK): {e}"; self.log_service.log_warning(warn_msg); self._update_status(last_keep_alive_ok=ka_time)
+            except Exception as e:
+                 crit_msg = f"[KeepAlive] Error inesperado: {e}"; self.log_service.log_critical(crit_msg + ". Desconectando...", exc_info=True); self.disconnect(True); break
+        self.log_service.log_info("[KeepAlive] Hilo terminado."); self._keep_alive_thread = None
@@ -0,0 +1,128 @@
+# services/device_manager.py
+import os
+import re
+import threading
+from services.register_service import RegisterService
+from services.history_store import HistoryStore
+from services.connection_service import ConnectionService
+from services.polling_service import PollingService
+from services.write_queue import WriteQueue
+
+DEFAULT_DEVICE = "default" # Dispositivo de las rutas /api/... sin identificador
+DEVICE_ID_PATTERN = re.compile(r'^(?!\.)[A-Za-z0-9_.-]{1,64}$') # Sin punto inicial: ".", ".." u ocultos saldrían de HISTORY_DIR o lo compartirían
+MAX_DEVICES = 256
+
+
+class Device:
+    """
+    Un gateway Modbus con sus propios servicios: cliente y estado de conexión,
+    keep-alive, hilo de conexión, registros, cola de escrituras y polling
+    (y, opcionalmente, su histórico en disco).
+    Los servicios de dispositivos distintos no comparten locks ni sockets.
+    """
+    def __init__(self, device_id, log_service, event_service=None, gap_threshold=10, history_store=None):
+        self.device_id = device_id
+        self.history_store = history_store
+        scoped_events = event_service.scoped(device_id) if event_service else None
+        self.register_service = RegisterService(log_service=log_service, gap_threshold=gap_threshold, event_service=scoped_events, history_store=history_store)
+        self.write_queue = WriteQueue(log_service=log_service)
+        self.polling_service = PollingService(log_service=log_service, connection_service=None,
+                                              register_service=self.register_service, write_queue=self.write_queue, device_id=device_id)
+        self.connection_service = ConnectionService(log_service=log_service, register_service=self.register_service,
+                                                    polling_service=self.polling_service, event_service=scoped_events, device_id=device_id)
+        self.polling_service.connection_service = self.connection_service
+        self.config = {} # Últimos parámetros de conexión (ip, port, unit_id, unit_ids, mode, pipeline_window)
+
+    def connect(self, ip, port, unit_id, mode='tcp', pipeline_window=1, unit_ids=None):
+        self.config = {"ip": ip, "port": port, "unit_id": unit_id, "unit_ids": unit_ids, "mode": mode, "pipeline_window": pipeline_window}
+        return self.connection_service.connect(ip, port, unit_id, mode, pipeline_window, unit_ids)
+
+    def disconnect(self):
+        self.polling_service.stop_polling()
+        return self.connection_service.disconnect()
+
+    def get_summary(self):
+        status = self.connection_service.get_connection_status()
+        return {"id": self.device_id, "config": self.config, "connected": status["connected"], "is_connecting": status["is_connecting"],
+                "message": status["message"], "last_error": status["last_error"], "polling": self.polling_service.is_polling()}
+
+
+class DeviceManager:
+    """
+    Registro de dispositivos (gateways) atendidos por este proceso. Cada uno
+    se conecta, sondea y se desconecta de forma independiente; el dispositivo
+    DEFAULT_DEVICE existe siempre y atiende las rutas sin identificador.
+    """
+    def __init__(self, log_service, event_service=None, max_devices=MAX_DEVICES, history_dir=None, history_options=None):
+        self.log_service = log_service
+        self.event_service = event_service
+        self.max_devices = max_devices
+        self.history_dir = history_dir # Con directorio: histórico en disco por dispositivo (<dir>/<device_id>/)
+        self.history_options = history_options or {} # Parámetros de HistoryStore (rotación, retención)
+        self._devices = {}
+        self._lock = threading.Lock()
+        self.add_device(DEFAULT_DEVICE)
+
+    def add_device(self, device_id, gap_threshold=10):
+        """Crea un dispositivo (aún sin conectar). Lanza ValueError si el id no es válido o ya existe."""
+        device_id = str(device_id)
+        if not DEVICE_ID_PATTERN.match(device_id):
+            raise ValueError(f"Identificador de dispositivo inválido: '{device_id}' (letras, dígitos, '_', '-', '.' salvo al inicio; máx. 64).")
+        history_path = self._history_path(device_id) if self.history_dir else None
+        with self._lock:
+            if device_id in self._devices:
+                raise ValueError(f"El dispositivo '{device_id}' ya existe.")
+            if len(self._devices) >= self.max_devices:
+                raise ValueError(f"Límite de dispositivos alcanzado ({self.max_devices}).")
+            history_store = HistoryStore(history_path, log_service=self.log_service, **self.history_options) if self.history_dir else None
+            device = Device(device_id, self.log_service, self.event_service, gap_threshold, history_store)
+            self._devices[device_id] = device
+        self.log_service.log_info(f"DeviceManager: Dispositivo '{device_id}' registrado.")
+        return device
+
+    def _history_path(self, device_id):
+        """Directorio del histórico del dispositivo; ValueError si no queda justo debajo de history_dir."""
+        base = os.path.realpath(self.history_dir)
+        path = os.path.realpath(os.path.join(base, device_id))
+        if os.path.dirname(path) != base:
+            raise ValueError(f"Identificador de dispositivo inválido: '{device_id}' (fuera del directorio de histórico).")
+        return path
+
+    def get_device(self, device_id):
+        with self._lock:
+            return self._devices.get(device_id)
+
+    def remove_device(self, device_id):
+        """Desconecta y elimina un dispositivo. El dispositivo por defecto no se puede eliminar."""
+        if device_id == DEFAULT_DEVICE:
+            raise ValueError(f"El dispositivo '{DEFAULT_DEVICE}' no se puede eliminar.")
+        with self._lock:
+            device = self._devices.pop(device_id, None)
+        if device is None:
+            return False
+        device.polling_service.stop_polling()
+        device.connection_service.disconnect(initiated_by_polling=True) # Silencioso si no estaba conectado
+        if device.history_store:
+            device.history_store.close() # Los segmentos se conservan
+        if self.event_service:
+            self.event_service.discard_scope(device_id)
+        self.log_service.log_info(f"DeviceManager: Dispositivo '{device_id}' eliminado.")
+        return True
+
+    def list_devices(self):
+        with self._lock:
+            devices = list(self._devices.values())
+        return [device.get_summary() for device in devices]
+
+    def shutdown(self):
+        """Detiene el polling y desconecta todos los dispositivos (cierre del proceso)."""
+        with self._lock:
+            devices = list(self._devices.values())
+        for device in devices:
+            try:
+                device.polling_service.stop_polling()
+                device.connection_service.disconnect(initiated_by_polling=True)
+                if device.history_store:
+                    device.history_store.close()
+            except Exception as e:
+                self.log_service.log_error(f"DeviceManager: Error desconectando '{device.device_id}': {e}")
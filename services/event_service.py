@@ -0,0 +1,66 @@
+# services/event_service.py
+import threading
+
+# Temas que se publican por /api/events
+EVENT_TOPICS = ("status", "registers", "changes", "log")
+
+
+class EventService:
+    """
+    Notificación de cambios para los streams SSE (/api/events).
+    Cada tema tiene un contador de versión; los servicios lo incrementan al
+    cambiar su estado (notify) y cada stream espera en una Condition hasta que
+    alguna versión difiera de la última que envió. Sin cambios no hay trabajo:
+    ni peticiones del navegador ni locks de los servicios.
+    """
+    def __init__(self):
+        self._versions = dict.fromkeys(EVENT_TOPICS, 0)
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def scoped_topic(topic, scope=None):
+        """Nombre del tema `topic` de un dispositivo concreto ("status:planta1")."""
+        return topic if scope is None else f"{topic}:{scope}"
+
+    def scoped(self, scope):
+        """Vista que publica sus temas con el ámbito `scope` (un dispositivo), en la misma Condition."""
+        return ScopedEventService(self, scope)
+
+    def notify(self, topic):
+        """Marca `topic` como cambiado y despierta a los streams en espera."""
+        with self._condition:
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+            self._condition.notify_all()
+
+    def discard_scope(self, scope):
+        """Olvida los contadores de un dispositivo eliminado."""
+        suffix = f":{scope}"
+        with self._condition:
+            for topic in [t for t in self._versions if t.endswith(suffix)]:
+                del self._versions[topic]
+            self._condition.notify_all()
+
+    def get_versions(self):
+        with self._condition:
+            return dict(self._versions)
+
+    def wait_for_change(self, versions, topics=EVENT_TOPICS, timeout=None):
+        """
+        Espera (como mucho `timeout` s) a que algún tema de `topics` tenga una
+        versión distinta de la de `versions` (un dict vacío fuerza el envío
+        inicial). Devuelve (versiones actuales, temas cambiados).
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: any(self._versions.get(topic, 0) != versions.get(topic) for topic in topics), timeout)
+            current = {topic: self._versions.get(topic, 0) for topic in topics}
+        return current, [topic for topic in topics if current[topic] != versions.get(topic)]
+
+
+class ScopedEventService:
+    """EventService visto desde un dispositivo: notify("status") publica "status:<scope>"."""
+    def __init__(self, event_service, scope):
+        self._event_service = event_service
+        self.scope = scope
+
+    def notify(self, topic):
+        self._event_service.notify(EventService.scoped_topic(topic, self.scope))
@@ -0,0 +1,343 @@
+# services/history_store.py
+import os
+import mmap
+import time
+import queue
+import bisect
+import struct
+import threading
+
+# Registro de ancho fijo (16 bytes): timestamp, unit_id, dirección, valor, tipo (+1 byte de relleno)
+RECORD = struct.Struct('<dHHHBx')
+RECORD_CHANGE = 0 # Cambio emitido por RegisterService (delta)
+RECORD_KEYFRAME = 1 # Valor vigente copiado al empezar un segmento (replay sin leer segmentos anteriores)
+
+SEGMENT_SUFFIX = ".seg"
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024 # Rotación por tamaño (1 M registros)
+DEFAULT_SEGMENT_SECONDS = 3600 # Rotación por antigüedad del segmento
+DEFAULT_RETENTION_BYTES = 1024 * 1024 * 1024 # Se borran los segmentos más antiguos por encima de esto...
+DEFAULT_RETENTION_SECONDS = 7 * 24 * 3600 # ...o cuyo último registro sea más antiguo que esto
+INDEX_STRIDE = 1024 # Registros entre entradas del índice disperso
+READ_CHUNK = 4096 # Registros que se desempaquetan de una vez al recorrer un segmento
+MAX_QUERY_RECORDS = 100000
+_MAX_BATCH = 1000 # Lotes de cambios que el escritor junta por escritura
+
+
+class _Segment:
+    """Metadatos de un segmento: fichero, nº de registros, primer/último timestamp e índice disperso."""
+    __slots__ = ("path", "number", "count", "first_time", "last_time", "index", "created")
+
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        self.count = 0
+        self.first_time = None
+        self.last_time = None
+        self.index = [] # Timestamp del registro k * INDEX_STRIDE
+        self.created = time.time()
+
+    def load(self):
+        """Metadatos de un segmento existente: sólo se leen 1 de cada INDEX_STRIDE registros (vía mmap)."""
+        size = os.path.getsize(self.path)
+        self.count = size // RECORD.size
+        if not self.count:
+            return
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), self.count * RECORD.size, access=mmap.ACCESS_READ) as data:
+            self.index = [RECORD.unpack_from(data, position * RECORD.size)[0] for position in range(0, self.count, INDEX_STRIDE)]
+            self.first_time = self.index[0]
+            self.last_time = RECORD.unpack_from(data, (self.count - 1) * RECORD.size)[0]
+
+    def add(self, timestamps):
+        """Anota registros recién escritos (con el lock del store tomado)."""
+        for timestamp in timestamps:
+            if self.count % INDEX_STRIDE == 0:
+                self.index.append(timestamp)
+            self.count += 1
+        if timestamps:
+            self.first_time = self.index[0]
+            self.last_time = timestamps[-1]
+
+    def size(self):
+        return self.count * RECORD.size
+
+
+class _StoreControl:
+    """Orden para el hilo escritor, procesada en orden con los cambios (flush, parar)."""
+    __slots__ = ("action", "done")
+
+    def __init__(self, action):
+        self.action = action
+        self.done = threading.Event()
+
+
+class HistoryStore:
+    """
+    Histórico en disco de los cambios de registros de un dispositivo. Cada
+    cambio es un registro binario de ancho fijo, añadido al final del
+    segmento actual; los segmentos rotan por tamaño/antigüedad y los más
+    viejos se borran por tamaño total/edad. El polling sólo encola (append);
+    un hilo escritor agrupa los cambios en una escritura por lote. Las
+    consultas abren los segmentos con mmap, saltan al primer registro del
+    rango con el índice disperso y recorren el resto por trozos, sin cargar
+    ficheros enteros en memoria. Cada segmento empieza con los valores
+    vigentes (keyframes), así el estado en un instante se reconstruye
+    leyendo un único segmento.
+    """
+    def __init__(self, directory, log_service=None, segment_bytes=DEFAULT_SEGMENT_BYTES, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                 retention_bytes=DEFAULT_RETENTION_BYTES, retention_seconds=DEFAULT_RETENTION_SECONDS):
+        self.directory = directory
+        self.log_service = log_service
+        self.segment_bytes = segment_bytes # 0 = sin rotación por tamaño
+        self.segment_seconds = segment_seconds # 0 = sin rotación por tiempo
+        self.retention_bytes = retention_bytes # 0 = sin límite
+        self.retention_seconds = retention_seconds # 0 = sin límite
+        self._lock = threading.Lock() # Protege la lista de segmentos (escritor vs. consultas)
+        self._segments = []
+        self._file = None # Segmento actual (sólo lo usa el escritor)
+        self._last_time = 0.0
+        self._state = {} # (unit_id, dirección) -> último valor escrito (keyframes al rotar)
+        self._unremoved = [] # Segmentos retirados cuyo borrado falló (p.ej. Windows con el fichero mapeado): se reintentan al rotar
+        self.written = 0
+        self.dropped = 0 # Cambios descartados por cola llena (con _dropped_lock: lo incrementan los productores y lo vacía el escritor)
+        self._dropped_lock = threading.Lock()
+        self.max_pending = 10000
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                segment = _Segment(os.path.join(directory, name), int(name[:-len(SEGMENT_SUFFIX)]))
+                try:
+                    segment.load()
+                except (OSError, ValueError) as e:
+                    self._log_warning(f"HistoryStore: segmento ilegible {segment.path} ({e}), se ignora.")
+                    continue
+                if segment.count:
+                    self._segments.append(segment); self._last_time = max(self._last_time, segment.last_time)
+                else:
+                    self._remove_files([segment.path])
+        self._queue = queue.SimpleQueue()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name=f"HistoryWriter-{os.path.basename(directory)}", daemon=True)
+        self._writer_thread.start()
+
+    def _log_warning(self, message):
+        if self.log_service:
+            self.log_service.log_warning(message)
+
+    def append(self, unit_id, timestamp, changes):
+        """Encola los cambios [[dirección, valor], ...] de una lectura y vuelve enseguida (nunca bloquea)."""
+        if self._queue.qsize() >= self.max_pending:
+            with self._dropped_lock:
+                self.dropped += len(changes)
+            return
+        self._queue.put((unit_id, timestamp, changes))
+
+    # --- Hilo escritor ---
+
+    def _writer_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < _MAX_BATCH:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            pending = []
+            for item in batch:
+                if isinstance(item, _StoreControl): # Escribir lo anterior antes de atender la orden
+                    self._write(pending); pending = []
+                    if item.action == "stop":
+                        self._close_file()
+                    item.done.set()
+                    if item.action == "stop":
+                        return
+                else:
+                    pending.append(item)
+            self._write(pending)
+
+    def _write(self, items):
+        if self.dropped:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            self._log_warning(f"HistoryStore: {dropped} cambios descartados (escritor saturado).")
+        if not items:
+            return
+        try:
+            if self._file is None or self._should_rotate():
+                self._rotate()
+            buffer = bytearray(RECORD.size * sum(len(changes) for _, _, changes in items))
+            timestamps = []
+            offset = 0; last_time = self._last_time; state = self._state
+            for unit_id, timestamp, changes in items:
+                last_time = max(last_time, timestamp) # Orden no decreciente dentro del fichero (índice)
+                for address, value in changes:
+                    RECORD.pack_into(buffer, offset, last_time, unit_id, address, value, RECORD_CHANGE); offset += RECORD.size
+                    state[(unit_id, address)] = value
+                timestamps.extend([last_time] * len(changes))
+            self._file.write(buffer); self._file.flush()
+            self._last_time = last_time; self.written += len(timestamps)
+            with self._lock:
+                self._segments[-1].add(timestamps)
+        except OSError as e:
+            self._log_warning(f"HistoryStore: error escribiendo {self.directory} ({e}); {sum(len(c) for _, _, c in items)} cambios perdidos.")
+            self._close_file()
+
+    def _should_rotate(self):
+        segment = self._segments[-1]
+        return ((self.segment_bytes and segment.size() >= self.segment_bytes) or
+                (self.segment_seconds and time.time() - segment.created >= self.segment_seconds))
+
+    def _rotate(self):
+        """Cierra el segmento actual, abre otro (con keyframes de los valores vigentes) y aplica la retención."""
+        self._close_file()
+        number = self._segments[-1].number + 1 if self._segments else 1
+        segment = _Segment(os.path.join(self.directory, f"{number:010d}{SEGMENT_SUFFIX}"), number)
+        self._file = open(segment.path, "ab")
+        with self._lock:
+            self._segments.append(segment)
+        if self._state:
+            buffer = bytearray(RECORD.size * len(self._state)); offset = 0
+            for (unit_id, address), value in sorted(self._state.items()):
+                RECORD.pack_into(buffer, offset, self._last_time, unit_id, address, value, RECORD_KEYFRAME); offset += RECORD.size
+            self._file.write(buffer)
+            with self._lock:
+                segment.add([self._last_time] * len(self._state))
+        self._apply_retention()
+
+    def _apply_retention(self):
+        now = time.time()
+        with self._lock:
+            removed = []
+            while len(self._segments) > 1: # El actual nunca se borra
+                oldest = self._segments[0]
+                total = sum(segment.size() for segment in self._segments)
+                if not ((self.retention_bytes and total > self.retention_bytes) or
+                        (self.retention_seconds and oldest.last_time is not None and now - oldest.last_time > self.retention_seconds)):
+                    break
+                removed.append(self._segments.pop(0).path)
+        self._remove_files(self._unremoved + removed)
+
+    def _remove_files(self, paths):
+        """
+        Borra segmentos ya retirados de la lista. En POSIX una consulta que
+        lo tenga abierto (mmap) sigue leyéndolo; en Windows el borrado falla
+        mientras esté mapeado y se reintenta en la próxima rotación.
+        """
+        failed = []
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                if path not in self._unremoved:
+                    self._log_warning(f"HistoryStore: no se pudo borrar {path} ({e}); se reintentará al rotar.")
+                failed.append(path)
+        self._unremoved = failed
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def _send_control(self, action, timeout):
+        control = _StoreControl(action)
+        self._queue.put(control)
+        if threading.current_thread() is not self._writer_thread:
+            control.done.wait(timeout)
+        return control.done.is_set()
+
+    def flush(self, timeout=5):
+        """Espera a que el escritor haya escrito todo lo encolado hasta ahora."""
+        return self._send_control("flush", timeout)
+
+    def close(self, timeout=5):
+        """Escribe lo pendiente, cierra el segmento y detiene el escritor (los ficheros se conservan)."""
+        if self._writer_thread.is_alive():
+            self._send_control("stop", timeout)
+
+    # --- Consultas ---
+
+    def _segments_for(self, start, end):
+        with self._lock: # (segmento, nº de registros visibles ahora): lo que se escriba después no se lee
+            return [(segment, segment.count) for segment in self._segments
+                    if segment.count and (end is None or segment.first_time <= end) and (start is None or segment.last_time >= start)]
+
+    @staticmethod
+    def _iter_segment(segment, count, start, end):
+        """Registros (timestamp, unit_id, dirección, valor, tipo) de un segmento con timestamp en [start, end]."""
+        try:
+            file = open(segment.path, "rb")
+        except FileNotFoundError: # Borrado por la retención entretanto
+            return
+        with file, mmap.mmap(file.fileno(), count * RECORD.size, access=mmap.ACCESS_READ) as data:
+            position = 0
+            if start is not None: # Índice disperso: saltar al último bloque que empieza antes de `start`
+                position = max(0, bisect.bisect_left(segment.index, start) - 1) * INDEX_STRIDE
+            while position < count: # Por trozos: en memoria sólo READ_CHUNK registros a la vez
+                chunk = min(READ_CHUNK, count - position)
+                records = RECORD.iter_unpack(data[position * RECORD.size:(position + chunk) * RECORD.size])
+                position += chunk
+                last_time = RECORD.unpack_from(data, (position - 1) * RECORD.size)[0]
+                if (end is None or last_time <= end) and (start is None or RECORD.unpack_from(data, (position - chunk) * RECORD.size)[0] >= start):
+                    yield from records # Trozo entero dentro del rango: sin comparar registro a registro
+                    continue
+                for record in records:
+                    if end is not None and record[0] > end:
+                        return
+                    if start is None or record[0] >= start:
+                        yield record
+
+    def iter_records(self, start=None, end=None, unit_id=None, addresses=None, keyframes=False):
+        """
+        Generador de cambios (timestamp, unit_id, dirección, valor) en [start, end],
+        en orden, segmento a segmento. Con `keyframes` incluye también los
+        valores vigentes repetidos al principio de cada segmento.
+        """
+        addresses = set(addresses) if addresses is not None else None
+        for segment, count in self._segments_for(start, end):
+            records = self._iter_segment(segment, count, start, end)
+            if unit_id is None and addresses is None:
+                yield from (record[:4] for record in records if keyframes or record[4] == RECORD_CHANGE)
+                continue
+            for timestamp, record_unit, address, value, kind in records:
+                if (kind == RECORD_CHANGE or keyframes) and (unit_id is None or record_unit == unit_id) and (addresses is None or address in addresses):
+                    yield timestamp, record_unit, address, value
+
+    def query(self, start=None, end=None, unit_id=None, addresses=None, limit=MAX_QUERY_RECORDS):
+        """
+        {"records": [[timestamp, unit_id, dirección, valor], ...], "truncated"}:
+        como mucho `limit` cambios; con "truncated" se sigue pidiendo desde el
+        timestamp del último registro devuelto.
+        """
+        records = []
+        for record in self.iter_records(start, end, unit_id, addresses):
+            if len(records) >= limit:
+                return {"records": records, "truncated": True}
+            records.append(list(record))
+        return {"records": records, "truncated": False}
+
+    def snapshot_at(self, timestamp, unit_id=None):
+        """
+        Valores vigentes en `timestamp`: {unit_id: {dirección: valor}}. Se lee
+        sólo el segmento que lo contiene (empieza con keyframes) hasta ese instante.
+        """
+        with self._lock:
+            candidates = [(segment, segment.count) for segment in self._segments if segment.count and segment.first_time <= timestamp]
+        state = {}
+        if candidates:
+            segment, count = candidates[-1]
+            for record_time, record_unit, address, value, kind in self._iter_segment(segment, count, None, timestamp):
+                if unit_id is None or record_unit == unit_id:
+                    state.setdefault(record_unit, {})[address] = value
+        return state
+
+    def get_stats(self):
+        with self._lock:
+            segments = [{"file": os.path.basename(segment.path), "records": segment.count, "bytes": segment.size(),
+                         "first_time": segment.first_time, "last_time": segment.last_time} for segment in self._segments]
+        return {"directory": self.directory, "segments": segments, "bytes": sum(segment["bytes"] for segment in segments),
+                "written": self.written, "pending": self._queue.qsize(), "unremoved": len(self._unremoved),
+                "config": {"segment_bytes": self.segment_bytes, "segment_seconds": self.segment_seconds,
+                           "retention_bytes": self.retention_bytes, "retention_seconds": self.retention_seconds}}
@@ -1,69 +1,375 @@
+import os
+import sys
 import time
+import queue
+import atexit
 import traceback # Para formatear tracebacks
 from collections import deque
 import threading
 
+# Niveles de log (numéricos para comparar con el umbral)
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARN": 30, "ERROR": 40, "CRITICAL": 50}
+_LEVEL_ALIASES = {"WARNING": "WARN"}
+_MAX_BATCH = 500 # Entradas máximas que el escritor procesa por ciclo
+
+
+class LogRecord:
+    """
+    Entrada de log. El mensaje se guarda sin formatear (plantilla con estilo
+    % + argumentos) y sólo se formatea la primera vez que se muestra, en el
+    hilo escritor. Los argumentos no deben modificarse después de loguearlos.
+    """
+    __slots__ = ("seq", "created", "level", "thread_name", "layer", "message", "args", "exc_text", "_text")
+
+    def __init__(self, level, message, args, layer=None, exc_text=None):
+        self.created = time.time()
+        self.level = level
+        self.thread_name = threading.current_thread().name
+        self.layer = layer
+        self.message = message
+        self.args = args
+        self.exc_text = exc_text
+        self._text = None
+        self.seq = 0 # Lo asigna el hilo escritor al guardar la entrada (creciente, nunca se reutiliza)
+
+    def get_message(self):
+        """Mensaje con los argumentos ya aplicados."""
+        message = self.message
+        if self.args:
+            try:
+                message = message % self.args
+            except (TypeError, ValueError):
+                message = f"{message} {self.args!r}" # Plantilla y argumentos no casan: no perder el dato
+        if self.layer:
+            message = f"[{self.layer}] {message}"
+        if self.exc_text:
+            message += f"\nTraceback:\n{self.exc_text}"
+        return message
+
+    def format(self):
+        """Línea completa: fecha [LEVEL][ThreadName] Mensaje (cacheada)."""
+        if self._text is None:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.created))
+            self._text = f"{timestamp} [{self.level}][{self.thread_name}] {self.get_message()}"
+        return self._text
+
+
+class RotatingFileSink:
+    """
+    Fichero de log con rotación por tamaño y/o por tiempo: fichero.log pasa a
+    fichero.log.1, .1 a .2, ... conservando `backup_count` copias.
+    Recibe lotes de líneas (una escritura por lote). Sólo lo usa el hilo escritor.
+    """
+    def __init__(self, filename, max_bytes=5 * 1024 * 1024, backup_count=5, rotate_seconds=0):
+        self.filename = filename
+        self.max_bytes = max_bytes # 0 = sin rotación por tamaño
+        self.backup_count = backup_count
+        self.rotate_seconds = rotate_seconds # 0 = sin rotación por tiempo
+        self._file = None
+        self._opened_at = None
+        self._size = 0
+
+    def _open(self):
+        directory = os.path.dirname(self.filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.filename, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        self._opened_at = time.time()
+
+    def _rotate(self):
+        self.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = f"{self.filename}.{index}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.filename}.{index + 1}")
+            if os.path.exists(self.filename):
+                os.replace(self.filename, f"{self.filename}.1")
+        else:
+            open(self.filename, "w").close() # Sin copias: truncar
+        self._open()
+
+    def write_lines(self, lines):
+        if self._file is None:
+            self._open()
+        data = "\n".join(lines) + "\n"
+        if self._size and ((self.max_bytes and self._size + len(data) > self.max_bytes) or
+                           (self.rotate_seconds and time.time() - self._opened_at >= self.rotate_seconds)):
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _LogControl:
+    """Orden para el hilo escritor, procesada en orden con las entradas (vaciar log, flush, parar)."""
+    __slots__ = ("action", "done")
+
+    def __init__(self, action):
+        self.action = action
+        self.done = threading.Event()
+
+
 class LogService:
-    def __init__(self, max_log_size=250): # Aumentar tamaño un poco
+    """
+    Logs de la aplicación. Quien loguea sólo filtra por nivel y encola la
+    entrada (SimpleQueue, sin locks); un único hilo escritor la formatea y la
+    reparte por lotes al buffer en memoria (visor de debug), a stdout y,
+    opcionalmente, a un fichero rotativo. Así un stdout lento (journald, pipe
+    de contenedor) nunca añade latencia a una transacción Modbus.
+    """
+    def __init__(self, max_log_size=250, level="INFO", console=True, file_sink=None, max_pending=10000, event_service=None): # Aumentar tamaño un poco
         self._debug_log = deque(maxlen=max_log_size)
-        self._log_lock = threading.Lock()
+        self._log_lock = threading.Lock() # Sólo protege _debug_log (lectores vs. escritor)
+        self._last_seq = 0 # Nº de secuencia de la última entrada guardada (cursor de /api/debuglog)
+        self._clear_seq = 0 # Nº de secuencia del último clear_logs(): cursores anteriores deben recargar
+        self._level_no = LOG_LEVELS["INFO"]
+        self.set_level(level)
+        self.console = console
+        self.file_sink = file_sink # RotatingFileSink o None
+        self.max_pending = max_pending # Si el escritor no da abasto se descarta en vez de bloquear
+        self.dropped = 0 # Entradas descartadas por cola llena (con _dropped_lock: lo incrementan varios hilos)
+        self._dropped_lock = threading.Lock()
+        self._write_lock = threading.Lock() # Serializa las escrituras: el hilo escritor y, tras close(), los propios productores
+        self._closed = False # Tras close() las entradas se escriben en el hilo que loguea
+        self.event_service = event_service # Avisa a los streams SSE de entradas nuevas (tema "log")
+        self._queue = queue.SimpleQueue()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="LogWriter", daemon=True)
+        self._writer_thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _normalize_level(level):
+        level = _LEVEL_ALIASES.get(str(level).upper(), str(level).upper())
+        if level not in LOG_LEVELS:
+            raise ValueError(f"Nivel de log desconocido: {level}. Válidos: {', '.join(LOG_LEVELS)}")
+        return level
+
+    def set_level(self, level):
+        """Cambia el umbral: las entradas por debajo se descartan sin formatear."""
+        self._level_no = LOG_LEVELS[self._normalize_level(level)]
+
+    def get_level(self):
+        for name, number in LOG_LEVELS.items():
+            if number == self._level_no:
+                return name
 
-    def _add_entry(self, level, message, exc_info=False): # Aceptar exc_info
-        """Añade una entrada al log, opcionalmente con traceback."""
-        full_message = message
+    def is_enabled_for(self, level):
+        """True si una entrada de `level` pasaría el umbral (para evitar construir mensajes caros)."""
+        return LOG_LEVELS.get(level, 0) >= self._level_no
+
+    def _add_entry(self, level, message, args=(), exc_info=False, layer=None): # Aceptar exc_info
+        """Encola una entrada (opcionalmente con traceback) y vuelve enseguida."""
+        if LOG_LEVELS[level] < self._level_no:
+            return # Por debajo del umbral: ni se formatea ni se guarda
+        exc_text = None
         # Si exc_info es True, obtener y añadir el traceback formateado
         if exc_info:
             try:
-                # format_exc() devuelve el traceback de la excepción actual
+                # format_exc() devuelve el traceback de la excepción actual (sólo existe ahora)
                 exc_text = traceback.format_exc()
-                full_message += f"\nTraceback:\n{exc_text}"
             except Exception:
                 # Por si format_exc falla por alguna razón
-                full_message += "\n(Error al obtener traceback)"
+                exc_text = "(Error al obtener traceback)"
+
+        record = LogRecord(level, message, args, layer, exc_text)
+        if self._closed: # Sin hilo escritor (p.ej. logs durante el apagado): escribir ya
+            self._write_records([record])
+            return
+        if self._queue.qsize() >= self.max_pending:
+            with self._dropped_lock:
+                self.dropped += 1 # Nunca bloquear al productor
+            return
+        self._queue.put(record)
+        if self._closed: # close() terminó entre la comprobación y el put: nadie más vaciará la cola
+            self._drain_queue()
+
+    # --- Hilo escritor ---
+
+    def _writer_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < _MAX_BATCH:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            records = []
+            for item in batch:
+                if isinstance(item, _LogControl):
+                    self._write_records(records) # Respetar el orden respecto a la orden
+                    records = []
+                    if self._run_control(item):
+                        return
+                else:
+                    records.append(item)
+            self._write_records(records)
 
+    def _run_control(self, control):
+        """Ejecuta una orden del escritor. Devuelve True si el hilo debe terminar."""
+        try:
+            if control.action == "clear":
+                with self._log_lock:
+                    self._debug_log.clear()
+                    self._last_seq += 1 # El clear ocupa un nº propio: también el cursor de un cliente al día es anterior
+                    self._clear_seq = self._last_seq
+                if self.event_service:
+                    self.event_service.notify("log")
+            elif control.action == "stop" and self.file_sink:
+                self.file_sink.close()
+        finally:
+            control.done.set()
+        return control.action == "stop"
+
+    def _write_records(self, records):
+        with self._write_lock:
+            self._write_records_locked(records)
+
+    def _write_records_locked(self, records):
+        if self.dropped:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            records.append(LogRecord("WARN", "LogService: %d entradas descartadas (escritor saturado).", (dropped,)))
+        if not records:
+            return
+        lines = [record.format() for record in records]
         with self._log_lock:
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-            thread_name = threading.current_thread().name
-            # Formato [LEVEL][ThreadName] Mensaje
-            log_entry = f"{timestamp} [{level}][{thread_name}] {full_message}"
-            print(log_entry) # Imprimir siempre a consola
-            self._debug_log.append(log_entry)
+            for record in records:
+                self._last_seq += 1
+                record.seq = self._last_seq
+            self._debug_log.extend(records)
+        if self.event_service:
+            self.event_service.notify("log") # Una notificación por lote
+        if self.console:
+            try:
+                sys.stdout.write("\n".join(lines) + "\n") # Una escritura por lote
+                sys.stdout.flush()
+            except Exception:
+                pass # stdout cerrado/roto: no afecta al resto de sinks
+        if self.file_sink:
+            try:
+                self.file_sink.write_lines(lines)
+            except Exception as e:
+                try:
+                    sys.stderr.write(f"LogService: error escribiendo fichero de log ({e}).\n")
+                except Exception:
+                    pass
 
-    # Métodos públicos ahora aceptan exc_info
-    def log_debug(self, message, exc_info=False):
-        self._add_entry("DEBUG", message, exc_info)
+    def _send_control(self, action, timeout):
+        control = _LogControl(action)
+        if self._closed: # Sin escritor: ejecutarla aquí, en orden tras lo pendiente
+            self._drain_queue(); self._run_control(control)
+            return True
+        self._queue.put(control)
+        if threading.current_thread() is not self._writer_thread:
+            control.done.wait(timeout)
+        return control.done.is_set()
 
-    def log_info(self, message, exc_info=False):
-        self._add_entry("INFO", message, exc_info)
+    def flush(self, timeout=5):
+        """Espera a que el escritor haya procesado todo lo encolado hasta ahora."""
+        return self._send_control("flush", timeout)
 
-    def log_warning(self, message, exc_info=False):
-        self._add_entry("WARN", message, exc_info)
+    def close(self, timeout=5):
+        """
+        Procesa lo pendiente, cierra el fichero y detiene el escritor. Lo que
+        se loguee después se escribe de forma síncrona en el hilo que loguea
+        (el fichero se reabre si hace falta) en vez de perderse.
+        """
+        if self._writer_thread.is_alive():
+            self._send_control("stop", timeout)
+        self._closed = True
+        self._drain_queue()
 
-    def log_error(self, message, exc_info=False):
-        self._add_entry("ERROR", message, exc_info)
+    def _drain_queue(self):
+        """Escribe lo que quede en la cola sin el hilo escritor (tras close())."""
+        records = []
+        try:
+            while True:
+                item = self._queue.get_nowait()
+                if isinstance(item, _LogControl):
+                    item.done.set() # Nadie la ejecutará: no dejar esperando a quien la envió
+                else:
+                    records.append(item)
+        except queue.Empty:
+            pass
+        self._write_records(records)
 
-    def log_critical(self, message, exc_info=False):
-         self._add_entry("CRITICAL", message, exc_info)
+    def log(self, level, message, *args, exc_info=False, layer=None):
+        """Entrada genérica por nombre de nivel (lo usan los clientes Modbus)."""
+        if level not in LOG_LEVELS:
+            level = _LEVEL_ALIASES.get(level, "DEBUG")
+        self._add_entry(level, message, args, exc_info, layer)
+
+    # Métodos públicos ahora aceptan exc_info y argumentos diferidos (estilo %)
+    def log_debug(self, message, *args, exc_info=False, layer=None):
+        self._add_entry("DEBUG", message, args, exc_info, layer)
+
+    def log_info(self, message, *args, exc_info=False, layer=None):
+        self._add_entry("INFO", message, args, exc_info, layer)
+
+    def log_warning(self, message, *args, exc_info=False, layer=None):
+        self._add_entry("WARN", message, args, exc_info, layer)
+
+    def log_error(self, message, *args, exc_info=False, layer=None):
+        self._add_entry("ERROR", message, args, exc_info, layer)
+
+    def log_critical(self, message, *args, exc_info=False, layer=None):
+         self._add_entry("CRITICAL", message, args, exc_info, layer)
 
     def get_logs(self):
         """Devuelve las últimas entradas del log."""
         with self._log_lock:
-            return list(self._debug_log)
+            records = list(self._debug_log)
+        return [record.format() for record in records]
+
+    def get_logs_since(self, since=0, level=None, layers=None):
+        """
+        Entradas posteriores al cursor `since` (nº de secuencia), opcionalmente
+        filtradas por nivel mínimo y por capas (SOCKET, MB_RECV, ...).
+        Devuelve {"logs", "cursor", "reset"}; con reset=True el cursor ya no
+        es válido (logs limpiados o servidor reiniciado) y se devuelven todas
+        las entradas disponibles para recargar la vista.
+        """
+        min_level_no = LOG_LEVELS[self._normalize_level(level)] if level else 0
+        layers = set(layers) if layers else None
+        with self._log_lock:
+            cursor = self._last_seq
+            reset = since < self._clear_seq or since > cursor
+            if reset:
+                since = 0
+            new_records = []
+            for record in reversed(self._debug_log): # Las más nuevas al final: parar en el cursor
+                if record.seq <= since:
+                    break
+                new_records.append(record)
+        new_records.reverse()
+        logs = [record.format() for record in new_records
+                if LOG_LEVELS[record.level] >= min_level_no and (layers is None or record.layer in layers)]
+        return {"logs": logs, "cursor": cursor, "reset": reset}
 
     def clear_logs(self):
         """Limpia la cola de logs."""
-        with self._log_lock:
-            self._debug_log.clear()
-            self.log_info("Logs limpiados.") # Loguear la acción
+        self._send_control("clear", 5) # En orden con lo ya encolado
+        self.log_info("Logs limpiados.") # Loguear la acción
 
     def get_logs_as_text(self):
         """Devuelve todos los logs como una sola cadena."""
-        with self._log_lock:
-            return "\n".join(self._debug_log)
+        return "\n".join(self.get_logs())
 
     def save_logs_to_file(self, filename="modbus_web_log.txt"):
-        """Guarda los logs actuales en un archivo."""
-        # Implementación futura (o quitar si no se necesita)
-        self.log_warning(f"Función save_logs_to_file no implementada (Archivo: {filename}).")
-        pass
-
+        """Guarda los logs actuales (buffer en memoria) en un archivo. Devuelve True si lo consigue."""
+        self.flush()
+        try:
+            with open(filename, "w", encoding="utf-8") as log_file:
+                log_file.write(self.get_logs_as_text() + "\n")
+        except OSError as e:
+            self.log_error(f"No se pudieron guardar los logs en {filename}: {e}")
+            return False
+        self.log_info(f"Logs guardados en {filename}.")
+        return True
@@ -1,70 +1,574 @@
+import heapq
+import random
 import threading
 import time
 import socket # Para errores específicos
-from modbus_client.exceptions import ModbusException, ConnectionException, ModbusIOException
+from modbus_client.exceptions import ModbusException, ConnectionException, ModbusIOException, ModbusInvalidResponseException, ModbusTimeoutException
+from services.read_planner import ReadPlanner, DEFAULT_MAP
+from services.bus_arbiter import BusBusyException, PRIORITY_WRITE, PRIORITY_ON_DEMAND, PRIORITY_CYCLIC
+from services.circuit_breaker import (CircuitBreaker, DEFAULT_FAILURE_THRESHOLD, DEFAULT_BACKOFF, DEFAULT_MAX_BACKOFF, DEFAULT_BACKOFF_JITTER,
+                                      GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_NO_RESPONSE)
+
+ILLEGAL_FUNCTION = 0x01 # Código de excepción Modbus: función no soportada
+
+MAIN_SCAN_GROUP = "main" # Grupo que lee el mapa completo del RegisterService
+MIN_SCAN_INTERVAL = 0.05 # s
+MAX_SCAN_INTERVAL = 86400.0 # s
+OVERRUN_SKIP = "skip" # Tras un desbordamiento, saltar los ciclos perdidos y volver a la rejilla
+OVERRUN_CATCH_UP = "catch_up" # Ejecutar los ciclos perdidos seguidos (hasta MAX_CATCH_UP)
+MAX_CATCH_UP = 3 # Con más ciclos de retraso, catch_up se comporta como skip (evita ráfagas)
+READ_ONCE_MAX_WAIT = 30.0 # s; espera máxima de quien se une a una lectura bajo demanda en curso
+
+
+class _InFlightRead:
+    """Lectura bajo demanda en curso: quien llega mientras tanto espera su resultado."""
+    __slots__ = ("done", "result", "joined")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.joined = 0 # Peticiones que comparten esta lectura (además de la que la lanzó)
+
+
+class ScanGroup:
+    """
+    Grupo de escaneo con periodo propio. Los instantes de ejecución siguen una
+    rejilla fija (next_deadline += interval), no "dormir tras trabajar", así
+    que el periodo medio no deriva aunque cada lectura tarde distinto.
+    `jitter` (fracción del periodo) retrasa cada disparo un valor aleatorio
+    sin mover la rejilla, para que grupos con el mismo periodo no coincidan.
+    """
+    def __init__(self, name, interval, addresses=None, jitter=0.0, policy=OVERRUN_SKIP, gap_threshold=10):
+        self.name = name
+        self.interval = interval
+        self.jitter = jitter
+        self.policy = policy
+        self.planner = None # None = mapa completo del RegisterService
+        if addresses is not None:
+            self.planner = ReadPlanner(gap_threshold=gap_threshold)
+            self.planner.set_register_map(DEFAULT_MAP, addresses)
+        self.generation = 0 # Invalida entradas antiguas del heap al cambiar el periodo
+        self.next_deadline = None
+        # Estadísticas
+        self.runs = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.last_start = None
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.last_lateness = None # Retraso del disparo respecto a su instante teórico (s)
+        self.last_result = None
+
+    def get_plan(self):
+        return self.planner.get_plan(DEFAULT_MAP) if self.planner else None
+
+    def get_stats(self):
+        return {"name": self.name, "interval": self.interval, "jitter": self.jitter, "policy": self.policy,
+                "addresses": self.planner.get_register_map() if self.planner else None,
+                "runs": self.runs, "overruns": self.overruns, "skipped": self.skipped,
+                "last_start": self.last_start, "last_duration": self.last_duration, "max_duration": self.max_duration,
+                "last_lateness": self.last_lateness, "last_result": self.last_result}
+
 
 class PollingService:
-    def __init__(self, log_service, connection_service, register_service):
-        """Inicializa el servicio para lecturas bajo demanda."""
+    def __init__(self, log_service, connection_service, register_service, write_queue=None, device_id=None):
+        """Inicializa el servicio de lecturas (bajo demanda y cíclicas)."""
         self.log_service = log_service
+        self.device_id = device_id
         self.connection_service = connection_service
         self.register_service = register_service
-        self._read_lock = threading.Lock()
+        self.write_queue = write_queue
+        self._in_flight_read = None # _InFlightRead de la lectura bajo demanda en curso (single-flight)
+        self._in_flight_lock = threading.Lock()
+        self._write_lock = threading.Lock() # Serializa los flush de escrituras
+        self._fc23_unsupported = set() # Unidades que respondieron 0x17 con ILLEGAL_FUNCTION
+        # Planificador cíclico: heap de (instante de disparo, secuencia, generación, grupo)
+        self._scan_groups = {} # nombre -> ScanGroup
+        self._schedule = []
+        self._schedule_seq = 0
+        self._schedule_cond = threading.Condition()
+        self._scheduler_thread = None
+        self._stop_scheduler = None # Event de parada del hilo planificador actual (uno por hilo: un stop→start rápido no revive al anterior)
+        # Circuito por unidad: una unidad que no responde deja de leerse (con pruebas espaciadas) sin frenar al resto
+        self.breaker_config = {"failure_threshold": DEFAULT_FAILURE_THRESHOLD, "backoff": DEFAULT_BACKOFF,
+                               "max_backoff": DEFAULT_MAX_BACKOFF, "jitter": DEFAULT_BACKOFF_JITTER}
+        self._breakers = {} # unit_id -> CircuitBreaker
+        self._breakers_lock = threading.Lock()
+
+    def _read_blocks(self, modbus_client, unit_id, blocks, write_client=None):
+        """
+        Lee los bloques del plan. Si hay escrituras pendientes para la unidad,
+        cada una viaja junto con una lectura en una transacción 0x17
+        (una ida y vuelta en lugar de dos, con prioridad de escritura vía
+        `write_client`); el resto se lee normalmente. Si la 0x17 vuelve con
+        una excepción no se sabe si el rechazo es de la lectura o de la
+        escritura: el tramo vuelve a la cola y se usan 0x10 + 0x03 por
+        separado, donde cada error es inequívoco.
+        """
+        results = [None] * len(blocks)
+        first_plain = 0
+        if self.write_queue and unit_id not in self._fc23_unsupported:
+            for index, (addr, qty) in enumerate(blocks):
+                run = self.write_queue.take_run(unit_id)
+                if run is None:
+                    break
+                try:
+                    results[index] = (write_client or modbus_client).read_write_registers(unit_id, addr, qty, run[0], run[1])
+                    first_plain = index + 1
+                except ModbusIOException as e:
+                    self.write_queue.requeue(unit_id, run[0], run[1])
+                    if e.error_code in (None, GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_NO_RESPONSE):
+                        raise
+                    if e.error_code == ILLEGAL_FUNCTION:
+                        self.log_service.log_warning(f"PollingService: Unit {unit_id} no soporta 0x17; se usarán 0x10 + 0x03 por separado.")
+                        self._fc23_unsupported.add(unit_id)
+                    else:
+                        self.log_service.log_warning(f"PollingService: 0x17 rechazada por Unit {unit_id} (código {e.error_code}); lectura y escritura por separado.")
+                    break
+                except Exception:
+                    self.write_queue.requeue(unit_id, run[0], run[1])
+                    raise
+        if first_plain < len(blocks):
+            results[first_plain:] = modbus_client.read_holding_register_blocks(unit_id, blocks[first_plain:])
+        return results
+
+    def _flush_writes(self, modbus_client, unit_id):
+        """Escribe lo que quede en la cola para la unidad (0x06/0x10). Devuelve (transacciones, rechazos)."""
+        if not self.write_queue or not self.write_queue.has_pending(unit_id):
+            return 0, []
+        with self._write_lock:
+            try:
+                return self.write_queue.flush(modbus_client, unit_id)
+            finally:
+                self.register_service.invalidate_unit(unit_id) # Lo leído antes de escribir ya no vale como cache
+
+    def flush_writes(self):
+        """Escribe inmediatamente las escrituras pendientes (sin esperar a la próxima lectura)."""
+        status = self.connection_service.get_connection_status()
+        modbus_client = self.connection_service.get_client(PRIORITY_WRITE)
+        if not status["connected"] or not modbus_client:
+            return {"success": False, "message": "No conectado. Escrituras en cola para la próxima conexión."}
+        try:
+            transactions = 0; rejected = []
+            for unit_id in (self.write_queue.pending_units() if self.write_queue else []): # Todas las unidades del bus con escrituras
+                unit_transactions, unit_rejected = self._flush_writes(modbus_client, unit_id)
+                transactions += unit_transactions; rejected += unit_rejected
+            if rejected:
+                return {"success": False, "message": f"{len(rejected)} escrituras rechazadas por el esclavo (descartadas); {transactions} transacciones completadas.", "rejected": rejected}
+            return {"success": True, "message": f"Escrituras completadas ({transactions} transacciones)."}
+        except (ModbusIOException, ModbusInvalidResponseException, ModbusTimeoutException, BusBusyException) as e:
+            self.log_service.log_error(f"PollingService: Error Modbus en escritura: {e}")
+            return {"success": False, "message": f"Error Modbus en escritura: {e}"}
+        except (ConnectionException, socket.error, socket.timeout) as e:
+            self.log_service.log_error(f"PollingService: Error conexión/socket en escritura: {e}. Desconectando...")
+            self.connection_service.disconnect(initiated_by_polling=True)
+            return {"success": False, "message": f"Error conexión/socket en escritura: {e}"}
+        except ValueError as e:
+            self.log_service.log_error(f"PollingService: Error parámetros escritura: {e}")
+            return {"success": False, "message": f"Error parámetros escritura: {e}"}
+
+    def read_once(self, max_wait=READ_ONCE_MAX_WAIT, max_age=None):
+        """
+        Realiza una única lectura bajo demanda. Las peticiones que llegan con
+        una lectura en curso se unen a ella (single-flight) y reciben su
+        resultado, esperando como mucho `max_wait` s: N peticiones simultáneas
+        cuestan una sola lectura en el bus. Con `max_age` (s) las unidades
+        leídas completas hace menos de eso se sirven de la cache (read-through)
+        y sólo se leen las demás; el resultado indica la edad ("age").
+        """
+        if max_age is not None:
+            cached = self._cached_result(max_age)
+            if cached is not None:
+                return cached
+        with self._in_flight_lock:
+            flight = self._in_flight_read
+            leader = flight is None
+            if leader:
+                flight = self._in_flight_read = _InFlightRead()
+            else:
+                flight.joined += 1
+        if not leader:
+            self.log_service.log_debug("PollingService: read_once - Uniéndose a la lectura en curso.")
+            if not flight.done.wait(max_wait):
+                return {"success": False, "message": f"Lectura en curso: sin resultado tras {max_wait}s."}
+            return dict(flight.result, shared=True)
 
-    def read_once(self):
-        """Realiza una única lectura bajo demanda."""
         # --- Log de Inicio Claro ---
         self.log_service.log_info(">>> PollingService: Solicitud read_once() recibida.")
-        print(">>> PollingService: Solicitud read_once() recibida.")
         # ---------------------------
+        result = {"success": False, "message": "Error inesperado en la lectura."}
+        try:
+            result = self._read_cycle(None, PRIORITY_ON_DEMAND, verbose=True, max_age=max_age)
+            return result
+        finally:
+            with self._in_flight_lock:
+                self._in_flight_read = None # Quien llegue a partir de aquí lanza una lectura nueva
+                result["joined"] = flight.joined
+            flight.result = result
+            flight.done.set()
+            if flight.joined:
+                self.log_service.log_info(f"PollingService: read_once - {flight.joined} peticiones compartieron la lectura.")
 
-        if not self._read_lock.acquire(blocking=False):
-            self.log_service.log_warning("PollingService: Lectura ya en progreso. Omitiendo.")
-            return {"success": False, "message": "Lectura ya en progreso."}
+    def _cached_result(self, max_age):
+        """Resultado de read_once servido entero de la cache, o None si alguna unidad no está fresca."""
+        status = self.connection_service.get_connection_status()
+        unit_id = status["unit_id"]
+        if not status["connected"] or unit_id is None:
+            return None
+        results = {}
+        for current_unit in status.get("unit_ids") or [unit_id]:
+            cached = self.register_service.get_fresh_unit_values(current_unit, max_age)
+            if cached is None:
+                return None
+            results[current_unit] = self._cached_unit_result(*cached)
+        self.log_service.log_debug(f"PollingService: read_once servido de cache (max_age={max_age}s).")
+        return self._cycle_result(unit_id, list(results), results)
 
+    @staticmethod
+    def _cached_unit_result(values, age):
+        return {"success": True, "message": f"Valores en cache ({len(values)} registros, edad {age:.3f}s).", "data": values, "cached": True, "age": age}
+
+    def _read_cycle(self, group, priority, verbose=False, max_age=None):
+        """
+        Lee el mapa completo (group None o sin mapa propio) o el del grupo de
+        cada Unit ID atendido por la conexión y guarda los valores en el
+        RegisterService. Cada transacción pide turno en el bus con `priority`
+        (las escrituras de la cola, con PRIORITY_WRITE). Un fallo Modbus de una unidad se
+        contabiliza en ella y no impide leer las demás; un fallo de conexión
+        corta el ciclo. `verbose` mantiene los logs INFO de las lecturas
+        manuales; las cíclicas sólo loguean a nivel DEBUG (y los errores).
+        Con `max_age` las unidades con una lectura completa más reciente no se leen.
+        """
+        status = self.connection_service.get_connection_status()
+        if not status["connected"]:
+             result_message = "No conectado."
+             if verbose: self.log_service.log_warning(f"PollingService: {result_message}")
+             return {"success": False, "message": result_message}
+
+        modbus_client = self.connection_service.get_client(priority)
+        write_client = self.connection_service.get_client(PRIORITY_WRITE)
+        unit_id = status["unit_id"]
+        if not modbus_client: result_message = "Error: Cliente no disponible."; self.log_service.log_error(f"PollingService: {result_message}"); return {"success": False, "message": result_message}
+        if unit_id is None: result_message = "Unit ID no configurado."; self.log_service.log_warning(f"PollingService: {result_message}"); return {"success": False, "message": result_message}
+        unit_ids = status.get("unit_ids") or [unit_id]
+
+        results = {}
+        for current_unit in unit_ids:
+            cached = self.register_service.get_fresh_unit_values(current_unit, max_age) if max_age is not None else None
+            if cached is not None:
+                results[current_unit] = self._cached_unit_result(*cached)
+                continue
+            breaker = self._get_breaker(current_unit)
+            if not breaker.allow():
+                result_message = f"Unit {current_unit} sin respuesta: circuito abierto (prueba en {breaker.retry_in():.1f}s)."
+                results[current_unit] = {"success": False, "message": result_message, "data": None, "circuit_open": True}
+                continue
+            results[current_unit] = result = self._read_unit(modbus_client, write_client, current_unit, group, current_unit == unit_id, verbose, breaker)
+            if result.get("connection_lost"):
+                break
+        return self._cycle_result(unit_id, unit_ids, results)
+
+    @staticmethod
+    def _cycle_result(unit_id, unit_ids, results):
+        """Resultado del ciclo: el de la unidad principal o, con varias, un resumen por unidad."""
+        primary = results[unit_id]
+        if len(unit_ids) == 1:
+            return primary
+        failed = [uid for uid, result in results.items() if not result["success"]]
+        ages = [result["age"] for result in results.values() if result.get("age") is not None]
+        result_message = f"Lectura de {len(results)}/{len(unit_ids)} unidades: {len(results) - len(failed)} OK" + (f", fallo en {failed}." if failed else ".")
+        return {"success": not failed and len(results) == len(unit_ids), "message": result_message, "data": primary.get("data"),
+                "age": max(ages) if ages else None, "cached": all(result.get("cached") for result in results.values()),
+                "units": {uid: {"success": result["success"], "message": result["message"], "age": result.get("age")} for uid, result in results.items()}}
+
+    def _read_unit(self, modbus_client, write_client, unit_id, group, primary, verbose, breaker=None):
+        """
+        Lee y guarda el plan de una unidad. Devuelve el dict de resultado (con
+        'connection_lost' si se cayó la conexión). El resultado alimenta el
+        circuito de la unidad: sólo los fallos de "no responde" lo abren.
+        """
         read_success = False
         result_message = "Fallo desconocido durante lectura."
         registers_read = None
+        log_progress = self.log_service.log_info if verbose else self.log_service.log_debug
+
+        subset = group is not None and group.planner is not None
+        read_plan = group.get_plan() if subset else self.register_service.get_read_plan(unit_id)
+        count = len(read_plan.addresses) if read_plan else 0
 
+        if count <= 0:
+             result_message = f"Lectura omitida (Cantidad={count})."; log_progress(f"PollingService: {result_message} (Unit: {unit_id})")
+             rejected = []
+             try: _, rejected = self._flush_writes(write_client, unit_id)
+             except Exception as e: self.log_service.log_error(f"PollingService: Error escribiendo cola: {e}")
+             if breaker: breaker.release_probe()
+             return dict({"success": True, "message": result_message, "data": []}, **({"rejected_writes": rejected} if rejected else {}))
+
+        # --- Log Antes de Leer ---
+        log_progress(f"PollingService: Intentando leer {count} Holding Registers en {len(read_plan.blocks)} bloques (Unit: {unit_id})...")
+        # -------------------------
+        connection_lost = False
+        rejected = [] # Escrituras descartadas por respuesta de excepción en este ciclo
+        unit_fault = False # El fallo es atribuible a la unidad (cuenta en sus errores)
+        unreachable = False # La unidad no respondió (abre el circuito)
         try:
-            status = self.connection_service.get_connection_status()
-            if not status["connected"]:
-                 result_message = "No conectado."
-                 self.log_service.log_warning(f"PollingService: {result_message}")
-                 return {"success": False, "message": result_message}
-
-            modbus_client = self.connection_service.get_client()
-            start_addr, count = self.register_service.get_read_parameters()
-            unit_id = status["unit_id"]
-
-            if not modbus_client: result_message = "Error: Cliente no disponible."; self.log_service.log_error(f"PollingService: {result_message}"); return {"success": False, "message": result_message}
-            if unit_id is None: result_message = "Unit ID no configurado."; self.log_service.log_warning(f"PollingService: {result_message}"); return {"success": False, "message": result_message}
-
-            if count <= 0:
-                 result_message = f"Lectura omitida (Cantidad={count})."; self.log_service.log_info(f"PollingService: {result_message}"); return {"success": True, "message": result_message, "data": []}
-
-            # --- Log Antes de Leer ---
-            self.log_service.log_info(f"PollingService: Intentando leer {count} Holding Registers desde {start_addr} (Unit: {unit_id})...")
-            print(f"PollingService: Intentando leer {count} Holding Registers desde {start_addr} (Unit: {unit_id})...")
-            # -------------------------
-            try:
-                registers_read = modbus_client.read_holding_registers(unit_id, start_addr, count)
-                read_success = True
-                result_message = f"Lectura exitosa: {len(registers_read)} registros leídos."
+            write_epoch = self.register_service.get_write_epoch(unit_id) # Una escritura posterior deja lo leído sin frescura
+            block_values = self._read_blocks(modbus_client, unit_id, read_plan.blocks, write_client)
+            _, rejected = self._flush_writes(write_client, unit_id) # Escrituras que no cupieron en una 0x17
+            registers_read = read_plan.scatter(block_values)
+            read_success = True
+            result_message = f"Lectura exitosa: {len(registers_read)} registros leídos ({len(read_plan.blocks)} peticiones)."
+            if verbose:
                 self.log_service.log_info(f"PollingService: {result_message} Valores: {registers_read}") # Loguear valores leídos
-                print(f"PollingService: {result_message} Valores: {registers_read}")
 
-            # --- Manejo de Excepciones (sin cambios, pero los logs ahora tienen 'PollingService') ---
-            except (ModbusIOException, ModbusInvalidResponseException) as e: result_message = f"Error Modbus en lectura: {e}"; self.log_service.log_error(f"PollingService: {result_message}"); read_success = False
-            except (ConnectionException, socket.error, socket.timeout) as e: result_message = f"Error conexión/socket en lectura: {e}"; self.log_service.log_error(f"PollingService: {result_message}. Desconectando..."); self.connection_service.disconnect(initiated_by_polling=True); read_success = False
-            except ValueError as e: result_message = f"Error parámetros lectura: {e}"; self.log_service.log_error(f"PollingService: {result_message}"); read_success = False
-            except Exception as e: result_message = f"Error inesperado lectura: {e}"; self.log_service.log_critical(f"PollingService: {result_message}", exc_info=True); read_success = False
+        # --- Manejo de Excepciones (sin cambios, pero los logs ahora tienen 'PollingService') ---
+        except (ModbusIOException, ModbusInvalidResponseException, ModbusTimeoutException) as e: result_message = f"Error Modbus en lectura: {e}"; self.log_service.log_error(f"PollingService: {result_message} (Unit: {unit_id})"); read_success = False; unit_fault = True; unreachable = self._is_unreachable(e)
+        except BusBusyException as e: result_message = str(e); self.log_service.log_warning(f"PollingService: {result_message} (Unit: {unit_id})"); read_success = False
+        except (ConnectionException, socket.error, socket.timeout) as e: result_message = f"Error conexión/socket en lectura: {e}"; self.log_service.log_error(f"PollingService: {result_message}. Desconectando..."); self.connection_service.disconnect(initiated_by_polling=True); read_success = False; connection_lost = True
+        except ValueError as e: result_message = f"Error parámetros lectura: {e}"; self.log_service.log_error(f"PollingService: {result_message}"); read_success = False
+        except Exception as e: result_message = f"Error inesperado lectura: {e}"; self.log_service.log_critical(f"PollingService: {result_message}", exc_info=True); read_success = False
 
-            if read_success and registers_read is not None:
-                self.register_service.update_register_values(registers_read)
+        if read_success and registers_read is not None:
+            # Los bloques se escriben en la imagen de la unidad tal cual (sin listas intermedias)
+            self.register_service.update_unit_blocks(unit_id, read_plan.blocks, block_values, read_plan.addresses, primary=primary, complete=not subset, write_epoch=write_epoch)
+        elif unit_fault:
+            self.register_service.record_unit_error(unit_id, result_message)
+        if breaker:
+            self._update_breaker(breaker, unit_id, read_success or unit_fault, unreachable)
 
-            return {"success": read_success, "message": result_message, "data": registers_read if read_success else None}
+        result = {"success": read_success, "message": result_message, "data": registers_read if read_success else None, "cached": False, "age": 0.0 if read_success else None}
+        if rejected:
+            result["rejected_writes"] = rejected
+        if connection_lost:
+            result["connection_lost"] = True
+        return result
 
-        finally:
-            self._read_lock.release()
-            self.log_service.log_debug("PollingService: read_once - Lock liberado.")
\ No newline at end of file
+    # --- Circuito por unidad ---
+
+    @staticmethod
+    def _is_unreachable(error):
+        """True si el fallo indica que la unidad no responde (no un error de la petición en sí)."""
+        if isinstance(error, ModbusIOException):
+            return error.error_code in (GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_NO_RESPONSE)
+        return True # Timeout o respuesta ilegible
+
+    def _get_breaker(self, unit_id):
+        with self._breakers_lock:
+            breaker = self._breakers.get(unit_id)
+            if breaker is None:
+                breaker = self._breakers[unit_id] = CircuitBreaker(**self.breaker_config)
+            return breaker
+
+    def _update_breaker(self, breaker, unit_id, reached, unreachable):
+        """`reached`: hubo respuesta o fallo atribuible a la unidad; `unreachable`: la unidad no respondió."""
+        if unreachable:
+            if breaker.record_failure():
+                self.log_service.log_warning(f"PollingService: Unit {unit_id} no responde ({breaker.failure_threshold} fallos seguidos). Circuito abierto; prueba en {breaker.retry_in():.1f}s.")
+        elif reached:
+            if breaker.record_success():
+                self.log_service.log_info(f"PollingService: Unit {unit_id} responde de nuevo. Circuito cerrado.")
+        else:
+            breaker.release_probe()
+
+    def configure_breakers(self, failure_threshold=None, backoff=None, max_backoff=None, jitter=None):
+        """Cambia los parámetros del circuito; las unidades vuelven a empezar cerradas."""
+        config = dict(self.breaker_config)
+        if failure_threshold is not None: config["failure_threshold"] = int(failure_threshold)
+        if backoff is not None: config["backoff"] = float(backoff)
+        if max_backoff is not None: config["max_backoff"] = float(max_backoff)
+        if jitter is not None: config["jitter"] = float(jitter)
+        if config["failure_threshold"] < 1: raise ValueError("failure_threshold debe ser >= 1.")
+        if not (0 < config["backoff"] <= config["max_backoff"]): raise ValueError("Se requiere 0 < backoff <= max_backoff.")
+        if not (0 <= config["jitter"] < 1): raise ValueError("jitter debe estar en [0, 1).")
+        self.breaker_config = config
+        self.reset_breakers()
+        self.log_service.log_info(f"PollingService: Circuito por unidad: {config}")
+        return config
+
+    def reset_breakers(self, keep_unit_ids=None):
+        """Descarta el estado de los circuitos (todos, o los de unidades fuera de `keep_unit_ids`)."""
+        with self._breakers_lock:
+            if keep_unit_ids is None:
+                self._breakers.clear()
+            else:
+                for unit_id in [uid for uid in self._breakers if uid not in keep_unit_ids]:
+                    del self._breakers[unit_id]
+
+    def get_breaker_stats(self):
+        with self._breakers_lock:
+            breakers = list(self._breakers.items())
+        return {"config": self.breaker_config, "units": {unit_id: breaker.get_stats() for unit_id, breaker in breakers}}
+
+    # --- Planificador cíclico (grupos de escaneo por plazos) ---
+
+    @staticmethod
+    def _validate_interval(interval):
+        interval = float(interval)
+        if not (MIN_SCAN_INTERVAL <= interval <= MAX_SCAN_INTERVAL):
+            raise ValueError(f"Intervalo fuera de rango ({MIN_SCAN_INTERVAL}-{MAX_SCAN_INTERVAL}s): {interval}")
+        return interval
+
+    def set_scan_group(self, name, interval, addresses=None, jitter=0.0, policy=OVERRUN_SKIP):
+        """
+        Crea o redefine un grupo de escaneo. `addresses` (direcciones y/o rangos
+        [start, count]) limita el grupo a ese subconjunto; None = mapa completo.
+        El nuevo periodo se aplica ya (primer disparo inmediato).
+        """
+        interval = self._validate_interval(interval)
+        jitter = float(jitter)
+        if not (0.0 <= jitter <= 0.5):
+            raise ValueError(f"Jitter fuera de rango (0-0.5 del periodo): {jitter}")
+        if policy not in (OVERRUN_SKIP, OVERRUN_CATCH_UP):
+            raise ValueError(f"Política de desbordamiento desconocida: {policy}")
+        if name == MAIN_SCAN_GROUP and addresses is not None:
+            raise ValueError(f"El grupo '{MAIN_SCAN_GROUP}' siempre lee el mapa completo.")
+        group = ScanGroup(name, interval, addresses, jitter, policy, self.register_service.read_planner.gap_threshold)
+        with self._schedule_cond:
+            old_group = self._scan_groups.get(name)
+            if old_group is not None:
+                old_group.generation += 1 # Sus entradas del heap quedan obsoletas
+            self._scan_groups[name] = group
+            self._push_group(group, time.monotonic())
+        self.log_service.log_info(f"PollingService: Grupo de escaneo '{name}' cada {interval}s (jitter {jitter}, política {policy}).")
+        return group
+
+    def remove_scan_group(self, name):
+        with self._schedule_cond:
+            group = self._scan_groups.pop(name, None)
+            if group is None:
+                return False
+            group.generation += 1
+            self._schedule_cond.notify()
+        self.log_service.log_info(f"PollingService: Grupo de escaneo '{name}' eliminado.")
+        return True
+
+    def set_interval(self, interval, group_name=MAIN_SCAN_GROUP):
+        """Cambia el periodo de un grupo (crea el principal si no existe). Devuelve True si es válido."""
+        try:
+            with self._schedule_cond:
+                group = self._scan_groups.get(group_name)
+            if group is None:
+                if group_name != MAIN_SCAN_GROUP:
+                    return False
+                self.set_scan_group(group_name, interval)
+                return True
+            interval = self._validate_interval(interval)
+            with self._schedule_cond:
+                group.interval = interval
+                group.generation += 1
+                self._push_group(group, time.monotonic())
+            self.log_service.log_info(f"PollingService: Grupo '{group_name}' ahora cada {interval}s.")
+            return True
+        except (ValueError, TypeError) as e:
+            self.log_service.log_warning(f"PollingService: Intervalo inválido: {e}")
+            return False
+
+    def get_scan_stats(self):
+        with self._schedule_cond:
+            groups = list(self._scan_groups.values())
+        return {"running": self.is_polling(), "groups": [group.get_stats() for group in groups]}
+
+    def _push_group(self, group, deadline):
+        """Programa el próximo disparo del grupo (con _schedule_cond tomado)."""
+        group.next_deadline = deadline
+        release_time = deadline + (random.uniform(0, group.jitter * group.interval) if group.jitter else 0.0)
+        self._schedule_seq += 1
+        heapq.heappush(self._schedule, (release_time, self._schedule_seq, group.generation, group))
+        self._schedule_cond.notify()
+
+    def is_polling(self):
+        return self._scheduler_thread is not None and self._scheduler_thread.is_alive()
+
+    def start_polling(self):
+        """Arranca el hilo planificador (si hay grupos). Idempotente."""
+        with self._schedule_cond:
+            if not self._scan_groups:
+                return False
+            if self.is_polling():
+                return True
+            self._stop_scheduler = stop_event = threading.Event()
+            now = time.monotonic()
+            self._schedule = []
+            for group in self._scan_groups.values():
+                group.generation += 1
+                self._push_group(group, now)
+            self._scheduler_thread = threading.Thread(target=self._scheduler_loop, args=(stop_event,), name=f"PollingScheduler-{self.device_id}" if self.device_id else "PollingScheduler", daemon=True)
+            self._scheduler_thread.start()
+        self.log_service.log_info(f"PollingService: Planificador iniciado ({len(self._scan_groups)} grupos).")
+        return True
+
+    def stop_polling(self):
+        """Detiene el planificador (los grupos se conservan para el próximo start_polling)."""
+        with self._schedule_cond:
+            thread = self._scheduler_thread
+            if thread is None:
+                return
+            self._stop_scheduler.set()
+            self._scheduler_thread = None
+            self._schedule_cond.notify_all()
+        if thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.log_service.log_info("PollingService: Planificador detenido.")
+
+    def _next_due_group(self, stop_event):
+        """Espera al siguiente disparo. Devuelve (grupo, instante teórico, generación) o None si hay que parar."""
+        with self._schedule_cond:
+            while not stop_event.is_set():
+                if not self._schedule:
+                    self._schedule_cond.wait()
+                    continue
+                release_time, _, generation, group = self._schedule[0]
+                if generation != group.generation or self._scan_groups.get(group.name) is not group:
+                    heapq.heappop(self._schedule) # Entrada obsoleta (grupo cambiado/eliminado)
+                    continue
+                remaining = release_time - time.monotonic()
+                if remaining > 0:
+                    self._schedule_cond.wait(remaining) # Despierta antes si cambia el heap
+                    continue
+                heapq.heappop(self._schedule)
+                return group, group.next_deadline, generation
+            return None
+
+    def _scheduler_loop(self, stop_event):
+        while True:
+            due = self._next_due_group(stop_event)
+            if due is None:
+                break
+            group, deadline, generation = due
+            start = time.monotonic()
+            group.last_lateness = start - deadline
+            group.last_start = time.time()
+            try:
+                # Sin esperar a read_once: una lectura bajo demanda no debe esperar (ni ser rechazada) por un
+                # escaneo cíclico; el BusArbiter intercala sus transacciones con prioridad
+                result = self._read_cycle(group, PRIORITY_CYCLIC)
+                group.last_result = result.get("message")
+            except Exception as e:
+                group.last_result = f"Error inesperado: {e}"
+                self.log_service.log_critical(f"PollingService: Error en grupo '{group.name}': {e}", exc_info=True)
+            finish = time.monotonic()
+            group.runs += 1
+            group.last_duration = finish - start
+            group.max_duration = max(group.max_duration, group.last_duration)
+            self._reschedule(group, deadline, finish, generation, stop_event)
+
+    def _reschedule(self, group, deadline, finish, generation, stop_event):
+        """
+        Calcula el siguiente instante sobre la rejilla y aplica la política de
+        desbordamiento. Si el grupo cambió durante el ciclo (`generation` ya no
+        es la suya) set_interval/start_polling ya lo volvieron a programar.
+        """
+        next_deadline = deadline + group.interval
+        if finish > next_deadline:
+            missed = int((finish - next_deadline) // group.interval) + 1 # Disparos cuyo instante ya pasó
+            group.overruns += 1
+            if group.overruns == 1 or group.overruns % 100 == 0:
+                self.log_service.log_warning(f"PollingService: Grupo '{group.name}' desbordado ({group.last_duration:.3f}s > {group.interval}s, {group.overruns} veces). Política: {group.policy}.")
+            if group.policy == OVERRUN_CATCH_UP and missed <= MAX_CATCH_UP:
+                pass # Ejecutar ya el siguiente; la rejilla se recupera ciclo a ciclo
+            else:
+                group.skipped += missed
+                next_deadline += missed * group.interval # Primer instante de la rejilla aún en el futuro
+        with self._schedule_cond:
+            if group.generation == generation and self._scan_groups.get(group.name) is group and not stop_event.is_set():
+                self._push_group(group, next_deadline)
@@ -0,0 +1,154 @@
+# services/read_planner.py
+import threading
+
+MAX_REGISTERS_PER_READ = 125 # Límite de la función 0x03
+DEFAULT_MAP = None # Clave del mapa que usan las unidades sin mapa propio
+
+
+class ReadPlan:
+    """
+    Plan de lectura precalculado para un mapa de registros.
+    `blocks` es la lista de peticiones (start_addr, count) a emitir;
+    `addresses` las direcciones pedidas, en orden ascendente.
+    """
+    __slots__ = ("addresses", "blocks", "_picks")
+
+    def __init__(self, addresses, blocks):
+        self.addresses = addresses
+        self.blocks = blocks
+        # Para cada dirección: (índice de bloque, offset dentro del bloque)
+        picks = []
+        block_index = 0
+        for addr in addresses:
+            while addr >= blocks[block_index][0] + blocks[block_index][1]:
+                block_index += 1
+            picks.append((block_index, addr - blocks[block_index][0]))
+        self._picks = picks
+
+    def scatter(self, block_results):
+        """Reparte los resultados por bloque en una lista alineada con `addresses`."""
+        return [block_results[b][offset] for b, offset in self._picks]
+
+    def scatter_dict(self, block_results):
+        """Igual que scatter() pero devuelve {dirección: valor}."""
+        return dict(zip(self.addresses, self.scatter(block_results)))
+
+    def wasted_registers(self):
+        """Registros leídos que no están en el mapa (relleno de huecos)."""
+        return sum(count for _, count in self.blocks) - len(self.addresses)
+
+
+class ReadPlanner:
+    """
+    Agrupa un mapa disperso de registros (por unidad) en el mínimo número de
+    lecturas 0x03. Un hueco de hasta `gap_threshold` registros sin usar se
+    lee igualmente si así se evita otra petición (ida y vuelta).
+    El plan se cachea hasta que cambia el mapa o el umbral.
+    """
+    def __init__(self, gap_threshold=10, max_block_size=MAX_REGISTERS_PER_READ):
+        self.gap_threshold = gap_threshold
+        self.max_block_size = max_block_size
+        self._maps = {} # unit_id -> lista ordenada de direcciones
+        self._plans = {} # unit_id -> ReadPlan (cache)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_addresses(spec):
+        """
+        Convierte una especificación de mapa en una lista ordenada y sin
+        duplicados. Acepta direcciones sueltas (int) y rangos [start, count].
+        """
+        addresses = set()
+        for item in spec:
+            if isinstance(item, (list, tuple)):
+                if len(item) != 2:
+                    raise ValueError(f"Rango inválido: {item}. Formato esperado [start, count].")
+                start, count = int(item[0]), int(item[1])
+                if count < 0 or not (0 <= start <= 65535) or start + count > 65536:
+                    raise ValueError(f"Rango fuera de límites (0-65535): [{start}, {count}]")
+                addresses.update(range(start, start + count))
+            else:
+                addr = int(item)
+                if not (0 <= addr <= 65535):
+                    raise ValueError(f"Dirección fuera de rango (0-65535): {addr}")
+                addresses.add(addr)
+        return sorted(addresses)
+
+    @staticmethod
+    def build_blocks(addresses, gap_threshold, max_block_size=MAX_REGISTERS_PER_READ):
+        """
+        Algoritmo voraz sobre direcciones ordenadas: extiende el bloque actual
+        mientras el hueco no supere el umbral y el bloque quepa en una lectura.
+        Con ambas restricciones, extender al máximo da el mínimo de bloques.
+        """
+        blocks = []
+        if not addresses:
+            return blocks
+        block_start = last = addresses[0]
+        for addr in addresses[1:]:
+            if addr - last - 1 <= gap_threshold and addr - block_start < max_block_size:
+                last = addr
+                continue
+            blocks.append((block_start, last - block_start + 1))
+            block_start = last = addr
+        blocks.append((block_start, last - block_start + 1))
+        return blocks
+
+    def set_register_map(self, unit_id, spec):
+        """
+        Define el mapa de registros de una unidad (o el mapa por defecto si
+        unit_id es DEFAULT_MAP). Invalida los planes cacheados afectados.
+        """
+        addresses = self.normalize_addresses(spec)
+        with self._lock:
+            self._maps[unit_id] = addresses
+            if unit_id is DEFAULT_MAP:
+                self._plans.clear()
+            else:
+                self._plans.pop(unit_id, None)
+        return addresses
+
+    def get_register_map(self, unit_id=DEFAULT_MAP):
+        with self._lock:
+            return list(self._resolve_map(unit_id))
+
+    def _resolve_map(self, unit_id):
+        addresses = self._maps.get(unit_id)
+        if addresses is None:
+            addresses = self._maps.get(DEFAULT_MAP, [])
+        return addresses
+
+    def has_own_map(self, unit_id):
+        with self._lock:
+            return unit_id in self._maps
+
+    def is_current(self, unit_id, addresses):
+        """True si `addresses` (el de un ReadPlan) sigue siendo el mapa vigente de la unidad."""
+        with self._lock:
+            return self._resolve_map(unit_id) is addresses
+
+    def remove_unit(self, unit_id):
+        with self._lock:
+            self._maps.pop(unit_id, None)
+            self._plans.pop(unit_id, None)
+
+    def set_gap_threshold(self, gap_threshold):
+        """Cambia el umbral de relleno de huecos. Invalida todos los planes."""
+        gap_threshold = int(gap_threshold)
+        if gap_threshold < 0:
+            raise ValueError("El umbral de huecos no puede ser negativo.")
+        with self._lock:
+            self.gap_threshold = gap_threshold
+            self._plans.clear()
+
+    def get_plan(self, unit_id=DEFAULT_MAP):
+        """Devuelve el ReadPlan (cacheado) de la unidad, o None si su mapa está vacío."""
+        with self._lock:
+            plan = self._plans.get(unit_id)
+            if plan is None:
+                addresses = self._resolve_map(unit_id)
+                if not addresses:
+                    return None
+                plan = ReadPlan(addresses, self.build_blocks(addresses, self.gap_threshold, self.max_block_size))
+                self._plans[unit_id] = plan
+            return plan
@@ -0,0 +1,151 @@
+# services/register_history.py
+import bisect
+import time
+from array import array
+
+DEFAULT_HISTORY_SAMPLES = 3600 # Muestras por unidad (1 h a 1 Hz)
+DEFAULT_HISTORY_INTERVAL = 1.0 # s; mínimo entre muestras (lecturas más rápidas no se guardan todas)
+MAX_HISTORY_BYTES = 64 * 1024 * 1024 # Techo de memoria por unidad: con mapas grandes se guardan menos muestras
+MAX_BUCKETS = 10000
+MAX_HISTORY_ROWS = 10000 # Muestras por consulta sin buckets (más: "truncated" y se sigue desde la última)
+
+
+class _RingTimes:
+    """Vista de los timestamps en orden lógico (de la más antigua a la más nueva), para bisect."""
+    def __init__(self, history):
+        self._history = history
+
+    def __len__(self):
+        return self._history.count
+
+    def __getitem__(self, index):
+        history = self._history
+        return history.times[(history.head - history.count + index) % history.capacity]
+
+
+class RegisterHistory:
+    """
+    Histórico en memoria de una unidad: matriz preasignada de muestras ×
+    registros (array('H'), fila a fila) más una columna de timestamps
+    (array('d')), usada como buffer circular. Añadir una muestra copia los
+    tramos contiguos del mapa directamente desde la imagen de registros (sin
+    objetos Python por valor) y la más antigua se sobrescribe. Las columnas
+    se extraen con slices con paso, también en C: copy() es lo único que
+    necesita el lock del llamante; las listas y los buckets se construyen
+    después, sin él (summarize).
+    """
+    def __init__(self, addresses, capacity):
+        self.addresses = addresses # Lista del ReadPlan (no se modifica): el mismo objeto es el mismo mapa
+        self.width = len(self.addresses)
+        self.capacity = capacity
+        self.samples = array('H', bytes(2 * capacity * self.width))
+        self.times = array('d', bytes(8 * capacity))
+        self.head = 0 # Próxima fila a escribir
+        self.count = 0
+        self.sampled_at = None # time.monotonic() de la última muestra (intervalo mínimo, inmune a cambios de hora)
+        self._columns = {address: column for column, address in enumerate(self.addresses)}
+        self._runs = [] # (dirección inicial, longitud, columna): tramos contiguos del mapa
+        for column, address in enumerate(self.addresses):
+            if self._runs and address == self._runs[-1][0] + self._runs[-1][1]:
+                self._runs[-1][1] += 1
+            else:
+                self._runs.append([address, 1, column])
+
+    @staticmethod
+    def capacity_for(width, samples, max_bytes=MAX_HISTORY_BYTES):
+        """Muestras que caben en `max_bytes` con `width` registros (como mucho `samples`)."""
+        return max(1, min(samples, max_bytes // (2 * width + 8)))
+
+    def append(self, timestamp, image_values):
+        """
+        Añade una muestra con los valores actuales de la imagen (array indexado
+        por dirección). Si el reloj retrocede, el timestamp se iguala al de la
+        última muestra: la búsqueda por tiempo (bisect) exige orden.
+        """
+        if self.count:
+            timestamp = max(timestamp, self.times[(self.head - 1) % self.capacity])
+        self.sampled_at = time.monotonic()
+        base = self.head * self.width
+        samples = self.samples
+        for start, length, column in self._runs:
+            samples[base + column:base + column + length] = image_values[start:start + length]
+        self.times[self.head] = timestamp
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _segments(self, first, last):
+        """Filas físicas [(inicio, fin), ...] (como mucho dos) de las filas lógicas [first, last)."""
+        if first >= last:
+            return []
+        oldest = (self.head - self.count) % self.capacity
+        start = (oldest + first) % self.capacity; end = start + (last - first)
+        if end <= self.capacity:
+            return [(start, end)]
+        return [(start, self.capacity), (0, end - self.capacity)]
+
+    def _column(self, column, segments):
+        samples = self.samples; width = self.width
+        values = array('H')
+        for start, end in segments:
+            values.extend(samples[start * width + column:end * width:width])
+        return values
+
+    def copy(self, start=None, end=None, addresses=None, limit=None):
+        """
+        Copia (arrays, sin objetos Python por valor) de las muestras con
+        timestamp en [start, end] de `addresses` (todas las del mapa por
+        defecto), como mucho las `limit` primeras. Devuelve
+        (times, [(dirección, valores)], truncated) para summarize().
+        """
+        times = _RingTimes(self)
+        first = 0 if start is None else bisect.bisect_left(times, start)
+        last = self.count if end is None else bisect.bisect_right(times, end)
+        truncated = limit is not None and last - first > limit
+        if truncated:
+            last = first + limit
+        segments = self._segments(first, last)
+        sample_times = array('d')
+        for seg_start, seg_end in segments:
+            sample_times.extend(self.times[seg_start:seg_end])
+        columns = [(address, self._column(self._columns[address], segments)) for address in (self.addresses if addresses is None else addresses) if address in self._columns]
+        return sample_times, columns, truncated
+
+    def query(self, start=None, end=None, addresses=None, buckets=None):
+        """Consulta completa (copy() + summarize()); con el lock del llamante tomado todo el tiempo."""
+        return self.summarize(*self.copy(start, end, addresses, None if buckets else MAX_HISTORY_ROWS), start=start, end=end, buckets=buckets)
+
+    @staticmethod
+    def summarize(sample_times, columns, truncated=False, start=None, end=None, buckets=None):
+        """
+        Resultado de una copia de copy(). Sin `buckets`: {"times", "values":
+        {dirección: [...]}, "truncated"}. Con `buckets`: el intervalo se divide
+        en `buckets` tramos iguales y se devuelve por tramo no vacío su inicio
+        y min/max/avg de cada dirección (para gráficas: la forma de la curva
+        sin enviar todas las muestras).
+        """
+        if not buckets:
+            return {"times": sample_times.tolist(), "values": {address: values.tolist() for address, values in columns}, "truncated": truncated}
+        result = {"times": [], "min": {}, "max": {}, "avg": {}}
+        if not sample_times:
+            return result
+        t0 = sample_times[0] if start is None else start; t1 = sample_times[-1] if end is None else end
+        step = (t1 - t0) / buckets or 1.0
+        bounds = [] # Filas [desde, hasta) de cada tramo no vacío
+        row = 0
+        for bucket in range(1, buckets + 1):
+            limit = len(sample_times) if bucket == buckets else bisect.bisect_left(sample_times, t0 + bucket * step, row)
+            if limit > row:
+                bounds.append((row, limit)); result["times"].append(t0 + (bucket - 1) * step)
+            row = limit
+        for address, values in columns:
+            chunks = [values[lo:hi] for lo, hi in bounds]
+            result["min"][address] = [min(chunk) for chunk in chunks]
+            result["max"][address] = [max(chunk) for chunk in chunks]
+            result["avg"][address] = [sum(chunk) / len(chunk) for chunk in chunks]
+        return result
+
+    def get_stats(self):
+        oldest = self.times[(self.head - self.count) % self.capacity] if self.count else None
+        newest = self.times[(self.head - 1) % self.capacity] if self.count else None
+        return {"registers": self.width, "capacity": self.capacity, "samples": self.count, "bytes": self.samples.itemsize * len(self.samples) + self.times.itemsize * len(self.times),
+                "oldest": oldest, "newest": newest}
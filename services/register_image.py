@@ -0,0 +1,169 @@
+# services/register_image.py
+from array import array
+from collections import deque
+
+ADDRESS_SPACE = 65536 # Direcciones Modbus 0-65535
+MAX_CHANGE_LOG = 4096 # Rangos cambiados que se recuerdan para changes_since()
+
+_EMPTY_IMAGE = bytes(2 * ADDRESS_SPACE)
+_EMPTY_BITMAP = bytes(ADDRESS_SPACE // 8)
+
+
+class RegisterImage:
+    """
+    Imagen de los registros de una unidad: un array('H') indexado directamente
+    por dirección Modbus (0-65535, 128 KiB) más dos bitmaps de 8 KiB: `valid`
+    (dirección leída al menos una vez) y `dirty` (valor cambiado desde el
+    último take_dirty()). Las lecturas por bloques se escriben en su sitio,
+    sin reemplazar listas. Cada escritura que cambia algo incrementa
+    `generation` y anota el rango cambiado, para responder "qué cambió desde
+    la generación N" sin recorrer toda la imagen.
+    """
+    def __init__(self):
+        self.values = array('H', _EMPTY_IMAGE)
+        self._valid = bytearray(_EMPTY_BITMAP)
+        self._dirty = bytearray(_EMPTY_BITMAP)
+        self._dirty_span = None # (primer, último) byte del bitmap con bits a 1: take_dirty() no recorre los 8 KiB
+        self.generation = 0
+        self._change_log = deque(maxlen=MAX_CHANGE_LOG) # (generación, primera dirección, última dirección)
+        self._base_generation = 0 # changes_since() con una generación anterior a esta necesita la imagen entera
+
+    def write_block(self, start, block_values):
+        """
+        Escribe un bloque leído en su sitio. Devuelve las direcciones que
+        cambiaron (o se leyeron por primera vez), en orden creciente; lista
+        vacía si no cambió nada.
+        """
+        count = len(block_values)
+        end = start + count
+        if not count:
+            return []
+        if end > ADDRESS_SPACE:
+            raise ValueError(f"Bloque fuera del espacio de direcciones: {start}+{count}")
+        new = block_values if isinstance(block_values, array) else array('H', block_values)
+        old_bytes = self.values[start:end].tobytes(); new_bytes = new.tobytes()
+        first_time = not self._all_valid(start, end)
+        if old_bytes == new_bytes and not first_time: # Caso habitual (registros estáticos): una comparación en C
+            return []
+        changed = self._diff(start, old_bytes, new_bytes)
+        if first_time:
+            changed = sorted(set(changed).union(address for address in range(start, end) if not self._is_valid(address)))
+        if not changed:
+            return []
+        dirty = self._dirty
+        for address in changed:
+            dirty[address >> 3] |= 1 << (address & 7)
+        self.values[start:end] = new
+        self._set_valid(start, end)
+        first, last = changed[0], changed[-1]
+        span = self._dirty_span
+        self._dirty_span = (first >> 3, last >> 3) if span is None else (min(span[0], first >> 3), max(span[1], last >> 3))
+        self.generation += 1
+        if len(self._change_log) == self._change_log.maxlen:
+            self._base_generation = self._change_log[0][0] # El más antiguo se pierde
+        self._change_log.append((self.generation, first, last))
+        return changed
+
+    @staticmethod
+    def _diff(start, old_bytes, new_bytes):
+        """
+        Direcciones cuyos valores difieren entre dos bloques: XOR de los bloques
+        como enteros (una operación para todo el bloque) y recorrido sólo de
+        los registros con bits a 1; el coste no depende de los que no cambian.
+        """
+        diff = int.from_bytes(old_bytes, 'little') ^ int.from_bytes(new_bytes, 'little')
+        changed = []
+        address = start
+        while diff:
+            skip = ((diff & -diff).bit_length() - 1) >> 4 # Registro (16 bits) del bit a 1 más bajo
+            address += skip
+            changed.append(address)
+            diff >>= (skip + 1) << 4; address += 1
+        return changed
+
+    def read(self, addresses):
+        """Valores de `addresses` (lista)."""
+        values = self.values
+        return [values[address] for address in addresses]
+
+    def is_valid(self, address):
+        return self._is_valid(address)
+
+    def all_valid(self, start, end):
+        """True si todas las direcciones de [start, end) se han leído alguna vez."""
+        return self._all_valid(start, end)
+
+    def _is_valid(self, address):
+        return bool(self._valid[address >> 3] & (1 << (address & 7)))
+
+    def _all_valid(self, start, end):
+        valid = self._valid
+        address = start
+        while address < end and address & 7:
+            if not valid[address >> 3] & (1 << (address & 7)): return False
+            address += 1
+        full_end = end & ~7
+        if address < full_end:
+            chunk = valid[address >> 3:full_end >> 3]
+            if chunk.count(0xff) != len(chunk): return False
+            address = full_end
+        while address < end:
+            if not valid[address >> 3] & (1 << (address & 7)): return False
+            address += 1
+        return True
+
+    def _set_valid(self, start, end):
+        valid = self._valid
+        address = start
+        while address < end and address & 7: # Bits sueltos hasta alinear a byte
+            valid[address >> 3] |= 1 << (address & 7); address += 1
+        full_end = end & ~7
+        if address < full_end: # Bytes completos de una vez
+            valid[address >> 3:full_end >> 3] = b'\xff' * ((full_end - address) >> 3); address = full_end
+        while address < end:
+            valid[address >> 3] |= 1 << (address & 7); address += 1
+
+    def changes_since(self, generation):
+        """
+        Rangos [primera, última] cambiados después de `generation` (fusionados
+        y ordenados), o None si el registro de cambios ya no llega tan atrás
+        (el consumidor debe releer la imagen entera).
+        """
+        if generation >= self.generation:
+            return []
+        if generation < self._base_generation:
+            return None
+        ranges = sorted((first, last) for gen, first, last in self._change_log if gen > generation)
+        merged = []
+        for first, last in ranges:
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        return merged
+
+    def take_dirty(self):
+        """Direcciones cambiadas desde la llamada anterior (orden creciente); limpia el bitmap."""
+        if self._dirty_span is None:
+            return []
+        dirty = self._dirty
+        first, last = self._dirty_span
+        addresses = []
+        for index in range(first, last + 1):
+            byte = dirty[index]
+            if byte:
+                base = index << 3
+                addresses.extend(base + bit for bit in range(8) if byte & (1 << bit))
+                dirty[index] = 0
+        self._dirty_span = None
+        return addresses
+
+    def clear(self):
+        """Olvida todos los valores (desconexión, cambio de mapa). La generación sigue creciendo."""
+        self.values = array('H', _EMPTY_IMAGE)
+        self._valid = bytearray(_EMPTY_BITMAP)
+        self._dirty = bytearray(_EMPTY_BITMAP)
+        self._dirty_span = None
+        self.generation += 1
+        self._change_log.clear()
+        self._base_generation = self.generation # Quien pregunte por algo anterior debe releer todo
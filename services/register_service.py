@@ -1,39 +1,63 @@
 # services/register_service.py
+import bisect
 import time
 import threading
+from collections import deque
+from services.read_planner import ReadPlanner, DEFAULT_MAP
+from services.register_image import RegisterImage
+from modbus_client.tag_decoder import TagDecoder
+from services.register_history import RegisterHistory, DEFAULT_HISTORY_SAMPLES, DEFAULT_HISTORY_INTERVAL, MAX_BUCKETS, MAX_HISTORY_ROWS
+
+MAX_DELTA_EVENTS = 1024 # Lecturas con cambios que se recuerdan para get_deltas() (una entrada por lectura)
 
 class RegisterService:
-    def __init__(self, log_service):
+    def __init__(self, log_service, gap_threshold=10, event_service=None, history_store=None):
         self.log_service = log_service
+        self.event_service = event_service # Avisa a los streams SSE (tema "registers")
+        self.history_store = history_store # HistoryStore opcional: los deltas se guardan también en disco
         self._registers = {
             "start_addr": 0,
             "count": 10,
-            "values": [],       # Últimos valores leídos (números crudos)
+            "addresses": list(range(0, 10)), # Mapa de registros a leer (ordenado)
+            "unit_id": None,    # Unidad principal: su imagen da los valores de la vista (alineados con "addresses")
             "last_update": None,
         }
+        self._units = {} # unit_id -> imagen de registros y contadores de error de cada esclavo tras el gateway
+        # Report-by-exception: sólo los registros que cambiaron (fuera de su banda muerta) se emiten como deltas
+        self._deadbands = {} # Clave de mapa (DEFAULT_MAP o unit_id) -> {dirección: (absoluta, porcentaje)}
+        self._deltas = deque(maxlen=MAX_DELTA_EVENTS) # (cursor, timestamp, unit_id, [[dirección, valor], ...])
+        self._delta_cursor = 0
+        self._delta_base = 0 # Cursores anteriores a este necesitan releer la vista entera (reset)
+        # Histórico en memoria por unidad (buffer circular); samples 0 lo desactiva
+        self.history_config = {"samples": DEFAULT_HISTORY_SAMPLES, "interval": DEFAULT_HISTORY_INTERVAL}
+        self._tag_decoders = {} # Clave de mapa (DEFAULT_MAP o unit_id) -> TagDecoder (tags tipados compilados)
         self._register_lock = threading.Lock()
+        # Planificador de lecturas: agrupa el mapa en el mínimo de peticiones 0x03
+        self.read_planner = ReadPlanner(gap_threshold=gap_threshold)
+        self._registers["addresses"] = self.read_planner.set_register_map(DEFAULT_MAP, self._registers["addresses"])
 
     def update_read_parameters(self, start_addr, count):
-        """Actualiza los parámetros para la lectura de registros."""
+        """Actualiza los parámetros para la lectura de registros (ventana contigua)."""
         with self._register_lock:
             try:
                 new_start_addr = int(start_addr)
                 new_count = int(count)
                 if not (0 <= new_start_addr <= 65535):
                     raise ValueError("Dirección inicial fuera de rango (0-65535).")
-                if not (0 <= new_count <= 125): # Permitir 0
-                    raise ValueError("Cantidad fuera de rango (0-125).")
+                # Ventanas de más de 125 registros se reparten en varias lecturas
+                if not (0 <= new_count <= 65536 - new_start_addr): # Permitir 0
+                    raise ValueError(f"Cantidad fuera de rango (0-{65536 - new_start_addr}).")
 
                 changed = (self._registers["start_addr"] != new_start_addr or
-                           self._registers["count"] != new_count)
+                           self._registers["count"] != new_count or
+                           len(self._registers["addresses"]) != new_count)
 
                 self._registers["start_addr"] = new_start_addr
                 self._registers["count"] = new_count
 
                 if changed:
-                    # Limpiar valores antiguos si los parámetros cambian
-                    self._registers["values"] = []
-                    self._registers["last_update"] = None
+                    self._set_addresses(list(range(new_start_addr, new_start_addr + new_count)))
+                    self._notify()
                     self.log_service.log_info(f"Parámetros de lectura actualizados: Addr={new_start_addr}, Count={new_count}")
                 else:
                      self.log_service.log_info(f"Parámetros de lectura sin cambios (Addr={new_start_addr}, Count={new_count}).")
@@ -44,27 +68,470 @@ class RegisterService:
                 self.log_service.log_warning(f"Intento de actualizar parámetros con valores inválidos: {e}")
                 return {"success": False, "message": f"Valores inválidos: {e}"}
 
+    def update_register_map(self, spec, gap_threshold=None, unit_id=None):
+        """
+        Define un mapa disperso de registros: direcciones sueltas y/o rangos
+        [start, count]. Opcionalmente cambia el umbral de relleno de huecos.
+        Con `unit_id` el mapa es sólo de esa unidad (spec None = volver al
+        mapa común).
+        """
+        if unit_id is not None:
+            return self._update_unit_map(int(unit_id), spec, gap_threshold)
+        with self._register_lock:
+            try:
+                addresses = ReadPlanner.normalize_addresses(spec)
+                if gap_threshold is not None:
+                    self.read_planner.set_gap_threshold(gap_threshold)
+                self._registers["start_addr"] = addresses[0] if addresses else 0
+                self._registers["count"] = len(addresses)
+                self._set_addresses(addresses)
+                self._notify()
+                plan = self.read_planner.get_plan(DEFAULT_MAP)
+                blocks = plan.blocks if plan else []
+                self.log_service.log_info(f"Mapa de registros actualizado: {len(addresses)} registros en {len(blocks)} lecturas (umbral huecos: {self.read_planner.gap_threshold}).")
+                return {"success": True, "message": f"Mapa actualizado: {len(addresses)} registros, {len(blocks)} lecturas.", "blocks": blocks}
+            except (ValueError, TypeError) as e:
+                self.log_service.log_warning(f"Intento de actualizar mapa con valores inválidos: {e}")
+                return {"success": False, "message": f"Valores inválidos: {e}"}
+
+    def _update_unit_map(self, unit_id, spec, gap_threshold=None):
+        with self._register_lock:
+            try:
+                if gap_threshold is not None:
+                    self.read_planner.set_gap_threshold(gap_threshold)
+                if spec is None:
+                    self.read_planner.remove_unit(unit_id)
+                    message = f"Unit {unit_id}: usa el mapa común."
+                else:
+                    addresses = self.read_planner.set_register_map(unit_id, ReadPlanner.normalize_addresses(spec))
+                    plan = self.read_planner.get_plan(unit_id)
+                    message = f"Unit {unit_id}: mapa actualizado ({len(addresses)} registros, {len(plan.blocks) if plan else 0} lecturas)."
+                unit = self._units.get(unit_id)
+                if unit:
+                    self._reset_unit_view(unit)
+                self._reset_deltas()
+                self._notify()
+                self.log_service.log_info(message)
+                return {"success": True, "message": message}
+            except (ValueError, TypeError) as e:
+                self.log_service.log_warning(f"Intento de actualizar mapa de Unit {unit_id} con valores inválidos: {e}")
+                return {"success": False, "message": f"Valores inválidos: {e}"}
+
+    def _set_addresses(self, addresses):
+        """Cambia el mapa (con el lock tomado); hasta la próxima lectura completa no hay valores que mostrar."""
+        # Guardar la lista del planificador: así ReadPlan.addresses es el mismo objeto
+        self._registers["addresses"] = self.read_planner.set_register_map(DEFAULT_MAP, addresses)
+        self._registers["last_update"] = None
+        for unit_id, unit in self._units.items(): # Las unidades sin mapa propio leen el común
+            if not self.read_planner.has_own_map(unit_id):
+                self._reset_unit_view(unit)
+        self._reset_deltas()
+
+    def _reset_unit_view(self, unit):
+        """
+        La unidad cambió de mapa: sus valores no se muestran hasta la próxima
+        lectura completa. La imagen se conserva (está indexada por dirección,
+        no por posición en el mapa).
+        """
+        unit["addresses"] = []; unit["last_update"] = unit["last_full_update"] = None
+        if self._registers["unit_id"] == unit["unit_id"]:
+            self._registers["last_update"] = None
+
+    def _get_unit(self, unit_id):
+        """Entrada de la unidad (con el lock tomado), creada en su primer uso."""
+        unit = self._units.get(unit_id)
+        if unit is None:
+            unit = self._units[unit_id] = {"unit_id": unit_id, "image": RegisterImage(), "reported": {}, "history": None, "addresses": [], "last_update": None, "last_full_update": None,
+                                           "write_epoch": 0, "reads": 0, "errors": 0, "consecutive_errors": 0, "last_error": None, "last_error_time": None}
+        return unit
+
+    def _notify(self, topic="registers"):
+        if self.event_service:
+            self.event_service.notify(topic)
+
+    def _reset_deltas(self):
+        """
+        La vista cambió (mapa, limpieza, unidades): los consumidores de deltas
+        deben releerla entera. Consume un cursor propio para que el de la
+        nueva vista (get_register_data) ya no pida reset.
+        """
+        self._delta_cursor += 1; self._delta_base = self._delta_cursor
+        self._deltas.clear()
+        self._notify("changes")
+
     def get_read_parameters(self):
         """Obtiene los parámetros de lectura actuales."""
         with self._register_lock:
             return self._registers["start_addr"], self._registers["count"]
 
-    def update_register_values(self, new_values):
-        """Actualiza los valores de los registros leídos."""
+    def get_read_plan(self, unit_id=DEFAULT_MAP):
+        """Devuelve el ReadPlan cacheado (bloques a leer), o None si el mapa está vacío."""
+        return self.read_planner.get_plan(unit_id)
+
+    def update_register_values(self, new_values, addresses=None):
+        """
+        Actualiza los valores de la vista principal (unidad principal). Si se
+        indica `addresses` (el del ReadPlan usado), sólo se aceptan si el mapa
+        no cambió entretanto.
+        """
+        with self._register_lock:
+            unit_id = self._registers["unit_id"]
+        if unit_id is None:
+            self.log_service.log_warning("Valores descartados: aún no hay unidad principal.")
+            return False
+        if addresses is None: # El mapa vigente de la unidad principal (el común o el suyo propio)
+            plan = self.read_planner.get_plan(unit_id)
+            addresses = plan.addresses if plan else []
+        return self.update_unit_values(unit_id, new_values, addresses, primary=True)
+
+    def update_unit_values(self, unit_id, new_values, addresses, primary=False):
+        """Como update_unit_blocks(), con los valores alineados con `addresses` (se agrupan en tramos contiguos)."""
+        runs = []
+        for addr, value in zip(addresses, new_values):
+            if runs and addr == runs[-1][0] + len(runs[-1][1]):
+                runs[-1][1].append(value)
+            else:
+                runs.append((addr, [value]))
+        return self.update_unit_blocks(unit_id, [(start, len(values)) for start, values in runs], [values for _, values in runs], addresses, primary)
+
+    def update_unit_blocks(self, unit_id, blocks, block_values, addresses, primary=False, complete=True, write_epoch=None):
+        """
+        Escribe en la imagen de la unidad los bloques leídos, en su sitio.
+        `complete`: lectura del mapa entero de la unidad (`addresses` es el del
+        ReadPlan usado; se descarta si el mapa cambió durante la lectura). Si
+        no, es el subconjunto de un grupo de escaneo: actualiza los valores
+        pero no la frescura de la lectura completa. Con `primary` la unidad es
+        la que da los valores de la vista principal (get_register_data).
+        `write_epoch` (get_write_epoch() antes de leer): si se escribió en la
+        unidad desde entonces los valores se guardan pero no sirven como cache.
+        """
+        with self._register_lock:
+            if complete and not self.read_planner.is_current(unit_id, addresses):
+                self.log_service.log_warning(f"Valores de Unit {unit_id} descartados: el mapa cambió durante la lectura.")
+                return False
+            now = time.time()
+            unit = self._get_unit(unit_id)
+            image = unit["image"]
+            changed = []
+            for (start, _), values in zip(blocks, block_values):
+                changed.extend(image.write_block(start, values))
+            deltas = self._filter_deltas(unit, changed, addresses) if changed else []
+            view_changed = complete and unit["addresses"] is not addresses # Primera lectura completa con este mapa
+            if complete:
+                unit["addresses"] = addresses; unit["last_update"] = now
+                if write_epoch is None or write_epoch == unit["write_epoch"]: # Sin escrituras durante la lectura: vale como cache
+                    unit["last_full_update"] = time.monotonic()
+            elif unit["addresses"]: # Sin lectura completa previa no hay vista que refrescar
+                unit["last_update"] = now
+            if unit["addresses"] and self.history_config["samples"]:
+                self._record_history(unit, now)
+            unit["reads"] += 1; unit["consecutive_errors"] = 0
+            if primary:
+                if complete: # `addresses` es el mapa vigente de la unidad (comprobado arriba): el común o el suyo propio
+                    view_changed = view_changed or self._registers["unit_id"] != unit_id or self._registers["last_update"] is None
+                    self._registers["unit_id"] = unit_id; self._registers["last_update"] = now
+                elif not complete and self._registers["unit_id"] == unit_id and self._registers["last_update"] is not None:
+                    self._registers["last_update"] = now
+            if deltas:
+                self._delta_cursor += 1
+                if len(self._deltas) == self._deltas.maxlen:
+                    self._delta_base = self._deltas[0][0] # La más antigua se pierde
+                self._deltas.append((self._delta_cursor, now, unit_id, deltas))
+                self._notify("changes")
+                if self.history_store:
+                    self.history_store.append(unit_id, now, deltas) # Sólo encola: escribe el hilo del store
+            if deltas or view_changed: # Lecturas sin cambios no despiertan a los streams
+                self._notify()
+            return True
+
+    def _record_history(self, unit, now):
+        """Añade una muestra al histórico de la unidad (con el lock tomado); si cambió el mapa empieza uno nuevo."""
+        history = unit["history"]
+        if history is None or history.addresses is not unit["addresses"]:
+            addresses = unit["addresses"]
+            history = unit["history"] = RegisterHistory(addresses, RegisterHistory.capacity_for(len(addresses), self.history_config["samples"]))
+        elif history.sampled_at is not None and time.monotonic() - history.sampled_at < self.history_config["interval"]:
+            return
+        history.append(now, unit["image"].values)
+
+    def configure_history(self, samples=None, interval=None):
+        """Cambia el tamaño (muestras por unidad, 0 = desactivado) y/o el intervalo mínimo del histórico. Lanza ValueError."""
+        samples = self.history_config["samples"] if samples is None else int(samples)
+        interval = self.history_config["interval"] if interval is None else float(interval)
+        if samples < 0 or interval < 0:
+            raise ValueError("samples e interval no pueden ser negativos.")
+        with self._register_lock:
+            if samples != self.history_config["samples"]: # Otro tamaño: los buffers se crean de nuevo
+                for unit in self._units.values():
+                    unit["history"] = None
+            self.history_config = {"samples": samples, "interval": interval}
+            self.log_service.log_info(f"Histórico: {samples} muestras por unidad, cada {interval:g} s como mínimo.")
+            return dict(self.history_config)
+
+    def get_history(self, unit_id=None, start=None, end=None, addresses=None, buckets=None, limit=MAX_HISTORY_ROWS):
+        """
+        Consulta del histórico de una unidad (la principal por defecto); None
+        si no lo tiene. Con el lock sólo se copian los arrays; las listas y
+        los buckets se construyen fuera. Sin `buckets`, como mucho `limit`
+        muestras. Ver RegisterHistory.copy()/summarize().
+        """
+        if buckets is not None and not (1 <= buckets <= MAX_BUCKETS):
+            raise ValueError(f"buckets fuera de rango (1-{MAX_BUCKETS}).")
+        if not (1 <= limit <= MAX_HISTORY_ROWS):
+            raise ValueError(f"limit fuera de rango (1-{MAX_HISTORY_ROWS}).")
+        with self._register_lock:
+            unit = self._units.get(self._registers["unit_id"] if unit_id is None else unit_id)
+            history = unit["history"] if unit else None
+            if history is None:
+                return None
+            copied = history.copy(start, end, addresses, None if buckets else limit)
+            stats = history.get_stats(); unit_id = unit["unit_id"]
+        return dict(RegisterHistory.summarize(*copied, start=start, end=end, buckets=buckets), unit_id=unit_id, stats=stats)
+
+    def get_history_stats(self):
+        with self._register_lock:
+            return {"config": dict(self.history_config), "units": {unit_id: unit["history"].get_stats() for unit_id, unit in self._units.items() if unit["history"]}}
+
+    def _filter_deltas(self, unit, changed, addresses):
+        """
+        [[dirección, valor], ...] que se emiten de las direcciones `changed`
+        (con el lock tomado): sólo las del mapa (no el relleno de huecos) y,
+        si tienen banda muerta, sólo si se alejan del último valor emitido
+        más que la banda (el mayor de absoluta y porcentaje de ese valor).
+        """
+        values = unit["image"].values; reported = unit["reported"]
+        own = self._deadbands.get(unit["unit_id"], {}); common = self._deadbands.get(DEFAULT_MAP, {})
+        deltas = []
+        for address in changed:
+            pos = bisect.bisect_left(addresses, address)
+            if pos == len(addresses) or addresses[pos] != address:
+                continue
+            value = values[address]
+            band = own.get(address) or common.get(address)
+            if band:
+                last = reported.get(address)
+                if last is not None and abs(value - last) <= max(band[0], band[1] * abs(last) / 100):
+                    continue
+                reported[address] = value
+            deltas.append([address, value])
+        return deltas
+
+    def set_deadband(self, spec, absolute=None, percent=None, unit_id=None):
+        """
+        Banda muerta de las direcciones `spec` (sueltas y/o rangos [start, count],
+        como el mapa): un cambio sólo se emite como delta si supera `absolute`
+        o `percent` % del último valor emitido. Sin ninguna de las dos (o a 0)
+        se quita. Con `unit_id` sólo para esa unidad (tiene preferencia sobre
+        la común).
+        """
+        with self._register_lock:
+            try:
+                addresses = ReadPlanner.normalize_addresses(spec)
+                absolute = float(absolute or 0); percent = float(percent or 0)
+                if absolute < 0 or percent < 0:
+                    raise ValueError("La banda muerta no puede ser negativa.")
+                key = DEFAULT_MAP if unit_id is None else int(unit_id)
+                bands = self._deadbands.setdefault(key, {})
+                if absolute or percent:
+                    bands.update(dict.fromkeys(addresses, (absolute, percent)))
+                else:
+                    for address in addresses:
+                        bands.pop(address, None)
+                if not bands:
+                    del self._deadbands[key]
+                for unit in self._units.values(): # Los cambios siguientes se comparan con el valor actual
+                    image = unit["image"]; reported = unit["reported"]
+                    for address in addresses:
+                        if image.is_valid(address): reported[address] = image.values[address]
+                        else: reported.pop(address, None)
+                scope = "común" if unit_id is None else f"de Unit {key}"
+                band = f"abs {absolute:g}, {percent:g} %" if absolute or percent else "sin banda"
+                message = f"Banda muerta {scope}: {len(addresses)} registros ({band})."
+                self.log_service.log_info(message)
+                return {"success": True, "message": message}
+            except (ValueError, TypeError) as e:
+                self.log_service.log_warning(f"Intento de configurar banda muerta con valores inválidos: {e}")
+                return {"success": False, "message": f"Valores inválidos: {e}"}
+
+    def get_deadbands(self, unit_id=None):
+        """[{"address", "absolute", "percent"}, ...] comunes o de `unit_id`, ordenadas por dirección."""
+        with self._register_lock:
+            bands = self._deadbands.get(DEFAULT_MAP if unit_id is None else unit_id, {})
+            return [{"address": address, "absolute": band[0], "percent": band[1]} for address, band in sorted(bands.items())]
+
+    def get_delta_cursor(self):
+        with self._register_lock:
+            return self._delta_cursor
+
+    def set_tags(self, definitions, unit_id=None):
+        """
+        Define (reemplaza) los tags tipados comunes o de `unit_id`: lista de
+        {"name", "address", "type", "byte_order", "word_order", "scale",
+        "offset", "bit", "bits"}. Se compilan aquí, una vez; lista vacía los quita.
+        """
+        try:
+            decoder = TagDecoder.from_definitions(definitions) if definitions else None
+        except (ValueError, TypeError) as e:
+            self.log_service.log_warning(f"Intento de definir tags inválidos: {e}")
+            return {"success": False, "message": f"Tags inválidos: {e}"}
+        key = DEFAULT_MAP if unit_id is None else int(unit_id)
+        with self._register_lock:
+            if decoder:
+                self._tag_decoders[key] = decoder
+            else:
+                self._tag_decoders.pop(key, None)
+        scope = "comunes" if unit_id is None else f"de Unit {key}"
+        message = f"Tags {scope}: {len(decoder.tags)} en {len(decoder.blocks)} bloques." if decoder else f"Tags {scope} eliminados."
+        self.log_service.log_info(message)
+        return {"success": True, "message": message}
+
+    def get_tags(self, unit_id=None):
+        """Definiciones de los tags que usa `unit_id` (los suyos o los comunes)."""
+        with self._register_lock:
+            decoder = self._tag_decoders.get(unit_id) if unit_id is not None else None
+            decoder = decoder or self._tag_decoders.get(DEFAULT_MAP)
+            return [tag.to_dict() for tag in decoder.tags] if decoder else []
+
+    def get_tag_values(self, unit_id=None):
+        """
+        {"unit_id", "last_update", "values": {nombre: valor}} decodificados de
+        la imagen de la unidad (la principal por defecto) con sus tags o los
+        comunes; None si no hay tags. Tags con registros aún no leídos: None.
+        """
+        with self._register_lock:
+            unit_id = self._registers["unit_id"] if unit_id is None else unit_id
+            decoder = self._tag_decoders.get(unit_id) or self._tag_decoders.get(DEFAULT_MAP)
+            if decoder is None:
+                return None
+            unit = self._units.get(unit_id)
+            if unit is None:
+                return {"unit_id": unit_id, "last_update": None, "values": dict.fromkeys((tag.name for tag in decoder.tags), None)}
+            image = unit["image"]
+            return {"unit_id": unit_id, "last_update": unit["last_update"], "values": decoder.decode(image.values, image.all_valid)}
+
+    def get_deltas(self, since, unit_id=None):
+        """
+        Deltas emitidos después del cursor `since`: {"cursor", "reset",
+        "events": [{"time", "unit_id", "changes": [[dirección, valor], ...]}]}.
+        Con "reset" el cursor es anterior al último cambio de vista (o ya no
+        se recuerda): hay que releer /api/registers (trae su "cursor").
+        """
+        with self._register_lock:
+            cursor = self._delta_cursor
+            if since < self._delta_base or since > cursor:
+                return {"cursor": cursor, "reset": True, "events": []}
+            events = []
+            for event_cursor, timestamp, event_unit, changes in reversed(self._deltas):
+                if event_cursor <= since:
+                    break
+                if unit_id is None or event_unit == unit_id:
+                    events.append({"time": timestamp, "unit_id": event_unit, "changes": changes})
+            events.reverse()
+            return {"cursor": cursor, "reset": False, "events": events}
+
+    def get_fresh_unit_values(self, unit_id, max_age):
+        """
+        (valores, edad en s) de la última lectura completa de la unidad si no
+        tiene más de `max_age` s; None si no la hay o es más antigua. Las
+        lecturas parciales (grupos) no cuentan: la edad es la del dato más viejo.
+        """
+        with self._register_lock:
+            unit = self._units.get(unit_id)
+            if not unit or unit["last_full_update"] is None or not self.read_planner.is_current(unit_id, unit["addresses"]):
+                return None
+            age = max(0.0, time.monotonic() - unit["last_full_update"])
+            return (unit["image"].read(unit["addresses"]), age) if age <= max_age else None
+
+    def get_write_epoch(self, unit_id):
+        """Contador de escrituras de la unidad (ver update_unit_blocks)."""
+        with self._register_lock:
+            return self._get_unit(unit_id)["write_epoch"]
+
+    def invalidate_unit(self, unit_id):
+        """
+        Tras escribir en la unidad sus valores leídos ya no sirven como cache
+        (se conservan para mostrarlos), tampoco los de una lectura en curso.
+        """
+        with self._register_lock:
+            unit = self._get_unit(unit_id)
+            unit["last_full_update"] = None; unit["write_epoch"] += 1
+
+    def record_unit_error(self, unit_id, message):
+        """Contabiliza un fallo de lectura de la unidad (el resto del bus no se ve afectado)."""
+        with self._register_lock:
+            unit = self._get_unit(unit_id)
+            unit["errors"] += 1; unit["consecutive_errors"] += 1
+            unit["last_error"] = message; unit["last_error_time"] = time.time()
+            return unit["consecutive_errors"]
+
+    def get_unit_data(self, unit_id):
+        """Últimos valores (alineados con su mapa) y contadores de una unidad (None si nunca se leyó)."""
+        with self._register_lock:
+            unit = self._units.get(unit_id)
+            if not unit:
+                return None
+            data = {key: value for key, value in unit.items() if key not in ("image", "reported", "history", "last_full_update", "write_epoch")}
+            data["values"] = unit["image"].read(unit["addresses"]); data["generation"] = unit["image"].generation; data["cursor"] = self._delta_cursor
+            return data
+
+    def get_units_summary(self):
+        """Contadores por unidad (sin valores)."""
+        with self._register_lock:
+            return [dict({key: value for key, value in unit.items() if key not in ("image", "reported", "history", "addresses", "last_full_update", "write_epoch")}, generation=unit["image"].generation)
+                    for unit in self._units.values()]
+
+    def forget_units(self, keep_unit_ids):
+        """Descarta los datos de unidades que ya no se atienden."""
+        with self._register_lock:
+            removed = [uid for uid in self._units if uid not in keep_unit_ids]
+            for unit_id in removed:
+                del self._units[unit_id]
+                if self._registers["unit_id"] == unit_id:
+                    self._registers["unit_id"] = None; self._registers["last_update"] = None
+            if removed:
+                self._reset_deltas()
+
+    def get_changes(self, unit_id, since_generation):
+        """
+        Valores del mapa de la unidad que cambiaron después de `since_generation`:
+        {"generation", "full", "changes": [[dirección, valor], ...]}. Con
+        "full" el registro de cambios no llegaba tan atrás (o la unidad se
+        limpió) y "changes" trae el mapa entero.
+        """
         with self._register_lock:
-            self._registers["values"] = new_values
-            self._registers["last_update"] = time.time()
-            # self.log_service.log_debug(f"Valores de registro actualizados: {new_values}") # Puede ser muy verboso
+            unit = self._units.get(unit_id)
+            if not unit:
+                return None
+            image = unit["image"]; addresses = unit["addresses"]
+            ranges = image.changes_since(since_generation)
+            if ranges is None:
+                return {"generation": image.generation, "full": True, "changes": [[addr, image.values[addr]] for addr in addresses]}
+            changes = []
+            for first, last in ranges: # Sólo las direcciones del mapa (no el relleno de huecos)
+                for pos in range(bisect.bisect_left(addresses, first), bisect.bisect_right(addresses, last)):
+                    changes.append([addresses[pos], image.values[addresses[pos]]])
+            return {"generation": image.generation, "full": False, "changes": changes}
 
     def get_register_data(self):
         """Devuelve los últimos datos de registros leídos y sus parámetros."""
         with self._register_lock:
-            # Devuelve una copia
-            return self._registers.copy()
+            # Devuelve una copia; los valores salen de la imagen de la unidad principal
+            data = self._registers.copy()
+            unit = self._units.get(self._registers["unit_id"])
+            fresh = unit is not None and self._registers["last_update"] is not None
+            if fresh and unit["addresses"] and unit["addresses"] is not self._registers["addresses"]: # La unidad principal tiene mapa propio
+                data["addresses"] = unit["addresses"]; data["start_addr"] = unit["addresses"][0]; data["count"] = len(unit["addresses"])
+            data["values"] = unit["image"].read(data["addresses"]) if fresh else []
+            data["generation"] = unit["image"].generation if unit else None
+            data["cursor"] = self._delta_cursor # Para seguir con get_deltas() desde esta vista
+            return data
 
     def clear_register_data(self):
         """Limpia los valores de registros almacenados."""
         with self._register_lock:
-            self._registers["values"] = []
             self._registers["last_update"] = None
+            for unit in self._units.values():
+                unit["image"].clear(); unit["reported"].clear(); unit["addresses"] = []; unit["last_update"] = unit["last_full_update"] = None
+            self._reset_deltas()
+            self._notify()
             self.log_service.log_info("Datos de registros limpiados.")
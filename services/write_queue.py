@@ -0,0 +1,162 @@
+# services/write_queue.py
+import threading
+import time
+from collections import deque
+from modbus_client.exceptions import ModbusIOException
+from modbus_client.protocol import MAX_WRITE_QUANTITY, MAX_RW_WRITE_QUANTITY
+from services.circuit_breaker import GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_NO_RESPONSE
+
+MAX_REJECTED = 100 # Escrituras rechazadas por el esclavo que se recuerdan (get_rejected)
+
+
+class WriteQueue:
+    """
+    Cola de escrituras pendientes por unidad, con coalescencia:
+    - Varias escrituras al mismo registro se fusionan (gana la última).
+    - Registros contiguos se agrupan en una sola escritura 0x10 (hasta 123).
+    - Un registro aislado se escribe con 0x06.
+    El PollingService además combina una escritura con una lectura del mismo
+    dispositivo en una única transacción 0x17 (ver take_run()).
+    """
+    def __init__(self, log_service):
+        self.log_service = log_service
+        self._pending = {} # unit_id -> {dirección: valor}
+        self._rejected = deque(maxlen=MAX_REJECTED) # Escrituras descartadas por una respuesta de excepción
+        self._lock = threading.Lock()
+
+    def queue_write(self, unit_id, starting_address, values):
+        """Encola valores a partir de `starting_address`. Devuelve el nº de registros pendientes de la unidad."""
+        values = [int(v) for v in values]
+        if not values:
+            raise ValueError("No hay valores que escribir.")
+        starting_address = int(starting_address)
+        if not (0 <= starting_address <= 65535) or starting_address + len(values) > 65536:
+            raise ValueError("Dirección de escritura fuera de rango (0-65535).")
+        for value in values:
+            if not (0 <= value <= 0xFFFF):
+                raise ValueError(f"Valor de registro fuera de rango (0-65535): {value}")
+        with self._lock:
+            pending = self._pending.setdefault(unit_id, {})
+            for offset, value in enumerate(values):
+                pending[starting_address + offset] = value # La última escritura gana
+            return len(pending)
+
+    def has_pending(self, unit_id=None):
+        with self._lock:
+            if unit_id is None:
+                return any(self._pending.values())
+            return bool(self._pending.get(unit_id))
+
+    def pending_units(self):
+        with self._lock:
+            return [unit_id for unit_id, pending in self._pending.items() if pending]
+
+    def get_pending(self):
+        """Copia de las escrituras pendientes: {unit_id: {dirección: valor}}."""
+        with self._lock:
+            return {unit_id: dict(pending) for unit_id, pending in self._pending.items() if pending}
+
+    @staticmethod
+    def build_runs(pending, max_quantity=MAX_WRITE_QUANTITY):
+        """Agrupa {dirección: valor} en tramos contiguos [(start, [valores])] de como máximo max_quantity."""
+        runs = []
+        run_start = None
+        run_values = []
+        for addr in sorted(pending):
+            if run_values and addr == run_start + len(run_values) and len(run_values) < max_quantity:
+                run_values.append(pending[addr])
+                continue
+            if run_values:
+                runs.append((run_start, run_values))
+            run_start = addr
+            run_values = [pending[addr]]
+        if run_values:
+            runs.append((run_start, run_values))
+        return runs
+
+    def take_runs(self, unit_id, max_quantity=MAX_WRITE_QUANTITY):
+        """Saca todas las escrituras pendientes de la unidad, ya agrupadas en tramos."""
+        with self._lock:
+            pending = self._pending.pop(unit_id, None)
+        return self.build_runs(pending, max_quantity) if pending else []
+
+    def take_run(self, unit_id, max_quantity=MAX_RW_WRITE_QUANTITY):
+        """
+        Saca un único tramo contiguo (el de menor dirección) de como máximo
+        max_quantity registros; pensado para ir en una transacción 0x17.
+        """
+        with self._lock:
+            pending = self._pending.get(unit_id)
+            if not pending:
+                return None
+            start, values = self.build_runs(pending, max_quantity)[0]
+            for offset in range(len(values)):
+                del pending[start + offset]
+            return start, values
+
+    def requeue(self, unit_id, starting_address, values):
+        """
+        Devuelve a la cola un tramo que no se pudo escribir, sin pisar valores
+        más nuevos encolados mientras tanto.
+        """
+        with self._lock:
+            pending = self._pending.setdefault(unit_id, {})
+            for offset, value in enumerate(values):
+                pending.setdefault(starting_address + offset, value)
+
+    def reject(self, unit_id, starting_address, values, error):
+        """
+        Descarta un tramo que el esclavo rechazó con una respuesta de excepción
+        (p.ej. 0x02 dirección ilegal, 0x03 valor ilegal): reintentarlo daría el
+        mismo error en cada ciclo. Se loguea y se guarda para get_rejected().
+        """
+        rejection = {"unit_id": unit_id, "address": starting_address, "values": list(values), "error_code": error.error_code, "message": str(error), "time": time.time()}
+        with self._lock:
+            self._rejected.append(rejection)
+        self.log_service.log_error(f"WriteQueue: Escritura rechazada por Unit {unit_id} (dirección {starting_address}, {len(values)} registros, código {error.error_code}): descartada.")
+        return rejection
+
+    def get_rejected(self):
+        with self._lock:
+            return list(self._rejected)
+
+    def flush(self, client, unit_id):
+        """
+        Escribe todas las escrituras pendientes de la unidad con el mínimo de
+        transacciones (0x06 para registros sueltos, 0x10 para tramos).
+        Un tramo rechazado con una respuesta de excepción se descarta (reject)
+        y se sigue con los demás (salvo 0x0A/0x0B: la unidad tras la pasarela
+        no respondió, se trata como error de transporte). Ante un error de transporte (conexión,
+        timeout, bus ocupado...) ese tramo y los siguientes vuelven a la cola y
+        se relanza la excepción. Devuelve (nº de transacciones, rechazos).
+        """
+        runs = self.take_runs(unit_id)
+        transactions = 0
+        rejected = []
+        for index, (start, values) in enumerate(runs):
+            try:
+                if len(values) == 1:
+                    client.write_register(unit_id, start, values[0])
+                else:
+                    client.write_registers(unit_id, start, values)
+                transactions += 1
+            except ModbusIOException as e:
+                if e.error_code in (None, GATEWAY_PATH_UNAVAILABLE, GATEWAY_TARGET_NO_RESPONSE): # La unidad no llegó a responder: se reintenta
+                    for retry_start, retry_values in runs[index:]:
+                        self.requeue(unit_id, retry_start, retry_values)
+                    raise
+                rejected.append(self.reject(unit_id, start, values, e))
+            except Exception:
+                for retry_start, retry_values in runs[index:]:
+                    self.requeue(unit_id, retry_start, retry_values)
+                raise
+        if transactions:
+            self.log_service.log_info(f"WriteQueue: {sum(len(v) for _, v in runs) - sum(len(r['values']) for r in rejected)} registros escritos en {transactions} transacciones (Unit: {unit_id}).")
+        return transactions, rejected
+
+    def clear(self, unit_id=None):
+        with self._lock:
+            if unit_id is None:
+                self._pending.clear()
+            else:
+                self._pending.pop(unit_id, None)
@@ -26,14 +26,15 @@ document.addEventListener('DOMContentLoaded', () => {
     const debugLogPre = document.getElementById('debug-log');
 
     // --- Estado y Configuración ---
-    let statusIntervalId = null;
-    let debugIntervalId = null;
-    let stopDebugTimeoutId = null;
-    const STATUS_POLL_INTERVAL = 1000;
-    const DEBUG_POLL_INTERVAL = 1500;
+    let eventSource = null; // Stream SSE (/api/events): el servidor empuja estado, registros y logs al cambiar
+    let lastStatus = null; // Último estado recibido (y cuándo) para refrescar uptime/keep-alive sin peticiones
+    let lastStatusAt = 0;
+    let liveFieldsIntervalId = null;
+    const LIVE_FIELDS_INTERVAL = 1000;
     const DEFAULT_PORT_TCP = 502;
     const DEFAULT_PORT_RTU = 2300;
-    const DEBUG_STOP_DELAY = 2500;
+    const DEBUG_MAX_CHUNKS = 300; // Bloques de texto (uno por evento) que se conservan en el visor
+    let debugLogCursor = 0; // Nº de secuencia de la última entrada recibida (cursor de logs)
 
     // --- Funciones de Utilidad ---
     function showMessage(element, message, isError = false, duration = 4000) { if (!element) return; element.textContent = message; element.className = isError ? 'message error-message' : 'message success-message'; if (duration > 0) { setTimeout(() => { if (element.textContent === message) { element.textContent = ''; element.className = 'message'; } }, duration); } }
@@ -43,6 +44,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // --- Actualización UI (CORREGIDA lógica de inputs) ---
     function updateUIFromStatus(status) {
         if (!status) return;
+        lastStatus = status; lastStatusAt = Date.now();
         const isConnected = status.connected; const isConnecting = status.is_connecting; const currentMode = status.mode || 'tcp';
 
         // Estado General
@@ -91,44 +93,54 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Lógica API ---
     async function apiFetch(url, options = {}) { /* ... (igual) ... */ try { const r=await fetch(url,options); if(!r.ok){let m=`Error ${r.status}: ${r.statusText}`; try{m=(await r.json()).message||m;}catch(e){} throw new Error(m);} return r.status===204?null:await r.json(); } catch(e){console.error(`API Error (${options.method||'GET'} ${url}):`,e); throw e;} }
-    async function fetchStatus() { try { const status = await apiFetch('/api/status'); updateUIFromStatus(status); } catch (e) { updateUIFromStatus({ connected: false, is_connecting: false, message: 'Error backend', last_error: e.message }); stopAllPolling(true); } }
-    async function fetchDataAndUpdateUI() { // Lee y actualiza tabla
-        const selectedFormat = formatSelect.value;
+    function renderRegisters(data) { // Tabla a partir del snapshot de registros (evento 'registers')
+        if (!data) return;
+        if (!lastStatus?.connected && !lastStatus?.is_connecting) return; // Desconectado: updateUIFromStatus ya muestra el mensaje
+        registersTableBody.innerHTML = ''; // Limpiar tabla
+        if (data.values?.length > 0) {
+             const startAddr = data.start_addr; data.values.forEach((value, index) => {
+                 const addr = data.addresses?.[index] ?? (startAddr + index); // Mapa disperso: dirección explícita
+                 const row = registersTableBody.insertRow(); row.insertCell().textContent = `${addr} (0x${addr.toString(16).toUpperCase()})`;
+                 const cellVal = row.insertCell(); cellVal.textContent = value;
+                 if (data.raw_values?.[index] !== undefined) cellVal.dataset.rawValue = data.raw_values[index]; });
+         } else if (!data.last_update) { registersTableBody.innerHTML = `<tr><td colspan="2">Sin lecturas todavía.</td></tr>`; }
+         else if (data.count > 0) { registersTableBody.innerHTML = `<tr><td colspan="2">Lectura OK, 0 valores recibidos.</td></tr>`; }
+         else { registersTableBody.innerHTML = `<tr><td colspan="2">Cantidad a leer es 0.</td></tr>`; }
+         lastUpdateTimeSpan.textContent = data.last_update ? new Date(data.last_update * 1000).toLocaleTimeString() : 'N/A';
+    }
+    async function fetchDataAndUpdateUI() { // Dispara una lectura; la tabla se actualiza con el evento 'registers'
         registersMessageDiv.textContent = "Leyendo..."; registersMessageDiv.className = "message"; readNowBtn.disabled = true; // Deshabilitar botón mientras lee
         try {
             const result = await apiFetch('/api/readnow', { method: 'POST' }); // Llama a leer
             showMessage(registersMessageDiv, result.message, !result.success); // Muestra resultado
-            if (result.success || result.data) { // Si lectura OK o devolvió datos (aunque sea [])
-                // Pedir los datos formateados (RegisterService los tiene ahora)
-                const data = await apiFetch(`/api/registers?format=${selectedFormat}`);
-                if (!data) return;
-                registersTableBody.innerHTML = ''; // Limpiar tabla
-                if (data.values?.length > 0) {
-                     const startAddr = data.start_addr; data.values.forEach((value, index) => {
-                         const row = registersTableBody.insertRow(); row.insertCell().textContent = `${startAddr + index} (0x${(startAddr + index).toString(16).toUpperCase()})`;
-                         const cellVal = row.insertCell(); cellVal.textContent = value;
-                         if (data.raw_values?.[index] !== undefined) cellVal.dataset.rawValue = data.raw_values[index]; });
-                 } else if (data.count > 0) { registersTableBody.innerHTML = `<tr><td colspan="2">Lectura OK, 0 valores recibidos.</td></tr>`; }
-                 else { registersTableBody.innerHTML = `<tr><td colspan="2">Cantidad a leer es 0.</td></tr>`; }
-                 lastUpdateTimeSpan.textContent = data.last_update ? new Date(data.last_update * 1000).toLocaleTimeString() : 'Ahora';
-            }
         } catch (error) { showMessage(registersMessageDiv, `Error lectura: ${error.message}`, true); }
         finally { readNowBtn.disabled = false; } // Rehabilitar botón
     }
-    async function fetchDebugLog() { /* ... (igual) ... */ if(debugLogContainer.classList.contains('hidden')) return; try { const d=await apiFetch('/api/debuglog'); if (!d?.logs) return; const st=debugLogPre.scrollTop; const sb=debugLogPre.scrollHeight-debugLogPre.clientHeight<=st+1; debugLogPre.textContent=d.logs.join('\n'); if(sb)debugLogPre.scrollTop=debugLogPre.scrollHeight; } catch(e){debugLogPre.textContent+=`\n--- Error logs: ${e.message} ---`;} }
+    function appendDebugLog(d) { if (!d?.logs) return; const st=debugLogPre.scrollTop; const sb=debugLogPre.scrollHeight-debugLogPre.clientHeight<=st+1; if (d.reset || debugLogCursor === 0) debugLogPre.textContent=''; debugLogCursor=d.cursor ?? debugLogCursor; if (d.logs.length) { debugLogPre.append((debugLogPre.firstChild ? '\n' : '') + d.logs.join('\n')); while (debugLogPre.childNodes.length > DEBUG_MAX_CHUNKS) debugLogPre.firstChild.remove(); } if(sb)debugLogPre.scrollTop=debugLogPre.scrollHeight; }
+    function refreshLiveFields() { // Uptime y antigüedad del keep-alive avanzan en local, sin pedir nada al servidor
+        if (!lastStatus?.connected) return;
+        connectionUptimeSpan.textContent = `(Activo: ${formatUptime((lastStatus.uptime_seconds || 0) + (Date.now() - lastStatusAt) / 1000)})`;
+        keepAliveStatusSpan.textContent = formatKeepAliveStatus(lastStatus.last_keep_alive_ok);
+    }
 
-    // --- Gestión Polling (Solo Status y Debug) ---
-    function startStatusPolling() { if (statusIntervalId) clearInterval(statusIntervalId); fetchStatus(); statusIntervalId = setInterval(fetchStatus, STATUS_POLL_INTERVAL); console.debug("Status polling started."); }
-    function stopStatusPolling() { if (statusIntervalId) { clearInterval(statusIntervalId); statusIntervalId = null; console.debug("Status polling stopped."); } }
-    function startDebugPollingIfNeeded() { if (stopDebugTimeoutId) { clearTimeout(stopDebugTimeoutId); stopDebugTimeoutId = null; console.debug("Debug stop timeout cancelled."); } if (debugIntervalId) return; if (!debugLogContainer.classList.contains('hidden') && (statusIntervalId || !disconnectBtn.disabled)) { fetchDebugLog(); debugIntervalId = setInterval(fetchDebugLog, DEBUG_POLL_INTERVAL); console.debug("Debug polling started."); } else { console.debug("Debug polling NOT started."); } }
-    function stopDebugPolling(immediate = false) { if (stopDebugTimeoutId) { clearTimeout(stopDebugTimeoutId); stopDebugTimeoutId = null; } if (!immediate && debugIntervalId) { console.debug(`Scheduling debug stop in ${DEBUG_STOP_DELAY}ms`); stopDebugTimeoutId = setTimeout(() => { if (debugIntervalId) { clearInterval(debugIntervalId); debugIntervalId = null; console.debug("Debug polling stopped (delayed)."); } stopDebugTimeoutId = null; }, DEBUG_STOP_DELAY); } else { if (debugIntervalId) { clearInterval(debugIntervalId); debugIntervalId = null; console.debug("Debug polling stopped (immediate)."); } } }
-    function stopAllPolling(stopDebugImmediate = false) { stopStatusPolling(); stopDebugPolling(stopDebugImmediate); console.debug("All polling stop requested."); }
+    // --- Stream de Eventos (SSE) ---
+    function openEventStream() { // (Re)abre el stream con los temas necesarios: logs sólo con el visor abierto
+        closeEventStream();
+        const topics = ['status', 'registers']; if (!debugLogContainer.classList.contains('hidden')) topics.push('log');
+        eventSource = new EventSource(`/api/events?topics=${topics.join(',')}&since=${debugLogCursor}&format=${formatSelect.value}`);
+        eventSource.addEventListener('status', (e) => updateUIFromStatus(JSON.parse(e.data)));
+        eventSource.addEventListener('registers', (e) => renderRegisters(JSON.parse(e.data)));
+        eventSource.addEventListener('log', (e) => appendDebugLog(JSON.parse(e.data)));
+        eventSource.onerror = () => { if (eventSource?.readyState !== EventSource.OPEN) updateUIFromStatus({ ...(lastStatus || {}), connected: false, is_connecting: false, message: 'Sin conexión con el backend (reintentando...)', last_error: 'Stream de eventos interrumpido' }); }; // EventSource reintenta solo
+        console.debug(`Event stream opened (${topics.join(',')}).`);
+    }
+    function closeEventStream() { if (eventSource) { eventSource.close(); eventSource = null; } }
 
     // --- Manejadores de Eventos ---
-    async function handleConnectClick() { /* ... (igual) ... */ const ip=ipInput.value.trim(); const port=portInput.value.trim(); const unit_id=unitIdInput.value.trim(); const mode=modeSelect.value; if(!ip||!port||unit_id===''){showMessage(connectionMessageDiv,'IP, Puerto y Unit ID requeridos.',true); return;} updateUIFromStatus({connected:false, is_connecting:true, message:'Iniciando conexión...', last_error:null, mode:mode}); startStatusPolling(); startDebugPollingIfNeeded(); try { const result = await apiFetch('/api/connect',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({ip,port,unit_id,mode}),}); showMessage(connectionMessageDiv, result.message, !result.success); /* La lectura inicial la dispara el monitor */ } catch(error){ showMessage(connectionMessageDiv,`Error: ${error.message}`,true,8000); updateUIFromStatus({connected:false,is_connecting:false,message:'Error crítico al conectar',last_error:error.message}); stopAllPolling(true);} }
-    async function handleDisconnectClick() { /* ... (igual, usa stopDebugPolling(false)) ... */ updateUIFromStatus({connected:false,is_connecting:false,message:'Desconectando...'}); stopStatusPolling(); stopDebugPolling(false); try { const result=await apiFetch('/api/disconnect',{method:'POST'}); showMessage(connectionMessageDiv,result.message,!result.success); } catch(error){showMessage(connectionMessageDiv,`Error: ${error.message}`,true);} finally { setTimeout(async ()=>{await fetchStatus();}, DEBUG_STOP_DELAY + 500); } }
+    async function handleConnectClick() { /* ... (igual) ... */ const ip=ipInput.value.trim(); const port=portInput.value.trim(); const unit_id=unitIdInput.value.trim(); const mode=modeSelect.value; if(!ip||!port||unit_id===''){showMessage(connectionMessageDiv,'IP, Puerto y Unit ID requeridos.',true); return;} updateUIFromStatus({connected:false, is_connecting:true, message:'Iniciando conexión...', last_error:null, mode:mode}); try { const result = await apiFetch('/api/connect',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({ip,port,unit_id,mode}),}); showMessage(connectionMessageDiv, result.message, !result.success); /* La lectura inicial la dispara el monitor */ } catch(error){ showMessage(connectionMessageDiv,`Error: ${error.message}`,true,8000); updateUIFromStatus({connected:false,is_connecting:false,message:'Error crítico al conectar',last_error:error.message});} }
+    async function handleDisconnectClick() { /* El estado final llega por el stream de eventos */ updateUIFromStatus({connected:false,is_connecting:false,message:'Desconectando...'}); try { const result=await apiFetch('/api/disconnect',{method:'POST'}); showMessage(connectionMessageDiv,result.message,!result.success); } catch(error){showMessage(connectionMessageDiv,`Error: ${error.message}`,true);} }
     async function handleUpdateParamsClick() { // Solo actualiza params
-        const status = await apiFetch('/api/status').catch(() => ({connected: false})); if (!status?.connected) { showMessage(registersMessageDiv, 'Debe estar conectado.', true); return; }
+        if (!lastStatus?.connected) { showMessage(registersMessageDiv, 'Debe estar conectado.', true); return; }
         const start_addr = startAddrInput.value; const count = regCountInput.value;
         registersMessageDiv.textContent = "Actualizando parámetros..."; registersMessageDiv.className = "message"; updateParamsBtn.disabled = true; // Deshabilitar mientras actualiza
         try { const result=await apiFetch('/api/update_params',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({start_addr,count}),}); showMessage(registersMessageDiv, result.message, !result.success); }
@@ -138,12 +150,12 @@ document.addEventListener('DOMContentLoaded', () => {
     async function handleReadNowClick() { // Llama a leer y actualizar UI
         await fetchDataAndUpdateUI();
     }
-    function handleToggleDebugClick() { debugLogContainer.classList.toggle('hidden'); toggleDebugBtn.textContent = debugLogContainer.classList.contains('hidden') ? 'Mostrar' : 'Ocultar'; if (!debugLogContainer.classList.contains('hidden')) { startDebugPollingIfNeeded(); } else { stopDebugPolling(true); } }
+    function handleToggleDebugClick() { debugLogContainer.classList.toggle('hidden'); toggleDebugBtn.textContent = debugLogContainer.classList.contains('hidden') ? 'Mostrar' : 'Ocultar'; openEventStream(); /* Con el visor oculto no se envían logs */ }
     function handleModeChange() { const mode = modeSelect.value; portInput.value = mode === 'tcp' ? DEFAULT_PORT_TCP : DEFAULT_PORT_RTU; }
 
     // --- Inicialización ---
-    function bindEventListeners() { connectBtn.addEventListener('click', handleConnectClick); disconnectBtn.addEventListener('click', handleDisconnectClick); updateParamsBtn.addEventListener('click', handleUpdateParamsClick); readNowBtn.addEventListener('click', handleReadNowClick); toggleDebugBtn.addEventListener('click', handleToggleDebugClick); modeSelect.addEventListener('change', handleModeChange); handleModeChange(); }
-    async function checkInitialState() { /* ... (igual, no inicia data polling) ... */ console.debug("Checking initial state..."); try { const status=await apiFetch('/api/status'); updateUIFromStatus(status); if(status.connected||status.is_connecting){ startStatusPolling(); startDebugPollingIfNeeded(); if(status.connected){ const regData=await apiFetch('/api/registers').catch(()=>({})); startAddrInput.value=regData.start_addr??0; regCountInput.value=regData.count??10; formatSelect.value=regData.format||'dec'; /* fetchDataAndUpdateUI(); // Opcional: leer al cargar si ya está conectado */ } } else { stopAllPolling(true); } } catch(error){ updateUIFromStatus({connected:false,is_connecting:false,message:"No se pudo obtener estado inicial.",last_error:error.message}); stopAllPolling(true); } }
+    function bindEventListeners() { connectBtn.addEventListener('click', handleConnectClick); disconnectBtn.addEventListener('click', handleDisconnectClick); updateParamsBtn.addEventListener('click', handleUpdateParamsClick); readNowBtn.addEventListener('click', handleReadNowClick); toggleDebugBtn.addEventListener('click', handleToggleDebugClick); modeSelect.addEventListener('change', handleModeChange); formatSelect.addEventListener('change', openEventStream); handleModeChange(); }
+    async function checkInitialState() { /* El primer evento del stream trae estado y registros */ console.debug("Checking initial state..."); try { const regData=await apiFetch('/api/registers'); startAddrInput.value=regData.start_addr??0; regCountInput.value=regData.count??10; formatSelect.value=regData.format||'dec'; } catch(error){ console.debug("Initial register params not available."); } openEventStream(); liveFieldsIntervalId = setInterval(refreshLiveFields, LIVE_FIELDS_INTERVAL); }
 
     bindEventListeners(); checkInitialState();
 
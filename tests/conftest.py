@@ -0,0 +1,17 @@
+import pytest
+
+
+class NullLog:
+    """Sustituto mínimo de LogService: guarda las entradas para poder comprobarlas."""
+    def __init__(self):
+        self.entries = []
+
+    def __getattr__(self, name):
+        if not name.startswith("log"):
+            raise AttributeError(name)
+        return lambda message, *args, **kwargs: self.entries.append((name, message % args if args else message))
+
+
+@pytest.fixture
+def log_service():
+    return NullLog()
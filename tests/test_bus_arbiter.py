@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from services.bus_arbiter import (ArbitratedClient, BusArbiter, BusBusyException, PRIORITY_CYCLIC, PRIORITY_KEEP_ALIVE,
+                                  PRIORITY_ON_DEMAND, PRIORITY_WRITE)
+
+
+def queue_waiters(arbiter, priorities, order):
+    """Encola una petición por prioridad (en ese orden de llegada); cada una anota su turno y libera."""
+    threads = []
+    for priority in priorities:
+        def waiter(priority=priority):
+            with arbiter.slot(priority, timeout=5):
+                order.append(priority)
+        thread = threading.Thread(target=waiter); thread.start(); threads.append(thread)
+        deadline = time.monotonic() + 2
+        while arbiter.get_stats()["queue_depth"] < len(threads): # Llegadas en orden conocido
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+    return threads
+
+
+def test_free_bus_is_granted_immediately():
+    arbiter = BusArbiter()
+    assert arbiter.acquire(PRIORITY_CYCLIC) == 0.0
+    assert arbiter.get_stats()["busy"]
+    arbiter.release()
+    assert not arbiter.get_stats()["busy"]
+
+
+def test_waiters_are_served_by_priority():
+    arbiter = BusArbiter(aging_seconds=1000)
+    arbiter.acquire(PRIORITY_CYCLIC)
+    order = []
+    threads = queue_waiters(arbiter, [PRIORITY_KEEP_ALIVE, PRIORITY_CYCLIC, PRIORITY_ON_DEMAND, PRIORITY_WRITE, PRIORITY_CYCLIC], order)
+    arbiter.release()
+    for thread in threads: thread.join(5)
+    assert order == [PRIORITY_WRITE, PRIORITY_ON_DEMAND, PRIORITY_CYCLIC, PRIORITY_CYCLIC, PRIORITY_KEEP_ALIVE]
+    assert arbiter.get_stats()["max_queue_depth"] == 5
+
+
+def test_aging_lets_a_long_waiter_overtake():
+    arbiter = BusArbiter(aging_seconds=0.02)
+    arbiter.acquire(PRIORITY_WRITE)
+    order = []
+    threads = queue_waiters(arbiter, [PRIORITY_KEEP_ALIVE], order)
+    time.sleep(0.15) # 3 clases de diferencia se recuperan en 0.06 s
+    threads += queue_waiters(arbiter, [PRIORITY_WRITE], order)
+    arbiter.release()
+    for thread in threads: thread.join(5)
+    assert order == [PRIORITY_KEEP_ALIVE, PRIORITY_WRITE]
+    assert arbiter.get_stats()["classes"]["keep_alive"]["aged_grants"] == 1
+
+
+def test_acquire_timeout_raises_bus_busy():
+    arbiter = BusArbiter()
+    arbiter.acquire(PRIORITY_WRITE)
+    with pytest.raises(BusBusyException):
+        arbiter.acquire(PRIORITY_CYCLIC, timeout=0.05)
+    stats = arbiter.get_stats()
+    assert stats["queue_depth"] == 0 and stats["classes"]["cyclic"]["timeouts"] == 1
+    arbiter.release()
+    assert arbiter.acquire(PRIORITY_CYCLIC, timeout=0.05) == 0.0 # El que se rindió no se queda con el turno
+
+
+class RecordingClient:
+    def __init__(self, pipelined, arbiter):
+        self._pipelined = pipelined; self._arbiter = arbiter
+        self.busy_during_call = []
+
+    def is_pipelined(self):
+        return self._pipelined
+
+    def read_holding_registers(self, unit_id, starting_address, quantity):
+        self.busy_during_call.append(self._arbiter.get_stats()["busy"])
+        return [0] * quantity
+
+
+def test_arbitrated_client_takes_one_slot_per_block():
+    arbiter = BusArbiter()
+    client = RecordingClient(False, arbiter)
+    arbitrated = ArbitratedClient(client, arbiter, PRIORITY_CYCLIC)
+    assert arbitrated.read_holding_register_blocks(1, [(0, 2), (10, 1)]) == [[0, 0], [0]]
+    assert client.busy_during_call == [True, True]
+    assert arbiter.get_stats()["classes"]["cyclic"]["granted"] == 2
+
+
+def test_pipelined_client_bypasses_arbiter():
+    arbiter = BusArbiter()
+    client = RecordingClient(True, arbiter)
+    ArbitratedClient(client, arbiter, PRIORITY_CYCLIC).read_holding_registers(1, 0, 1)
+    assert client.busy_during_call == [False]
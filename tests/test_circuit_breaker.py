@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from services.circuit_breaker import CircuitBreaker, BREAKER_CLOSED, BREAKER_OPEN, BREAKER_HALF_OPEN
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker(failure_threshold=3, backoff=0.05, max_backoff=0.2, jitter=0)
+
+
+def test_opens_after_threshold(breaker):
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+    assert not breaker.allow()
+    assert breaker.get_stats()["skipped"] == 1 and breaker.trips == 1
+
+
+def test_success_resets_failure_count(breaker):
+    breaker.record_failure(); breaker.record_failure()
+    assert not breaker.record_success()
+    assert not breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED
+
+
+def test_half_open_allows_a_single_probe(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == BREAKER_HALF_OPEN
+    assert not breaker.allow()
+    assert breaker.record_success() # Recuperación
+    assert breaker.state == BREAKER_CLOSED and breaker.allow()
+
+
+def test_failed_probe_doubles_backoff_up_to_max(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    for expected in (0.1, 0.2, 0.2):
+        breaker.retry_at = time.monotonic() # Sin esperar la espera real
+        assert breaker.allow()
+        assert not breaker.record_failure()
+        assert breaker.state == BREAKER_OPEN
+        assert breaker.backoff == pytest.approx(expected)
+    assert breaker.trips == 1 and breaker.probes == 3
+
+
+def test_released_probe_is_retried_next_cycle(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    breaker.retry_at = time.monotonic()
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == BREAKER_OPEN
+    assert breaker.retry_in() == 0.0
+    assert breaker.allow()
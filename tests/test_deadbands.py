@@ -0,0 +1,71 @@
+import pytest
+
+from services.register_service import RegisterService
+
+
+@pytest.fixture
+def service(log_service):
+    service = RegisterService(log_service)
+    service.update_register_map([100, 101, 102])
+    return service
+
+
+def read(service, values, unit_id=1):
+    """Simula una lectura completa del mapa de la unidad."""
+    addresses = service.get_read_plan(unit_id).addresses
+    assert service.update_unit_values(unit_id, values, addresses)
+
+
+def emitted(service, since):
+    return [change for event in service.get_deltas(since)["events"] for change in event["changes"]]
+
+
+def test_changes_without_deadband_are_all_emitted(service):
+    read(service, [10, 20, 30])
+    cursor = service.get_delta_cursor()
+    read(service, [11, 20, 31])
+    assert emitted(service, cursor) == [[100, 11], [102, 31]]
+
+
+def test_absolute_deadband_compares_with_last_emitted_value(service):
+    read(service, [100, 100, 100])
+    assert service.set_deadband([100], absolute=5)["success"]
+    cursor = service.get_delta_cursor()
+    read(service, [103, 100, 100]) # Dentro de la banda
+    read(service, [105, 100, 100]) # Justo en el borde: tampoco
+    assert emitted(service, cursor) == []
+    read(service, [106, 100, 100]) # Deriva acumulada respecto al último emitido (100)
+    assert emitted(service, cursor) == [[100, 106]]
+    cursor = service.get_delta_cursor()
+    read(service, [102, 100, 100])
+    assert emitted(service, cursor) == []
+
+
+def test_percent_deadband_uses_largest_band(service):
+    read(service, [1000, 0, 0])
+    service.set_deadband([100], absolute=5, percent=1)
+    cursor = service.get_delta_cursor()
+    read(service, [1010, 0, 0]) # 1 % de 1000
+    assert emitted(service, cursor) == []
+    read(service, [1011, 0, 0])
+    assert emitted(service, cursor) == [[100, 1011]]
+
+
+def test_unit_deadband_overrides_common(service):
+    read(service, [0, 0, 0], unit_id=1)
+    read(service, [0, 0, 0], unit_id=2)
+    service.set_deadband([101], absolute=10)
+    service.set_deadband([101], absolute=1, unit_id=2)
+    cursor = service.get_delta_cursor()
+    read(service, [0, 5, 0], unit_id=1)
+    read(service, [0, 5, 0], unit_id=2)
+    events = service.get_deltas(cursor)["events"]
+    assert [(event["unit_id"], event["changes"]) for event in events] == [(2, [[101, 5]])]
+
+
+def test_removing_deadband_and_invalid_values(service):
+    service.set_deadband([100, 101], absolute=3)
+    assert [band["address"] for band in service.get_deadbands()] == [100, 101]
+    service.set_deadband([100], absolute=0)
+    assert [band["address"] for band in service.get_deadbands()] == [101]
+    assert not service.set_deadband([100], absolute=-1)["success"]
@@ -0,0 +1,72 @@
+import socket
+import struct
+import threading
+
+from modbus_client.frame_cache import FrameCache
+from modbus_client.rtu_over_tcp_client import ModbusRtuOverTcpClient
+from modbus_client.tcp_client import ModbusTCPClient
+
+
+def test_frame_is_built_once_per_key():
+    cache = FrameCache()
+    builds = []
+    build = lambda: builds.append(1) or bytearray(b"frame")
+    first = cache.get((1, 3, 0, 10), build)
+    assert cache.get((1, 3, 0, 10), build) is first
+    assert len(builds) == 1 and len(cache) == 1
+    cache.get((1, 3, 0, 11), build)
+    assert len(builds) == 2
+
+
+def test_full_cache_is_emptied():
+    cache = FrameCache(max_entries=2)
+    for key in range(3):
+        cache.get(key, bytearray)
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_concurrent_builders_share_one_frame():
+    cache = FrameCache()
+    barrier = threading.Barrier(8)
+    frames = []
+    def worker():
+        barrier.wait()
+        frames.append(cache.get("k", lambda: bytearray(b"x")))
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert all(frame is frames[0] for frame in frames)
+
+
+def test_tcp_template_gets_a_fresh_tid_on_each_send():
+    client_sock, server_sock = socket.socketpair()
+    client = ModbusTCPClient()
+    client.sock = client_sock; client.is_connected = True
+    seen = []
+    def server():
+        for _ in range(3):
+            header = server_sock.recv(12)
+            tid, _, _, unit_id, _, _, quantity = struct.unpack(">HHHBBHH", header)
+            seen.append(tid)
+            body = struct.pack(f">BB{quantity}H", 3, 2 * quantity, *([tid] * quantity))
+            server_sock.sendall(struct.pack(">HHHB", tid, 0, len(body) + 1, unit_id) + body)
+    thread = threading.Thread(target=server); thread.start()
+    try:
+        template = client._build_modbus_frame(1, 3, 100, 2)
+        results = [client.read_holding_registers(1, 100, 2) for _ in range(3)]
+        thread.join(2)
+        assert client._build_modbus_frame(1, 3, 100, 2) is template # Plantilla reutilizada
+        assert seen == [1, 2, 3] # El TID se parchea en cada envío
+        assert results == [[1, 1], [2, 2], [3, 3]]
+        assert len(client._frame_cache) == 1
+    finally:
+        client.disconnect(); server_sock.close()
+
+
+def test_rtu_frame_is_cached_with_crc():
+    client = ModbusRtuOverTcpClient()
+    frame = client._build_rtu_frame(1, 3, 0, 10)
+    assert client._build_rtu_frame(1, 3, 0, 10) is frame
+    assert bytes(frame) == bytes.fromhex("01030000000ac5cd")
@@ -0,0 +1,108 @@
+import os
+import re
+import threading
+import time
+
+import pytest
+
+from services.history_store import HistoryStore, INDEX_STRIDE, RECORD
+
+
+@pytest.fixture
+def open_stores():
+    stores = []
+    yield stores
+    for store in stores:
+        store.close()
+
+
+def make_store(open_stores, directory, **kwargs):
+    store = HistoryStore(str(directory), **kwargs)
+    open_stores.append(store)
+    return store
+
+
+def test_query_uses_sparse_index_across_chunks(tmp_path, open_stores):
+    store = make_store(open_stores, tmp_path, segment_seconds=0)
+    base = time.time()
+    total = 3 * INDEX_STRIDE + 10
+    for i in range(total):
+        store.append(1, base + i, [[i % 100, i % 65536]])
+    assert store.flush()
+    start = base + 2 * INDEX_STRIDE + 5
+    result = store.query(start=start, end=start + 2)
+    assert [record[0] for record in result["records"]] == [start, start + 1, start + 2]
+    assert [record[3] for record in result["records"]] == [2 * INDEX_STRIDE + 5 + k for k in range(3)]
+    assert len(store.query()["records"]) == total
+    truncated = store.query(limit=5)
+    assert truncated["truncated"] and len(truncated["records"]) == 5
+
+
+def test_filters_by_unit_and_address(tmp_path, open_stores):
+    store = make_store(open_stores, tmp_path)
+    now = time.time()
+    store.append(1, now, [[10, 1], [11, 2]])
+    store.append(2, now + 1, [[10, 3]])
+    store.flush()
+    assert [record[1:] for record in store.query(unit_id=2)["records"]] == [[2, 10, 3]]
+    assert [record[1:] for record in store.query(addresses=[11])["records"]] == [[1, 11, 2]]
+
+
+def test_reopen_rebuilds_index_and_snapshot(tmp_path, open_stores):
+    store = make_store(open_stores, tmp_path)
+    now = time.time()
+    store.append(1, now, [[10, 1], [11, 2]])
+    store.append(1, now + 1, [[10, 5]])
+    store.close()
+    reopened = make_store(open_stores, tmp_path)
+    assert reopened.get_stats()["segments"][0]["records"] == 3
+    assert reopened.snapshot_at(now + 0.5) == {1: {10: 1, 11: 2}}
+    assert reopened.snapshot_at(now + 1, unit_id=1) == {1: {10: 5, 11: 2}}
+
+
+def test_rotation_writes_keyframes(tmp_path, open_stores):
+    store = make_store(open_stores, tmp_path, segment_bytes=RECORD.size)
+    now = time.time()
+    store.append(1, now, [[10, 1], [11, 2]]); store.flush()
+    store.append(1, now + 1, [[10, 3]]); store.flush()
+    assert len(store.get_stats()["segments"]) == 2
+    # El segundo segmento basta para reconstruir el estado
+    assert store.snapshot_at(now + 1) == {1: {10: 3, 11: 2}}
+    assert len(store.query()["records"]) == 3 # Los keyframes no son cambios
+
+
+def test_retention_by_size_removes_oldest_segments(tmp_path, open_stores):
+    store = make_store(open_stores, tmp_path, segment_bytes=RECORD.size, retention_bytes=3 * RECORD.size)
+    now = time.time()
+    for i in range(6):
+        store.append(1, now + i, [[10, i]]); store.flush()
+    stats = store.get_stats()
+    # La retención se aplica al rotar y nunca borra el segmento actual
+    assert stats["bytes"] - stats["segments"][-1]["bytes"] <= 3 * RECORD.size and stats["unremoved"] == 0
+    assert len(stats["segments"]) < 6
+    assert sorted(os.listdir(tmp_path)) == [segment["file"] for segment in stats["segments"]]
+    assert store.query()["records"][-1][3] == 5
+
+
+def test_retention_by_age(tmp_path, open_stores):
+    store = make_store(open_stores, tmp_path, segment_bytes=RECORD.size, retention_seconds=60)
+    now = time.time()
+    store.append(1, now - 3600, [[10, 1]]); store.flush()
+    store.append(1, now, [[10, 2]]); store.flush()
+    segments = store.get_stats()["segments"]
+    assert len(segments) == 1 and segments[0]["last_time"] == pytest.approx(now)
+
+
+def test_dropped_changes_are_all_accounted(tmp_path, open_stores, log_service):
+    store = make_store(open_stores, tmp_path, log_service=log_service)
+    store.max_pending = 2 # Casi todo se descarta mientras el escritor vacía el contador
+    now = time.time()
+    def producer():
+        for i in range(2000):
+            store.append(1, now, [[i % 50, i]])
+    threads = [threading.Thread(target=producer) for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    store.flush()
+    logged = sum(int(re.search(r"(\d+) cambios descartados", message).group(1)) for _, message in log_service.entries if "descartados" in message)
+    assert store.written + logged + store.dropped == 4 * 2000
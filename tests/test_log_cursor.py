@@ -0,0 +1,56 @@
+import pytest
+
+from services.log_service import LogService
+
+
+@pytest.fixture
+def logs():
+    service = LogService(level="DEBUG", console=False)
+    yield service
+    service.close()
+
+
+def messages(result):
+    return [line.split("] ", 2)[-1] for line in result["logs"]]
+
+
+def test_cursor_returns_only_new_entries(logs):
+    logs.log_info("uno"); logs.log_info("dos")
+    logs.flush()
+    first = logs.get_logs_since(0)
+    assert not first["reset"] and len(first["logs"]) == 2
+    logs.log_info("tres")
+    logs.flush()
+    second = logs.get_logs_since(first["cursor"])
+    assert not second["reset"] and len(second["logs"]) == 1 and second["logs"][0].endswith("tres")
+    assert logs.get_logs_since(second["cursor"]) == {"logs": [], "cursor": second["cursor"], "reset": False}
+
+
+def test_clear_invalidates_older_cursors(logs):
+    logs.log_info("antes")
+    logs.flush()
+    cursor = logs.get_logs_since(0)["cursor"]
+    logs.clear_logs()
+    logs.flush()
+    result = logs.get_logs_since(cursor)
+    assert result["reset"] # Hay que recargar la vista entera
+    assert len(result["logs"]) == 1 and result["logs"][0].endswith("Logs limpiados.")
+    assert not logs.get_logs_since(result["cursor"])["reset"]
+
+
+def test_cursor_from_the_future_resets(logs):
+    logs.log_info("x")
+    logs.flush()
+    result = logs.get_logs_since(10 ** 6) # p.ej. el servidor se reinició
+    assert result["reset"] and len(result["logs"]) == 1
+
+
+def test_level_and_layer_filters_do_not_move_cursor(logs):
+    logs.log_debug("detalle", layer="SOCKET")
+    logs.log_error("fallo", layer="MB_ERROR")
+    logs.flush()
+    errors = logs.get_logs_since(0, level="ERROR")
+    assert len(errors["logs"]) == 1 and "fallo" in errors["logs"][0]
+    sockets = logs.get_logs_since(0, layers=["SOCKET"])
+    assert len(sockets["logs"]) == 1 and "detalle" in sockets["logs"][0]
+    assert errors["cursor"] == sockets["cursor"] == logs.get_logs_since(0)["cursor"]
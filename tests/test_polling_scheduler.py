@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from services.polling_service import PollingService, OVERRUN_SKIP, OVERRUN_CATCH_UP, MAX_CATCH_UP
+from services.register_service import RegisterService
+
+
+@pytest.fixture
+def polling(log_service):
+    service = PollingService(log_service, None, RegisterService(log_service))
+    yield service
+    service.stop_polling()
+
+
+def live_entries(service):
+    """Entradas del heap que el planificador aún ejecutaría."""
+    with service._schedule_cond:
+        return [entry for entry in service._schedule if entry[2] == entry[3].generation and service._scan_groups.get(entry[3].name) is entry[3]]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Tiempo de espera agotado"
+        time.sleep(0.005)
+
+
+def test_set_interval_during_a_run_keeps_a_single_entry(polling):
+    started = threading.Event(); release = threading.Event()
+    def read_cycle(group, priority, verbose=False, max_age=None):
+        started.set()
+        release.wait(2) # Sólo bloquea la primera ejecución
+        return {"success": True, "message": "OK"}
+    polling._read_cycle = read_cycle
+    group = polling.set_scan_group("g", 0.05)
+    polling.start_polling()
+    assert started.wait(2)
+    assert polling.set_interval(1.0, "g") # Con el grupo en plena lectura
+    release.set()
+    wait_for(lambda: group.runs == 2) # La del cambio de periodo se dispara ya
+    time.sleep(0.05)
+    entries = live_entries(polling)
+    assert len(entries) == 1 and entries[0][3] is group
+    time.sleep(0.2)
+    assert group.runs == 2 # Sin copias: el siguiente disparo es dentro de 1 s
+
+
+def test_runs_follow_a_fixed_grid(polling):
+    deadlines = []
+    def read_cycle(group, priority, verbose=False, max_age=None):
+        deadlines.append(group.next_deadline)
+        time.sleep(0.02) # La duración de la lectura no desplaza la rejilla
+        return {"success": True, "message": "OK"}
+    polling._read_cycle = read_cycle
+    polling.set_scan_group("g", 0.05)
+    polling.start_polling()
+    wait_for(lambda: len(deadlines) >= 5)
+    polling.stop_polling()
+    steps = [later - earlier for earlier, later in zip(deadlines, deadlines[1:])]
+    assert steps == pytest.approx([0.05] * len(steps))
+
+
+@pytest.mark.parametrize("policy, finish, expected_deadline, skipped", [
+    (OVERRUN_SKIP, 12.5, 13.0, 2), # Ciclos perdidos (11 y 12) saltados: siguiente en la rejilla futura
+    (OVERRUN_CATCH_UP, 12.5, 11.0, 0), # Se ejecutan seguidos
+    (OVERRUN_CATCH_UP, 10.0 + MAX_CATCH_UP + 1.5, 10.0 + MAX_CATCH_UP + 2, MAX_CATCH_UP + 1), # Demasiado retraso: como skip
+    (OVERRUN_SKIP, 10.5, 11.0, 0), # Sin desbordamiento
+])
+def test_overrun_policies(polling, policy, finish, expected_deadline, skipped):
+    group = polling.set_scan_group("g", 1.0, policy=policy)
+    group.last_duration = finish - 10.0
+    polling._reschedule(group, 10.0, finish, group.generation, threading.Event())
+    assert group.next_deadline == expected_deadline
+    assert group.skipped == skipped
+    assert group.overruns == (1 if finish > 11.0 else 0)
+
+
+def test_stale_run_is_not_rescheduled(polling):
+    group = polling.set_scan_group("g", 1.0)
+    generation = group.generation
+    polling.set_interval(2.0, "g")
+    before = len(live_entries(polling))
+    polling._reschedule(group, 10.0, 10.5, generation, threading.Event())
+    assert len(live_entries(polling)) == before == 1
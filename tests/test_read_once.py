@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+from services.polling_service import PollingService
+from services.register_service import RegisterService
+
+
+class FakeClient:
+    """Cliente Modbus falso: cada registro vale su dirección + `offset`; con `gate` cada lectura espera a que se abra."""
+    def __init__(self):
+        self.reads = 0
+        self.units = []
+        self.offset = 0
+        self.on_read = None
+        self.gate = None
+        self.started = threading.Event()
+
+    def read_holding_register_blocks(self, unit_id, blocks):
+        self.reads += 1
+        self.units.append(unit_id)
+        self.started.set()
+        if self.on_read is not None:
+            self.on_read(unit_id)
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [[address + self.offset for address in range(start, start + count)] for start, count in blocks]
+
+
+class FakeConnection:
+    def __init__(self, client, unit_ids=(1,)):
+        self.client = client
+        self.unit_ids = list(unit_ids)
+
+    def get_connection_status(self):
+        return {"connected": True, "unit_id": self.unit_ids[0], "unit_ids": self.unit_ids}
+
+    def get_client(self, priority):
+        return self.client
+
+    def disconnect(self, initiated_by_polling=False):
+        pass
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def registers(log_service):
+    service = RegisterService(log_service)
+    service.update_register_map([0, 1, 2])
+    return service
+
+
+@pytest.fixture
+def polling(log_service, client, registers):
+    return PollingService(log_service, FakeConnection(client), registers)
+
+
+def test_read_once_reads_and_stores(polling, client):
+    result = polling.read_once()
+    assert result["success"] and result["data"] == [0, 1, 2]
+    assert result["joined"] == 0 and client.reads == 1
+
+
+def test_concurrent_requests_share_one_read(polling, client):
+    client.gate = threading.Event()
+    results = []
+    leader = threading.Thread(target=lambda: results.append(polling.read_once()))
+    leader.start()
+    assert client.started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(polling.read_once())) for _ in range(5)]
+    for thread in followers: thread.start()
+    deadline = time.monotonic() + 2
+    while polling._in_flight_read.joined < 5: # Todas esperando la lectura en curso
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    client.gate.set()
+    for thread in [leader] + followers: thread.join(5)
+    assert client.reads == 1 # Una sola lectura en el bus
+    assert len(results) == 6 and all(result["data"] == [0, 1, 2] for result in results)
+    assert sum(1 for result in results if result.get("shared")) == 5
+    assert polling._in_flight_read is None
+    assert polling.read_once()["joined"] == 0 and client.reads == 2 # Al terminar, la siguiente lanza otra
+
+
+def test_follower_gives_up_after_max_wait(polling, client):
+    client.gate = threading.Event()
+    leader = threading.Thread(target=polling.read_once)
+    leader.start()
+    assert client.started.wait(2)
+    result = polling.read_once(max_wait=0.05)
+    assert not result["success"] and "sin resultado" in result["message"]
+    client.gate.set(); leader.join(5)
+    assert client.reads == 1
+
+
+def test_fresh_values_are_served_from_cache(polling, client):
+    polling.read_once()
+    result = polling.read_once(max_age=10)
+    assert result["success"] and result["cached"] and result["data"] == [0, 1, 2]
+    assert 0 <= result["age"] <= 10
+    assert client.reads == 1 # Sin transacción en el bus
+
+
+def test_stale_or_invalidated_values_are_read_again(polling, client, registers):
+    polling.read_once()
+    time.sleep(0.02)
+    client.offset = 10
+    result = polling.read_once(max_age=0.01) # Más viejos que max_age
+    assert not result.get("cached") and result["data"] == [10, 11, 12] and client.reads == 2
+    registers.invalidate_unit(1) # p.ej. tras una escritura
+    assert not polling.read_once(max_age=10).get("cached") and client.reads == 3
+
+
+def test_write_during_read_does_not_refresh_cache(polling, client, registers):
+    client.on_read = registers.invalidate_unit # Escritura mientras la lectura está en vuelo
+    polling.read_once()
+    client.on_read = None
+    assert registers.get_fresh_unit_values(1, 10) is None
+    assert not polling.read_once(max_age=10).get("cached") and client.reads == 2
+    assert polling.read_once(max_age=10)["cached"] and client.reads == 2
+
+
+def test_partial_reads_do_not_count_as_fresh(registers):
+    registers.update_unit_blocks(1, [(0, 1)], [[7]], [0], complete=False)
+    assert registers.get_fresh_unit_values(1, 10) is None
+
+
+def test_only_stale_units_hit_the_bus(log_service, client, registers):
+    polling = PollingService(log_service, FakeConnection(client, unit_ids=(1, 2)), registers)
+    polling.read_once()
+    assert sorted(client.units) == [1, 2]
+    registers.invalidate_unit(2)
+    client.units.clear()
+    result = polling.read_once(max_age=10)
+    assert client.units == [2] # La unidad 1 sale de la cache
+    assert result["success"] and not result["cached"]
+    assert result["units"][1]["message"].startswith("Valores en cache") and result["units"][2]["age"] == 0.0
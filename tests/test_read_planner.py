@@ -0,0 +1,47 @@
+import pytest
+
+from services.read_planner import ReadPlanner, MAX_REGISTERS_PER_READ, DEFAULT_MAP
+
+
+def test_small_gaps_are_read_through():
+    assert ReadPlanner.build_blocks([0, 1, 5, 20, 21], gap_threshold=3) == [(0, 6), (20, 2)]
+    assert ReadPlanner.build_blocks([0, 5], gap_threshold=4) == [(0, 6)]
+    assert ReadPlanner.build_blocks([0, 6], gap_threshold=4) == [(0, 1), (6, 1)]
+
+
+def test_blocks_split_at_max_read_size():
+    addresses = list(range(300))
+    blocks = ReadPlanner.build_blocks(addresses, gap_threshold=10)
+    assert blocks == [(0, MAX_REGISTERS_PER_READ), (125, MAX_REGISTERS_PER_READ), (250, 50)]
+    # Un hueco rellenado tampoco puede pasar del límite
+    assert ReadPlanner.build_blocks([0, 124, 125], gap_threshold=200) == [(0, 125), (125, 1)]
+
+
+def test_normalize_accepts_ranges_and_dedups():
+    assert ReadPlanner.normalize_addresses([5, [1, 3], 2]) == [1, 2, 3, 5]
+    with pytest.raises(ValueError):
+        ReadPlanner.normalize_addresses([[65535, 2]])
+    with pytest.raises(ValueError):
+        ReadPlanner.normalize_addresses([[1, 2, 3]])
+
+
+def test_plan_scatter_maps_block_results_to_addresses():
+    planner = ReadPlanner(gap_threshold=2)
+    planner.set_register_map(DEFAULT_MAP, [10, 12, 40])
+    plan = planner.get_plan(1)
+    assert plan.blocks == [(10, 3), (40, 1)]
+    assert plan.scatter_dict([[100, 101, 102], [400]]) == {10: 100, 12: 102, 40: 400}
+    assert plan.wasted_registers() == 1
+
+
+def test_plans_are_cached_until_map_or_threshold_change():
+    planner = ReadPlanner(gap_threshold=0)
+    planner.set_register_map(DEFAULT_MAP, [1, 3])
+    plan = planner.get_plan(1)
+    assert planner.get_plan(1) is plan and planner.is_current(1, plan.addresses)
+    planner.set_register_map(1, [7])
+    assert planner.get_plan(1).blocks == [(7, 1)]
+    assert not planner.is_current(1, plan.addresses)
+    planner.set_gap_threshold(5)
+    assert planner.get_plan(2).blocks == [(1, 3)]
+    assert ReadPlanner().get_plan(1) is None
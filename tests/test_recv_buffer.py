@@ -0,0 +1,68 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from modbus_client.exceptions import ConnectionException
+from modbus_client.recv_buffer import RecvBuffer
+
+
+@pytest.fixture
+def pair():
+    left, right = socket.socketpair()
+    yield left, right
+    left.close(); right.close()
+
+
+def test_fill_collects_partial_sends(pair):
+    sender, receiver = pair
+    receiver.settimeout(2)
+    buffer = RecvBuffer(64)
+    def send_in_pieces():
+        for piece in (b"\x01", b"\x02\x03", b"\x04\x05\x06"):
+            sender.sendall(piece); time.sleep(0.01)
+    thread = threading.Thread(target=send_in_pieces); thread.start()
+    buffer.fill(receiver, 6)
+    thread.join()
+    assert bytes(buffer.consume(6)) == b"\x01\x02\x03\x04\x05\x06" and len(buffer) == 0
+
+
+def test_fill_keeps_extra_bytes_for_next_frame(pair):
+    sender, receiver = pair
+    buffer = RecvBuffer(64)
+    sender.sendall(b"abcdefgh")
+    buffer.fill(receiver, 3)
+    assert bytes(buffer.consume(3)) == b"abc"
+    buffer.fill(receiver, 5) # Ya está en el buffer: no vuelve a leer del socket
+    assert bytes(buffer.peek(5)) == b"defgh"
+    buffer.skip(100)
+    assert len(buffer) == 0
+
+
+def test_compaction_preserves_pending_bytes(pair):
+    sender, receiver = pair
+    buffer = RecvBuffer(8)
+    sender.sendall(b"0123456")
+    buffer.fill(receiver, 7)
+    buffer.consume(5) # Quedan "56" al final del buffer
+    sender.sendall(b"789abc")
+    buffer.fill(receiver, 8) # No cabe sin mover los pendientes al principio
+    assert bytes(buffer.consume(8)) == b"56789abc"
+
+
+def test_deadline_and_peer_close(pair):
+    sender, receiver = pair
+    buffer = RecvBuffer(16)
+    sender.sendall(b"\x01")
+    with pytest.raises(socket.timeout):
+        buffer.fill(receiver, 4, deadline=time.monotonic() + 0.05)
+    assert len(buffer) == 1 # Los bytes parciales se conservan
+    sender.close()
+    with pytest.raises(ConnectionException):
+        buffer.fill(receiver, 4)
+
+
+def test_request_larger_than_buffer_raises(pair):
+    with pytest.raises(ValueError):
+        RecvBuffer(4).fill(pair[1], 5)
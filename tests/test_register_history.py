@@ -0,0 +1,69 @@
+from array import array
+
+import pytest
+
+from services.register_history import RegisterHistory
+
+
+def image_with(values):
+    """Imagen de registros (array indexado por dirección) con {dirección: valor}."""
+    image = array('H', bytes(2 * 256))
+    for address, value in values.items():
+        image[address] = value
+    return image
+
+
+@pytest.fixture
+def history():
+    history = RegisterHistory([10, 11, 12, 20], capacity=4)
+    for t in range(1, 4):
+        history.append(float(t), image_with({10: t, 11: 10 * t, 12: 100 * t, 20: 7}))
+    return history
+
+
+def test_query_returns_columns_in_time_order(history):
+    result = history.query()
+    assert result["times"] == [1.0, 2.0, 3.0]
+    assert result["values"] == {10: [1, 2, 3], 11: [10, 20, 30], 12: [100, 200, 300], 20: [7, 7, 7]}
+    assert result["truncated"] is False
+
+
+def test_ring_overwrites_oldest_samples(history):
+    history.append(4.0, image_with({10: 4}))
+    history.append(5.0, image_with({10: 5}))
+    result = history.query(addresses=[10])
+    assert result["times"] == [2.0, 3.0, 4.0, 5.0]
+    assert result["values"] == {10: [2, 3, 4, 5]}
+    assert history.get_stats()["oldest"] == 2.0 and history.get_stats()["newest"] == 5.0
+
+
+def test_time_range_and_unknown_addresses(history):
+    result = history.query(start=2.0, end=2.5, addresses=[11, 999])
+    assert result["times"] == [2.0]
+    assert result["values"] == {11: [20]}
+
+
+def test_copy_limit_marks_truncated(history):
+    times, columns, truncated = history.copy(addresses=[10], limit=2)
+    assert truncated and times.tolist() == [1.0, 2.0]
+    assert RegisterHistory.summarize(times, columns, truncated)["values"] == {10: [1, 2]}
+
+
+def test_backwards_clock_keeps_timestamps_ordered(history):
+    history.append(0.5, image_with({10: 9}))
+    assert history.query()["times"] == [1.0, 2.0, 3.0, 3.0]
+
+
+def test_buckets_summarize_min_max_avg():
+    history = RegisterHistory([0], capacity=10)
+    for t, value in enumerate([1, 3, 5, 7]):
+        history.append(float(t), image_with({0: value}))
+    result = history.query(start=0.0, end=4.0, buckets=2)
+    assert result["times"] == [0.0, 2.0]
+    assert result["min"] == {0: [1, 5]} and result["max"] == {0: [3, 7]} and result["avg"] == {0: [2.0, 6.0]}
+
+
+def test_capacity_for_respects_memory_ceiling():
+    assert RegisterHistory.capacity_for(10, 100) == 100
+    assert RegisterHistory.capacity_for(10, 100, max_bytes=28 * 5) == 5
+    assert RegisterHistory.capacity_for(10, 100, max_bytes=1) == 1
@@ -0,0 +1,59 @@
+from array import array
+
+import pytest
+
+from services.register_image import RegisterImage, ADDRESS_SPACE
+
+
+def test_first_write_reports_every_address():
+    image = RegisterImage()
+    assert image.write_block(10, [0, 0, 5]) == [10, 11, 12]
+    assert image.all_valid(10, 13) and not image.all_valid(9, 13)
+
+
+def test_diff_reports_only_changed_registers():
+    image = RegisterImage()
+    image.write_block(100, list(range(64)))
+    new = list(range(64)); new[0] = 1000; new[17] ^= 0x8000; new[63] = 1
+    assert image.write_block(100, array('H', new)) == [100, 117, 163]
+    assert image.read([100, 117, 163]) == [1000, 17 ^ 0x8000, 1]
+
+
+def test_unchanged_block_is_a_no_op():
+    image = RegisterImage()
+    image.write_block(0, [1, 2, 3])
+    generation = image.generation
+    assert image.write_block(0, [1, 2, 3]) == []
+    assert image.generation == generation
+
+
+def test_partially_new_block_reports_new_addresses():
+    image = RegisterImage()
+    image.write_block(0, [1, 2])
+    assert image.write_block(0, [1, 2, 0, 0]) == [2, 3]
+
+
+def test_diff_helper_handles_high_bits():
+    old = array('H', [0, 0, 0]).tobytes()
+    new = array('H', [0x8000, 0, 0x0001]).tobytes()
+    assert RegisterImage._diff(50, old, new) == [50, 52]
+
+
+def test_dirty_tracking_and_changes_since():
+    image = RegisterImage()
+    image.write_block(0, [1, 2, 3])
+    assert image.take_dirty() == [0, 1, 2]
+    assert image.take_dirty() == []
+    generation = image.generation
+    image.write_block(0, [1, 9, 3])
+    image.write_block(500, [7])
+    assert image.take_dirty() == [1, 500]
+    assert image.changes_since(generation) == [[1, 1], [500, 500]]
+    assert image.changes_since(image.generation) == []
+    image.clear()
+    assert image.changes_since(generation) is None
+
+
+def test_block_outside_address_space_raises():
+    with pytest.raises(ValueError):
+        RegisterImage().write_block(ADDRESS_SPACE - 1, [1, 2])
@@ -0,0 +1,86 @@
+import pytest
+
+from modbus_client.rtt_estimator import RttEstimator, MAX_BACKOFF, SIZE_CLASS_BYTES, size_class, transfer_size
+
+
+def test_unknown_unit_uses_ceiling_then_link_estimate():
+    estimator = RttEstimator(floor=0.01, ceiling=5.0)
+    assert estimator.timeout(1) == 5.0
+    for _ in range(20):
+        estimator.record(1, 0.02)
+    assert estimator.timeout(1) < 0.1
+    assert estimator.timeout(2) == pytest.approx(estimator.timeout(1)) # Sin muestras propias: la del enlace
+
+
+def test_timeout_is_clamped_to_limits():
+    estimator = RttEstimator(floor=0.05, ceiling=1.0)
+    for _ in range(20):
+        estimator.record(1, 0.001)
+    assert estimator.timeout(1) == 0.05
+    for _ in range(20):
+        estimator.record(2, 3.0)
+    assert estimator.timeout(2) == 1.0
+
+
+def test_backoff_doubles_until_next_response():
+    estimator = RttEstimator(floor=0.001, ceiling=100.0)
+    for _ in range(20):
+        estimator.record(1, 0.1)
+    base = estimator.timeout(1)
+    estimator.record_timeout(1)
+    assert estimator.timeout(1) == pytest.approx(2 * base)
+    for _ in range(MAX_BACKOFF + 3):
+        estimator.record_timeout(1)
+    assert estimator.timeout(1) == pytest.approx(base * (1 << MAX_BACKOFF))
+    estimator.record(1, 0.1)
+    assert estimator.timeout(1) == pytest.approx(base, rel=0.2)
+
+
+def test_invalid_limits_raise():
+    with pytest.raises(ValueError):
+        RttEstimator(floor=2.0, ceiling=1.0)
+    estimator = RttEstimator()
+    with pytest.raises(ValueError):
+        estimator.set_limits(floor=0)
+
+
+def test_transfer_size_counts_expected_response():
+    read_125 = bytes([0x03, 0x00, 0x00, 0x00, 125])
+    assert transfer_size(read_125) == 5 + 2 + 250
+    write_single = bytes([0x06, 0x00, 0x01, 0x00, 0x05])
+    assert transfer_size(write_single) == 5 + 5
+    assert size_class(SIZE_CLASS_BYTES) == 0
+    assert size_class(SIZE_CLASS_BYTES + 1) == 1
+    assert size_class(2 * SIZE_CLASS_BYTES + 1) == 2
+
+
+def test_large_transfers_get_their_own_estimate():
+    estimator = RttEstimator(floor=0.001, ceiling=10.0)
+    for _ in range(20):
+        estimator.record(1, 0.02, size=10)
+    small = estimator.timeout(1, 10)
+    # Sin muestras grandes: parte de la clase pequeña doblando por clase
+    assert estimator.timeout(1, 260) == pytest.approx(small * (1 << size_class(260)))
+    for _ in range(20):
+        estimator.record(1, 0.5, size=260)
+    assert estimator.timeout(1, 260) > 0.5
+    assert estimator.timeout(1, 10) == pytest.approx(small) # Las lecturas cortas no se ven afectadas
+
+
+def test_single_dead_unit_never_declares_link_dead():
+    estimator = RttEstimator()
+    for unit_id in (1, 2, 3):
+        estimator.record(unit_id, 0.01)
+    assert not any(estimator.record_timeout(9) for _ in range(10))
+    assert estimator.is_responsive(1) and not estimator.is_responsive(9)
+
+
+def test_several_silent_units_declare_link_dead():
+    estimator = RttEstimator()
+    for unit_id in (1, 2, 3, 4):
+        estimator.record(unit_id, 0.01)
+    assert not estimator.record_timeout(1)
+    assert not estimator.record_timeout(2)
+    assert estimator.record_timeout(3)
+    estimator.record(4, 0.01) # Cualquier respuesta demuestra que el enlace vive
+    assert not estimator.record_timeout(1)
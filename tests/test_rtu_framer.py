@@ -0,0 +1,118 @@
+import asyncio
+import struct
+
+import pytest
+
+from modbus_client.async_client import AsyncModbusRtuOverTcpClient
+from modbus_client.exceptions import ModbusIOException, ModbusInvalidResponseException
+from modbus_client.protocol import ModbusProtocol
+from modbus_client.recv_buffer import RecvBuffer
+from modbus_client.rtu_framer import RtuFramer
+
+
+def read_frame(slave_id, values, function_code=0x03):
+    return ModbusProtocol.build_rtu_frame(slave_id, struct.pack(f">BB{len(values)}H", function_code, 2 * len(values), *values))
+
+
+def corrupt(frame):
+    return frame[:-1] + bytes([frame[-1] ^ 0xFF])
+
+
+@pytest.fixture
+def framer():
+    return RtuFramer(RecvBuffer())
+
+
+def feed(framer, data):
+    framer._rx_buffer.feed(data)
+    return framer.next_frame(1, 0x03)
+
+
+def test_noise_before_frame_is_skipped(framer):
+    frame = read_frame(1, [10, 20])
+    assert bytes(feed(framer, b"\x00\xff\x13" + frame)) == frame
+    assert framer.discarded_bytes == 3 and len(framer._rx_buffer) == 0
+
+
+def test_partial_frame_waits_for_more_bytes(framer):
+    frame = read_frame(1, [1, 2, 3])
+    assert feed(framer, frame[:4]) is None
+    assert len(framer._rx_buffer) == 4 # El candidato incompleto se conserva
+    assert bytes(feed(framer, frame[4:])) == frame
+
+
+def test_crc_error_resynchronizes_on_next_valid_frame(framer):
+    frame = read_frame(1, [7])
+    assert feed(framer, corrupt(frame)) is None
+    assert framer.corrupted and framer.crc_errors == 1
+    assert bytes(feed(framer, frame)) == frame # Reenvío íntegro tras el corrupto
+
+
+def test_foreign_frames_are_dropped_whole(framer):
+    other_slave = read_frame(2, [5, 5])
+    other_function = ModbusProtocol.build_rtu_frame(1, struct.pack(">BHH", 0x06, 1, 2))
+    frame = read_frame(1, [9])
+    assert bytes(feed(framer, other_slave + other_function + frame)) == frame
+    assert framer.discarded_frames == 2
+
+
+def test_exception_response_is_a_frame(framer):
+    frame = ModbusProtocol.build_rtu_frame(1, bytes([0x83, 0x02]))
+    assert bytes(feed(framer, frame)) == frame
+
+
+def test_reset_discards_leftovers(framer):
+    framer._rx_buffer.feed(b"\x01\x03")
+    framer.corrupted = True
+    framer.reset()
+    assert len(framer._rx_buffer) == 0 and not framer.corrupted
+
+
+# --- Cliente asyncio: mismo framer que el cliente con hilos ---
+
+def run_against(responses, requests):
+    """
+    Arranca un servidor asyncio que contesta a la petición i con responses[i]
+    (bytes tal cual: ruido, frames corruptos...) y ejecuta `requests(client)`.
+    """
+    async def main():
+        async def handle(reader, writer):
+            for response in responses:
+                await reader.readexactly(8) # Petición 0x03: 8 bytes
+                writer.write(response); await writer.drain()
+            await reader.read()
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        client = AsyncModbusRtuOverTcpClient()
+        await client.connect("127.0.0.1", server.sockets[0].getsockname()[1], timeout=2)
+        try:
+            return await requests(client)
+        finally:
+            await client.disconnect()
+            server.close()
+    return asyncio.run(main())
+
+
+def test_async_client_skips_noise_and_stays_aligned():
+    responses = [b"\xaa\xbb" + read_frame(1, [1, 2]), read_frame(1, [3, 4])]
+    async def requests(client):
+        return [await client.read_holding_registers(1, 0, 2), await client.read_holding_registers(1, 0, 2)]
+    assert run_against(responses, requests) == [[1, 2], [3, 4]]
+
+
+def test_async_client_crc_error_keeps_connection():
+    responses = [corrupt(read_frame(1, [1])), read_frame(1, [2])]
+    async def requests(client):
+        with pytest.raises(ModbusInvalidResponseException):
+            await client.read_holding_registers(1, 0, 1)
+        assert client.is_connected
+        return await client.read_holding_registers(1, 0, 1)
+    assert run_against(responses, requests) == [2]
+
+
+def test_async_client_raises_modbus_exception_response():
+    responses = [ModbusProtocol.build_rtu_frame(1, bytes([0x83, 0x02]))]
+    async def requests(client):
+        with pytest.raises(ModbusIOException) as error:
+            await client.read_holding_registers(1, 0, 1)
+        return error.value.error_code
+    assert run_against(responses, requests) == 0x02
@@ -0,0 +1,78 @@
+import struct
+from array import array
+
+import pytest
+
+from modbus_client.tag_decoder import Tag, TagDecoder
+
+
+def registers(data):
+    """Registros (big-endian, como llegan por Modbus) de los bytes `data`."""
+    return list(struct.unpack(f">{len(data) // 2}H", data))
+
+
+def image(start, values):
+    values_array = array('H', bytes(2 * 256))
+    values_array[start:start + len(values)] = array('H', values)
+    return values_array
+
+
+def decode(tag, values):
+    return TagDecoder([tag]).decode(image(tag.address, values))[tag.name]
+
+
+@pytest.mark.parametrize("byte_order, word_order, layout", [
+    ("big", "big", b"\x12\x34\x56\x78"), # ABCD
+    ("big", "little", b"\x56\x78\x12\x34"), # CDAB
+    ("little", "big", b"\x34\x12\x78\x56"), # BADC
+    ("little", "little", b"\x78\x56\x34\x12"), # DCBA
+])
+def test_uint32_byte_and_word_orders(byte_order, word_order, layout):
+    tag = Tag("v", 10, "uint32", byte_order=byte_order, word_order=word_order)
+    assert decode(tag, registers(layout)) == 0x12345678
+
+
+def test_float32_word_swapped():
+    high, low = registers(struct.pack(">f", 123.5))
+    assert decode(Tag("t", 0, "float32", word_order="little"), [low, high]) == 123.5
+    assert decode(Tag("t", 0, "float32"), [high, low]) == 123.5
+
+
+def test_int64_and_float64_big_endian():
+    assert decode(Tag("n", 0, "int64"), registers(struct.pack(">q", -2))) == -2
+    assert decode(Tag("d", 0, "float64"), registers(struct.pack(">d", -0.25))) == -0.25
+
+
+def test_int16_little_byte_order():
+    assert decode(Tag("s", 5, "int16"), [0xFFFE]) == -2
+    assert decode(Tag("s", 5, "int16", byte_order="little"), [0xFEFF]) == -2
+
+
+def test_bit_fields_and_bool():
+    assert decode(Tag("b", 0, "bool", bit=3), [0b1000]) is True
+    assert decode(Tag("b", 0, "bool", bit=2), [0b1000]) is False
+    assert decode(Tag("f", 0, "uint16", bit=4, bits=4), [0x0AB0]) == 0xB
+    assert decode(Tag("h", 0, "uint32", bit=16, bits=8), [0x0012, 0x3400]) == 0x12 # Bits del registro alto
+
+
+def test_scale_and_offset():
+    assert decode(Tag("temp", 0, "int16", scale=0.1, offset=-40), [650]) == pytest.approx(25.0)
+
+
+def test_non_finite_floats_and_unread_registers_are_none():
+    nan = registers(struct.pack(">f", float("nan")))
+    assert decode(Tag("x", 0, "float32"), nan) is None
+    decoder = TagDecoder([Tag("a", 0), Tag("b", 40)])
+    result = decoder.decode(image(0, [7]), is_valid=lambda start, end: end <= 1)
+    assert result == {"a": 7, "b": None}
+
+
+def test_definitions_are_validated():
+    decoder = TagDecoder.from_definitions([{"name": "a", "address": 0, "type": "uint32", "word_order": "little"}])
+    assert decoder.tags[0].to_dict()["word_order"] == "little"
+    with pytest.raises(ValueError):
+        Tag("x", 0, "float32", bit=1)
+    with pytest.raises(ValueError):
+        Tag("x", 0, "uint16", byte_order="middle")
+    with pytest.raises(ValueError):
+        TagDecoder([Tag("a", 0), Tag("a", 1)])
@@ -0,0 +1,174 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from modbus_client.exceptions import ConnectionException, ModbusTimeoutException
+from modbus_client.tcp_client import ModbusTCPClient
+
+
+def read_exactly(sock, num_bytes):
+    data = b""
+    while len(data) < num_bytes:
+        chunk = sock.recv(num_bytes - len(data))
+        if not chunk:
+            raise ConnectionError("cerrado")
+        data += chunk
+    return data
+
+
+def read_response(tid, unit_id, pdu):
+    """Respuesta MBAP a una lectura 0x03/0x04: el valor de cada registro es su dirección."""
+    function_code, address, quantity = struct.unpack(">BHH", pdu)
+    body = struct.pack(f">BB{quantity}H", function_code, 2 * quantity, *range(address, address + quantity))
+    return struct.pack(">HHHB", tid, 0, len(body) + 1, unit_id) + body
+
+
+class MbapServer:
+    """
+    Servidor Modbus TCP mínimo en localhost. `handler(conn, requests)` recibe
+    cada petición como (tid, unit_id, pdu) y responde lo que quiera por `conn`;
+    `requests` es la lista de las recibidas en esa conexión.
+    """
+    def __init__(self, handler):
+        self.handler = handler
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        self.connections = []
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        requests = []
+        try:
+            while True:
+                tid, _, length, unit_id = struct.unpack(">HHHB", read_exactly(conn, 7))
+                requests.append((tid, unit_id, read_exactly(conn, length - 1)))
+                self.handler(conn, requests)
+        except (ConnectionError, OSError):
+            pass
+
+    def close(self):
+        self.listener.close()
+        for conn in self.connections:
+            conn.close()
+
+
+def answer_each(conn, requests):
+    conn.sendall(read_response(*requests[-1]))
+
+
+@pytest.fixture
+def servers():
+    started = []
+    yield lambda handler: started.append(MbapServer(handler)) or started[-1]
+    for server in started:
+        server.close()
+
+
+def connected_client(server, pipeline_window=1):
+    client = ModbusTCPClient(pipeline_window=pipeline_window)
+    client.set_timeout_limits(floor=0.05, ceiling=0.5)
+    client.connect("127.0.0.1", server.port, timeout=2)
+    return client
+
+
+def test_pipelined_responses_are_dispatched_by_tid(servers):
+    window = 4
+    def reversed_batches(conn, requests): # Responde cada tanda completa en orden inverso
+        if len(requests) % window == 0:
+            conn.sendall(b"".join(read_response(*request) for request in reversed(requests[-window:])))
+    client = connected_client(servers(reversed_batches), pipeline_window=window)
+    try:
+        blocks = [(address, 3) for address in (0, 100, 200, 300, 400, 500, 600, 700)]
+        assert client.read_holding_register_blocks(1, blocks) == [list(range(address, address + 3)) for address, _ in blocks]
+        results = {}
+        def reader(address):
+            results[address] = client.read_holding_registers(1, address, 2)
+        threads = [threading.Thread(target=reader, args=(address,)) for address in (10, 20, 30, 40)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join(5)
+        assert results == {address: [address, address + 1] for address in (10, 20, 30, 40)}
+    finally:
+        client.disconnect()
+
+
+@pytest.mark.parametrize("pipeline_window", [1, 4])
+def test_late_response_is_discarded(servers, pipeline_window):
+    def slow_first(conn, requests):
+        if len(requests) == 1:
+            time.sleep(0.7) # Más que el techo del plazo: el cliente ya se rindió
+        conn.sendall(read_response(*requests[-1]))
+    client = connected_client(servers(slow_first), pipeline_window)
+    try:
+        with pytest.raises(ModbusTimeoutException):
+            client.read_holding_registers(1, 0, 2)
+        assert client.is_connected # Un timeout de una unidad no tira la conexión
+        # Llega primero la respuesta tardía (otro TID): se descarta y se entrega la nuestra
+        assert client.read_holding_registers(1, 50, 2) == [50, 51]
+    finally:
+        client.disconnect()
+
+
+class StalledSocket:
+    """Socket cuyo recv_into no vuelve hasta abrir `gate`; entonces se comporta como cerrado por el otro extremo."""
+    def __init__(self):
+        self.gate = threading.Event()
+
+    def recv_into(self, view):
+        self.gate.wait(5)
+        return 0
+
+    def settimeout(self, timeout): pass
+    def shutdown(self, how): pass
+    def close(self): pass
+
+
+def test_old_receiver_does_not_fail_transactions_of_new_connection(servers):
+    def slow(conn, requests):
+        time.sleep(0.2)
+        conn.sendall(read_response(*requests[-1]))
+    server = servers(slow)
+    client = ModbusTCPClient(pipeline_window=4)
+    client.set_timeout_limits(floor=0.05, ceiling=2.0)
+    old_sock = StalledSocket()
+    with client._client_lock: # Conexión anterior cuyo receptor aún no se ha enterado del cierre
+        client.sock = old_sock; client.is_connected = True
+        client._start_receiver(old_sock)
+    client.disconnect()
+    client.connect("127.0.0.1", server.port, timeout=2)
+    try:
+        result = {}
+        reader = threading.Thread(target=lambda: result.setdefault("values", client.read_holding_registers(1, 7, 1)))
+        reader.start()
+        time.sleep(0.05) # Transacción en vuelo en la conexión nueva
+        old_sock.gate.set() # El receptor viejo termina ahora
+        reader.join(5)
+        assert result == {"values": [7]}
+        assert client.is_connected
+    finally:
+        client.disconnect()
+
+
+def test_reconnect_starts_with_clean_state(servers):
+    client = connected_client(servers(answer_each), pipeline_window=4)
+    try:
+        assert client.read_holding_registers(1, 0, 1) == [0]
+        client.disconnect()
+        with pytest.raises(ConnectionException):
+            client.read_holding_registers(1, 0, 1)
+        client.connect("127.0.0.1", client.port, timeout=2)
+        assert client.transaction_id == 0
+        assert client.read_holding_registers(1, 5, 2) == [5, 6]
+    finally:
+        client.disconnect()
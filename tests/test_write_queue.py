@@ -0,0 +1,98 @@
+import pytest
+
+from modbus_client.exceptions import ConnectionException, ModbusIOException, ModbusTimeoutException
+from services.circuit_breaker import GATEWAY_TARGET_NO_RESPONSE
+from services.write_queue import WriteQueue
+
+
+class FakeClient:
+    """Registra las escrituras; `failures` {dirección inicial: excepción} hace fallar ese tramo."""
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.calls = []
+
+    def write_register(self, unit_id, address, value):
+        self._write("0x06", unit_id, address, [value])
+
+    def write_registers(self, unit_id, starting_address, values):
+        self._write("0x10", unit_id, starting_address, list(values))
+
+    def _write(self, function, unit_id, address, values):
+        self.calls.append((function, unit_id, address, values))
+        if address in self.failures:
+            raise self.failures[address]
+
+
+@pytest.fixture
+def write_queue(log_service):
+    return WriteQueue(log_service)
+
+
+def test_last_write_wins_and_contiguous_writes_coalesce(write_queue):
+    write_queue.queue_write(1, 10, [1, 2])
+    write_queue.queue_write(1, 12, [3])
+    write_queue.queue_write(1, 11, [20])
+    write_queue.queue_write(1, 50, [5])
+    assert write_queue.take_runs(1) == [(10, [1, 20, 3]), (50, [5])]
+    assert not write_queue.has_pending(1)
+
+
+def test_build_runs_splits_at_max_quantity():
+    runs = WriteQueue.build_runs({address: address for address in range(5)}, max_quantity=2)
+    assert runs == [(0, [0, 1]), (2, [2, 3]), (4, [4])]
+
+
+def test_take_run_returns_lowest_run_only(write_queue):
+    write_queue.queue_write(1, 100, [1, 2, 3])
+    write_queue.queue_write(1, 5, [9])
+    assert write_queue.take_run(1) == (5, [9])
+    assert write_queue.get_pending() == {1: {100: 1, 101: 2, 102: 3}}
+
+
+def test_queue_write_validates_values(write_queue):
+    with pytest.raises(ValueError):
+        write_queue.queue_write(1, 0, [])
+    with pytest.raises(ValueError):
+        write_queue.queue_write(1, 65535, [1, 2])
+    with pytest.raises(ValueError):
+        write_queue.queue_write(1, 0, [0x10000])
+
+
+def test_requeue_keeps_newer_values(write_queue):
+    write_queue.queue_write(1, 1, [99])
+    write_queue.requeue(1, 0, [7, 8, 9])
+    assert write_queue.get_pending() == {1: {0: 7, 1: 99, 2: 9}}
+
+
+def test_flush_uses_single_and_multiple_writes(write_queue):
+    write_queue.queue_write(1, 0, [1, 2])
+    write_queue.queue_write(1, 10, [3])
+    client = FakeClient()
+    assert write_queue.flush(client, 1) == (2, [])
+    assert client.calls == [("0x10", 1, 0, [1, 2]), ("0x06", 1, 10, [3])]
+
+
+@pytest.mark.parametrize("error", [ConnectionException("caída"), ModbusTimeoutException("sin respuesta"),
+                                   ModbusIOException("pasarela", GATEWAY_TARGET_NO_RESPONSE)])
+def test_flush_requeues_on_transport_errors(write_queue, error):
+    write_queue.queue_write(1, 0, [1])
+    write_queue.queue_write(1, 10, [2])
+    write_queue.queue_write(1, 20, [3])
+    client = FakeClient({10: error})
+    with pytest.raises(type(error)):
+        write_queue.flush(client, 1)
+    assert write_queue.get_pending() == {1: {10: 2, 20: 3}} # El tramo que falló y los siguientes
+    assert write_queue.get_rejected() == []
+
+
+def test_flush_drops_runs_rejected_with_exception_code(write_queue):
+    write_queue.queue_write(1, 0, [1])
+    write_queue.queue_write(1, 10, [2, 3])
+    write_queue.queue_write(1, 20, [4])
+    client = FakeClient({10: ModbusIOException("dirección ilegal", 0x02)})
+    transactions, rejected = write_queue.flush(client, 1)
+    assert transactions == 2
+    assert [(r["unit_id"], r["address"], r["values"], r["error_code"]) for r in rejected] == [(1, 10, [2, 3], 0x02)]
+    assert not write_queue.has_pending(1) # No vuelve a la cola: fallaría en cada ciclo
+    assert write_queue.get_rejected() == rejected
+    assert [call[2] for call in client.calls] == [0, 10, 20]